@@ -1,32 +1,462 @@
-from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, Depends, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
+import sys
 import logging
+import queue
+import threading
+import random
+import time
+import functools
+from array import array
+from collections import OrderedDict, deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError, validator
+from typing import List, Optional, Dict, Any, AsyncIterator, Callable, Tuple, Type
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import asyncio
 import secrets
+import socket
 from cryptography.fernet import Fernet
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError, PhoneCodeExpiredError, PasswordHashInvalidError
-from telethon.sessions import StringSession
+from telethon.errors import (
+    FloodWaitError, SlowModeWaitError, ChatWriteForbiddenError, UserBannedInChannelError, ChannelPrivateError,
+    ChatAdminRequiredError, UsernameNotOccupiedError, UsernameInvalidError, InviteHashExpiredError,
+    InviteHashInvalidError, RPCError
+)
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, StringSession
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.messages import CheckChatInviteRequest
+from telethon.tl.types import (
+    Channel, Chat, ChatInviteAlready, InputPeerChannel, InputPeerChat, InputPeerUser, PeerChannel, PeerChat, PeerUser
+)
+from telethon.extensions import markdown
+from telethon.tl import types as tl_types
+from telethon.tl.tlobject import TLObject
+from telethon.utils import get_peer_id, resolve_id, split_text
 import base64
 import re
+import math
+import numpy as np
+import csv
+import io
+import zlib
+import zipfile
+import tempfile
+import tracemalloc
+import resource
+import argparse
+import ipaddress
+import bisect
+from bson import decode_file_iter
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ========================== LOGGING ==========================
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_SEND_BURST = int(os.environ.get('LOG_SEND_BURST', '20'))  # per-send lines let through each second
+LOG_SEND_SAMPLE_EVERY = int(os.environ.get('LOG_SEND_SAMPLE_EVERY', '100'))  # 1-in-N once the burst is used up
+
+# Correlation ids attached to every record emitted while they are set
+request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+cycle_id_var: ContextVar[Optional[str]] = ContextVar('cycle_id', default=None)
+
+_STANDARD_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+class JsonLogFormatter(logging.Formatter):
+    """Render log records as single-line JSON objects"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        # Context ids and anything passed through ``extra=``
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS and value is not None:
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+class ContextQueueHandler(QueueHandler):
+    """Queue handler that stamps context ids and leaves formatting to the listener thread
+
+    The stock ``prepare`` renders the message on the calling thread so records
+    can be pickled; the queue here is in-process, so the event loop only pays
+    for building the record and the enqueue.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        record.cycle_id = cycle_id_var.get()
+        return record
+
+class HotPathLogFilter(logging.Filter):
+    """Rate-limit and sample high-volume log lines such as per-send records
+
+    Warnings and errors always pass. Below that, the first ``burst`` records of
+    every one-second window pass, then only one in ``sample_every``.
+    """
+
+    def __init__(self, burst: int, sample_every: int):
+        super().__init__()
+        self.burst = burst
+        self.sample_every = max(1, sample_every)
+        self.suppressed = 0
+        self._window = 0
+        self._count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        window = int(record.created)
+        if window != self._window:
+            self._window = window
+            self._count = 0
+        self._count += 1
+        if self._count <= self.burst or self._count % self.sample_every == 0:
+            return True
+        self.suppressed += 1
+        return False
+
+def configure_logging() -> QueueListener:
+    """Route all logging through an in-process queue so handler I/O runs off the event loop"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(ContextQueueHandler(log_queue))
+    root_logger.setLevel(LOG_LEVEL)
+
+    # uvicorn configures its loggers, each with a stream handler, before importing the app; the access log is the busiest
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        for handler in list(uvicorn_logger.handlers):
+            uvicorn_logger.removeHandler(handler)
+        uvicorn_logger.propagate = True
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = configure_logging()
+logger = logging.getLogger(__name__)
+
+# Per-send lines go through their own logger so they can be sampled without touching the rest
+send_logger = logging.getLogger(f"{__name__}.send")
+send_logger.addFilter(HotPathLogFilter(LOG_SEND_BURST, LOG_SEND_SAMPLE_EVERY))
+
+# ========================== TRACING ==========================
+
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'true').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))  # fraction of traces kept
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '1000'))  # traces slower than this are always kept
+TRACE_FILE = Path(os.environ.get('TRACE_FILE', str(ROOT_DIR / 'traces' / 'traces.ndjson')))
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', str(20 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.environ.get('TRACE_BACKUP_COUNT', '5'))
+TRACE_MAX_SPANS = 512  # per trace, to bound memory on long engine runs
+
+SERVICE_NAME = "telegram-automation"
+
+class Trace:
+    """Spans collected for one request or engine send until the root span ends"""
+    __slots__ = ('trace_id', 'spans', 'dropped_spans')
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List['Span'] = []
+        self.dropped_spans = 0
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_span_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, trace: Trace, name: str, kind: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+current_span_var: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+@contextmanager
+def trace_span(name: str, kind: str = 'INTERNAL', root: bool = False, **attributes):
+    """Open a span as a child of the current one
+
+    Outside of a trace this is a no-op (yields ``None``) unless ``root`` is
+    set, in which case a new trace is started and handed to the exporter when
+    the span closes, subject to sampling. A parent that has already ended
+    (inherited by a task that outlived its request) counts as no parent.
+    """
+    parent = current_span_var.get()
+    if parent is not None and parent.end_ns:
+        parent = None
+    if not TRACE_ENABLED or (parent is None and not root):
+        yield None
+        return
+
+    trace = Trace() if root or parent is None else parent.trace
+    span = Span(trace, name, kind, None if root else parent, attributes)
+    token = current_span_var.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        current_span_var.reset(token)
+        if len(trace.spans) < TRACE_MAX_SPANS:
+            trace.spans.append(span)
+        else:
+            trace.dropped_spans += 1
+        if span.parent_span_id is None:
+            _finish_trace(span)
+
+def _finish_trace(root_span: Span):
+    """Tail-sample a finished trace: keep a random fraction plus every slow or failed one"""
+    keep = (
+        root_span.error is not None
+        or root_span.duration_ms >= TRACE_SLOW_MS
+        or random.random() < TRACE_SAMPLE_RATE
+    )
+    if keep:
+        # Serialisation happens on the exporter thread
+        trace_logger.info("%s", root_span.trace)
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+class OtlpTraceFormatter(logging.Formatter):
+    """Render a Trace as one OTLP/JSON ``resourceSpans`` line (OpenTelemetry file exporter shape)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        trace: Trace = record.args[0] if isinstance(record.args, tuple) else record.args
+        spans = []
+        for span in trace.spans:
+            attributes = [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items() if v is not None]
+            spans.append({
+                'traceId': trace.trace_id,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_span_id or '',
+                'name': span.name,
+                'kind': f'SPAN_KIND_{span.kind}',
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': attributes,
+                'status': {'code': 'STATUS_CODE_ERROR', 'message': span.error} if span.error else {'code': 'STATUS_CODE_UNSET'},
+            })
+        return json.dumps({
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                    {'key': 'telemetry.dropped_spans', 'value': {'intValue': str(trace.dropped_spans)}},
+                ]},
+                'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+            }]
+        })
+
+def configure_trace_export() -> Optional[QueueListener]:
+    """Write sampled traces to a rotating NDJSON file from a background thread"""
+    if not TRACE_ENABLED:
+        return None
+    TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    file_handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT)
+    file_handler.setFormatter(OtlpTraceFormatter())
+
+    trace_queue: queue.SimpleQueue = queue.SimpleQueue()
+    trace_logger.addHandler(ContextQueueHandler(trace_queue))
+    listener = QueueListener(trace_queue, file_handler)
+    listener.start()
+    return listener
+
+trace_logger = logging.getLogger(f"{__name__}.traces")
+trace_logger.propagate = False
+trace_logger.setLevel(logging.INFO)
+trace_listener = configure_trace_export()
+
+class TracedCursor:
+    """Motor cursor wrapper that traces ``to_list``; chained cursor methods keep the wrapper"""
+
+    def __init__(self, cursor, collection_name: str, operation: str):
+        self._cursor = cursor
+        self._collection_name = collection_name
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+    def __aiter__(self):
+        return self._cursor.__aiter__()
+
+    async def to_list(self, length: Optional[int] = None):
+        with trace_span(f"mongo.{self._operation}", kind='CLIENT', **{
+            'db.system': 'mongodb', 'db.mongodb.collection': self._collection_name, 'db.operation': self._operation,
+        }) as span:
+            documents = await self._cursor.to_list(length)
+            if span:
+                span.set_attribute('db.documents_returned', len(documents))
+            return documents
+
+# Called with the collection name after every write made through ``db``
+collection_write_listeners: List[Callable[[str], None]] = []
+
+class TracedCollection:
+    """Motor collection wrapper that opens a CLIENT span around every awaited operation"""
+
+    _TRACED_METHODS = frozenset({
+        'find_one', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete',
+        'insert_one', 'insert_many', 'replace_one', 'update_one', 'update_many',
+        'delete_one', 'delete_many', 'bulk_write', 'count_documents', 'estimated_document_count',
+        'distinct', 'create_index', 'drop_index',
+    })
+    _CURSOR_METHODS = frozenset({'find', 'aggregate'})
+    _WRITE_METHODS = frozenset({
+        'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete', 'insert_one', 'insert_many',
+        'replace_one', 'update_one', 'update_many', 'delete_one', 'delete_many', 'bulk_write',
+    })
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in self._TRACED_METHODS:
+            return functools.partial(self._traced_call, name, attr)
+        if name in self._CURSOR_METHODS:
+            return functools.partial(self._traced_cursor, name, attr)
+        return attr
+
+    async def _traced_call(self, operation: str, method, *args, **kwargs):
+        try:
+            if current_span_var.get() is None:
+                return await method(*args, **kwargs)
+            with trace_span(f"mongo.{operation}", kind='CLIENT', **{
+                'db.system': 'mongodb', 'db.mongodb.collection': self._collection.name, 'db.operation': operation,
+            }):
+                return await method(*args, **kwargs)
+        finally:
+            # Partially applied bulk writes count too
+            if operation in self._WRITE_METHODS:
+                for listener in collection_write_listeners:
+                    listener(self._collection.name)
+
+    def _traced_cursor(self, operation: str, method, *args, **kwargs):
+        return TracedCursor(method(*args, **kwargs), self._collection.name, operation)
+
+class TracedDatabase:
+    """Motor database wrapper handing out traced collections"""
+
+    def __init__(self, database):
+        self._database = database
+        self._collections: Dict[str, TracedCollection] = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if isinstance(attr, AsyncIOMotorCollection):
+            if name not in self._collections:
+                self._collections[name] = TracedCollection(attr)
+            return self._collections[name]
+        return attr
+
+    def __getitem__(self, name: str) -> TracedCollection:
+        return self.__getattr__(name)
+
+    def get_collection(self, name: str, **kwargs) -> TracedCollection:
+        return TracedCollection(self._database.get_collection(name, **kwargs))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))  # connections per server, per worker
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))  # kept open while idle
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '0'))  # 0 keeps idle connections
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0'))  # 0 waits for a free connection
+mongo_client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS or None,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS or None,
+)
+db = TracedDatabase(mongo_client[os.environ['DB_NAME']])
+
+# Reads that tolerate bounded staleness can be routed to secondaries, one read preference per route
+# (MONGO_READ_PREFERENCE_BROWSE etc.); auth, config and engine reads always go through ``db``, the primary
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90'))  # MongoDB's minimum is 90
+READ_ROUTES = ("browse", "export", "stats")  # list endpoints; exports; send statistics
+READ_PREFERENCE_MODES = {
+    "primary": Primary, "primaryPreferred": PrimaryPreferred, "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred, "nearest": Nearest,
+}
+
+def _read_preference(mode: str):
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown read preference {mode!r}, expected one of {', '.join(READ_PREFERENCE_MODES)}")
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCE_MODES[mode](max_staleness=MONGO_MAX_STALENESS_SECONDS)
+
+read_db: Dict[str, TracedDatabase] = {
+    route: TracedDatabase(mongo_client[os.environ['DB_NAME']].with_options(
+        read_preference=_read_preference(os.environ.get(f'MONGO_READ_PREFERENCE_{route.upper()}', 'primary'))
+    ))
+    for route in READ_ROUTES
+}
 
 # Encryption setup
 encryption_key = os.environ.get('ENCRYPTION_KEY', Fernet.generate_key().decode())
@@ -40,6 +470,7 @@ api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer(auto_error=False)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
 
 # Global variable to store active telegram clients
 telegram_clients: Dict[str, TelegramClient] = {}
@@ -82,11 +513,33 @@ class AuthRequest(BaseModel):
 class TwoFactorAuth(BaseModel):
     password: str
 
+class AuthJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    operation: str  # "send_code", "verify_code" or "verify_2fa"
+    status: str = "pending"  # "pending", "running", "succeeded" or "failed"
+    progress: List[str] = []
+    result: Optional[Dict[str, Any]] = None  # Response body of the synchronous endpoint
+    error: Optional[str] = None
+    status_code: Optional[int] = None  # HTTP status the synchronous endpoint would have failed with
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class CompiledTemplatePart(BaseModel):
+    text: str
+    entities: List[Dict[str, Any]] = []  # Telethon MessageEntity.to_dict() output
+
+class CompiledTemplate(BaseModel):
+    parse_mode: str = "markdown"
+    parts: List[CompiledTemplatePart]
+    compiled_at: datetime = Field(default_factory=datetime.utcnow)
+
 class MessageTemplate(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
     content: str
     is_active: bool = True
+    compiled: Optional[CompiledTemplate] = None  # parsed text and entities, rebuilt whenever content changes
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -100,6 +553,18 @@ class MessageTemplateUpdate(BaseModel):
     content: Optional[str] = None
     is_active: Optional[bool] = None
 
+class GroupPreflight(BaseModel):
+    checked_at: datetime = Field(default_factory=datetime.utcnow)
+    is_member: Optional[bool] = None  # None when the check could not tell
+    can_send: Optional[bool] = None
+    slow_mode_seconds: int = 0
+    error: Optional[str] = None
+
+    @property
+    def is_usable(self) -> bool:
+        """Only a definite 'no' excludes a group; unknown results are still tried"""
+        return self.is_member is not False and self.can_send is not False
+
 class GroupTarget(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     group_identifier: str  # Can be username, link, or ID
@@ -107,6 +572,7 @@ class GroupTarget(BaseModel):
     group_type: str  # 'username', 'invite_link', 'group_id'
     resolved_id: Optional[str] = None  # Will be populated when actually accessed
     is_active: bool = True
+    preflight: Optional[GroupPreflight] = None  # Cached membership/permission check
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -121,6 +587,22 @@ class GroupTargetUpdate(BaseModel):
 class GroupBulkImport(BaseModel):
     groups: List[str]
 
+class GroupImportIssue(BaseModel):
+    line: int  # 1-based position in the input
+    identifier: str
+    error: str
+
+class GroupImportPreview(BaseModel):
+    lines: int
+    blank: int
+    invalid: int
+    duplicates: int  # Repeats of an identifier earlier in the input
+    existing: int  # Already stored; the import skips them
+    new: int  # Groups the import would create
+    by_type: Dict[str, int]  # New groups per group_type
+    invalid_lines: List[GroupImportIssue]
+    computed_in_ms: float
+
 class BlacklistEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     group_id: str
@@ -163,6 +645,150 @@ class AutomationStatus(BaseModel):
     next_cycle_at: Optional[datetime] = None
     errors: List[str] = []
 
+class PreflightStatus(BaseModel):
+    is_running: bool = False
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    total: int = 0
+    checked: int = 0
+    usable: int = 0
+    unusable: int = 0
+    failed: int = 0
+    last_error: Optional[str] = None
+
+class SimulationRequest(BaseModel):
+    config: Optional[AutomationConfigUpdate] = None  # Overrides applied on top of the stored config
+    start_at: Optional[datetime] = None  # Defaults to the engine's next cycle, or now
+    send_latency_seconds: float = 0.5  # Expected time for one send_message round trip
+    schedule_offset: int = Field(0, ge=0)
+    schedule_limit: int = Field(100, ge=1, le=1000)  # Schedule entries returned from the offset on
+
+class SimulatedSend(BaseModel):
+    group_id: str
+    group_name: str
+    next_send_at: datetime
+    cycles_ahead: int  # 0 = first simulated cycle; >0 = pushed back by a flood/slow-mode window
+
+class SimulationResult(BaseModel):
+    start_at: datetime
+    groups_active: int
+    groups_in_next_cycle: int
+    groups_delayed: int  # Temporarily blacklisted at the start; picked up by a later cycle
+    groups_excluded: int  # Permanently blacklisted or failed preflight
+    cycle_duration_seconds: Dict[str, float]
+    cycle_gap_seconds: Dict[str, float]
+    cycle_period_seconds: float
+    sends_per_hour: float  # Long-run average including the gaps between cycles
+    sends_per_hour_in_cycle: float
+    schedule_total: int
+    schedule: List[SimulatedSend]
+    computed_in_ms: float
+
+class SendLogEntry(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    group_id: str
+    template_id: Optional[str] = None
+    status: str  # "sent" or "failed"
+    error: Optional[str] = None
+    latency_ms: Optional[float] = None
+    flood_wait_seconds: Optional[int] = None
+    cycle_id: Optional[str] = None
+    sent_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SendRollup(BaseModel):
+    period: datetime  # Start of the hour or day
+    sent: int = 0
+    failed: int = 0
+    flood_waits: int = 0
+    flood_wait_seconds: int = 0
+    avg_latency_ms: Optional[float] = None
+    max_latency_ms: Optional[float] = None
+    success_rate: Optional[float] = None  # None when nothing was attempted
+
+class SendBreakdown(BaseModel):
+    id: str  # Group or template id
+    name: Optional[str] = None
+    sent: int
+    failed: int
+    flood_waits: int
+    failure_rate: float
+
+class ScheduledTaskInfo(BaseModel):
+    name: str
+    interval_seconds: float
+    jitter: float
+    timeout_seconds: Optional[float] = None
+    single_instance: bool = False  # Runs only on the worker holding the engine lease
+    running: bool = False
+    runs: int = 0
+    failures: int = 0  # Errors and timeouts
+    skipped: int = 0  # Runs not started because the previous one was still going
+    last_started_at: Optional[datetime] = None
+    last_duration_ms: Optional[float] = None
+    avg_duration_ms: Optional[float] = None
+    max_duration_ms: Optional[float] = None
+    last_error: Optional[str] = None
+    last_error_at: Optional[datetime] = None
+    next_run_at: Optional[datetime] = None
+
+class ImportResult(BaseModel):
+    collection: str
+    inserted: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    errors: List[str] = []
+
+class MemoryAllocation(BaseModel):
+    location: str
+    size_bytes: int
+    count: int
+    size_diff_bytes: Optional[int] = None
+    count_diff: Optional[int] = None
+
+class MemorySnapshotInfo(BaseModel):
+    name: str
+    taken_at: datetime
+    traced_bytes: int
+    top: List[MemoryAllocation] = []
+
+class MemoryReport(BaseModel):
+    tracing: bool
+    traced_current_bytes: int = 0
+    traced_peak_bytes: int = 0
+    max_rss_kb: int
+    snapshots: List[str] = []
+    components: Dict[str, Dict[str, int]] = {}
+
+class ProfileRun(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    scope: str
+    route: Optional[str] = None
+    method: Optional[str] = None
+    format: str
+    seconds: float
+    interval_ms: float
+    status: str = "running"  # running, finished, failed
+    started_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    samples: int = 0
+    matched_samples: int = 0
+    loop_lag: Dict[str, float] = {}
+    output_file: Optional[str] = None
+    error: Optional[str] = None
+
+class QueryAuditResult(BaseModel):
+    name: str
+    collection: str
+    stages: List[str] = []
+    docs_examined: int = 0
+    keys_examined: int = 0
+    returned: int = 0
+    time_ms: int = 0
+    collscan: bool = False
+    in_memory_sort: bool = False
+    flagged: bool = False
+    error: Optional[str] = None
+
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_name: str
@@ -173,20 +799,31 @@ class StatusCheckCreate(BaseModel):
 
 # ========================== HELPER FUNCTIONS ==========================
 
+# name -> callable returning item counts of an in-memory structure, for leak hunting
+memory_reporters: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+def register_memory_reporter(name: str, reporter: Callable[[], Dict[str, int]]):
+    """Include a component's sizes in ``GET /api/admin/memory``"""
+    memory_reporters[name] = reporter
+
 def encrypt_data(data: str) -> str:
     """Encrypt sensitive data"""
-    return cipher_suite.encrypt(data.encode()).decode()
+    with trace_span("crypto.fernet.encrypt"):
+        return cipher_suite.encrypt(data.encode()).decode()
 
 def decrypt_data(encrypted_data: str) -> str:
     """Decrypt sensitive data"""
-    return cipher_suite.decrypt(encrypted_data.encode()).decode()
+    with trace_span("crypto.fernet.decrypt"):
+        return cipher_suite.decrypt(encrypted_data.encode()).decode()
+
+GROUP_ID_RE = re.compile(r'-?\d+')
 
 def parse_group_identifier(identifier: str) -> Dict[str, str]:
     """Parse group identifier and determine its type"""
     identifier = identifier.strip()
     
     # Check if it's a group ID (starts with - and contains only numbers)
-    if re.match(r'^-?\d+$', identifier):
+    if GROUP_ID_RE.fullmatch(identifier):
         return {
             'type': 'group_id',
             'value': identifier,
@@ -227,12 +864,27 @@ def parse_group_identifier(identifier: str) -> Dict[str, str]:
         'name': f'@{identifier}'
     }
 
+TELEGRAM_USERNAME_RE = re.compile(r'[A-Za-z][A-Za-z0-9_]{3,31}')
+INVITE_HASH_RE = re.compile(r'(?:/joinchat/|/\+)[\w-]+/?')
+
+def validate_group_identifier(identifier: str) -> Dict[str, str]:
+    """``parse_group_identifier`` for user input: raises ValueError for what cannot name a group"""
+    if len(identifier.split(None, 1)) != 1:
+        raise ValueError("Identifier is empty or contains spaces")
+    parsed = parse_group_identifier(identifier)
+    if parsed['type'] == 'username' and not TELEGRAM_USERNAME_RE.fullmatch(parsed['value']):
+        raise ValueError(f"'{parsed['value']}' is not a valid Telegram username")
+    if parsed['type'] == 'invite_link' and not INVITE_HASH_RE.search(identifier):
+        raise ValueError("Invite link has no invite hash")
+    return parsed
+
 # ========================== HELPER FUNCTIONS ==========================
 
 async def fetch_user_profile(client: TelegramClient) -> UserProfile:
     """Fetch user profile information from Telegram"""
     try:
-        me = await client.get_me()
+        with trace_span("telegram.get_me", kind='CLIENT'):
+            me = await client.get_me()
         return UserProfile(
             user_id=me.id,
             first_name=me.first_name,
@@ -243,9 +895,51 @@ async def fetch_user_profile(client: TelegramClient) -> UserProfile:
             is_bot=getattr(me, 'bot', False)
         )
     except Exception as e:
-        logging.warning(f"Failed to fetch user profile: {e}")
+        logger.warning("Failed to fetch user profile: %s", e)
         return UserProfile()  # Return empty profile on error
 
+async def require_admin(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    """Guard admin endpoints with the ADMIN_TOKEN bearer token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled. Set ADMIN_TOKEN to enable it.")
+    if not credentials or not secrets.compare_digest(credentials.credentials, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+# Collections whose documents use the model's string ``id`` as ``_id``
+ID_KEYED_COLLECTIONS = ("telegram_config", "message_templates", "group_targets", "blacklist", "automation_config")
+
+def to_document(model: BaseModel) -> Dict[str, Any]:
+    """Serialize a model for storage, using its string id as the Mongo ``_id``"""
+    document = model.dict()
+    document['_id'] = document['id']
+    return document
+
+async def migrate_ids_to_primary_key():
+    """Re-key documents that still carry an ObjectId ``_id`` by their string ``id`` and drop the old ``id`` indexes
+
+    ``_id`` cannot be updated in place, so each document is copied under its
+    new key and the original removed. Safe to run on every start.
+    """
+    for name in ID_KEYED_COLLECTIONS:
+        collection = db[name]
+        migrated = 0
+        async for document in collection.find({"_id": {"$not": {"$type": "string"}}, "id": {"$type": "string"}}):
+            old_id = document.pop('_id')
+            document['_id'] = document['id']
+            try:
+                await collection.insert_one(document)
+            except DuplicateKeyError:
+                pass  # copied by an earlier, interrupted run
+            await collection.delete_one({"_id": old_id})
+            migrated += 1
+        if migrated:
+            logger.info("Re-keyed %d %s documents by id", migrated, name)
+
+        try:
+            await collection.drop_index("id_1")
+        except OperationFailure:
+            pass  # already dropped
+
 async def get_telegram_config() -> Optional[TelegramConfig]:
     """Get the current telegram configuration"""
     config = await db.telegram_config.find_one()
@@ -260,7 +954,7 @@ async def get_telegram_config() -> Optional[TelegramConfig]:
 
 async def save_telegram_config(config: TelegramConfig) -> TelegramConfig:
     """Save telegram configuration with encryption"""
-    config_dict = config.dict()
+    config_dict = to_document(config)
     
     # Encrypt sensitive data
     if config_dict.get('api_hash'):
@@ -271,25 +965,82 @@ async def save_telegram_config(config: TelegramConfig) -> TelegramConfig:
     config_dict['updated_at'] = datetime.utcnow()
     
     await db.telegram_config.replace_one(
-        {"_id": config_dict.get('_id', config_dict['id'])},
+        {"_id": config.id},
         config_dict,
         upsert=True
     )
+    profile_cache.invalidate()
     return config
 
+DEFAULT_AUTOMATION_CONFIG_ID = "default"
+
+class AutomationConfigStore:
+    """The automation config held in memory and pushed to subscribers whenever it changes
+
+    Writes made here are applied at once; writes from other workers arrive
+    through the invalidation bus and trigger a reload.
+    """
+
+    def __init__(self):
+        self._config: Optional[AutomationConfig] = None
+        self._listeners: List[Callable[[AutomationConfig], None]] = []
+        self._lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, listener: Callable[[AutomationConfig], None]):
+        self._listeners.append(listener)
+        if self._config:
+            listener(self._config)
+
+    async def get(self) -> AutomationConfig:
+        """A copy of the current config, safe to modify before ``save``"""
+        if self._config is None:
+            await self.reload()
+        return self._config.copy()
+
+    async def reload(self):
+        async with self._lock:
+            document = await db.automation_config.find_one()
+            if document is None:
+                # Fixed _id: concurrent workers starting up create it exactly once
+                try:
+                    await db.automation_config.insert_one(to_document(AutomationConfig(id=DEFAULT_AUTOMATION_CONFIG_ID)))
+                except DuplicateKeyError:
+                    pass
+                document = await db.automation_config.find_one()
+            # Ensure auto_cleanup_blacklist is always True
+            document['auto_cleanup_blacklist'] = True
+            self._apply(AutomationConfig(**document))
+
+    async def save(self, config: AutomationConfig):
+        config.auto_cleanup_blacklist = True
+        config.updated_at = datetime.utcnow()
+        await db.automation_config.replace_one({"_id": config.id}, to_document(config), upsert=True)
+        self._apply(config.copy())
+
+    def invalidate(self):
+        if self._reload_task and not self._reload_task.done():
+            return
+        self._reload_task = asyncio.create_task(self._reload_quietly())
+
+    async def _reload_quietly(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.warning("Reloading automation config failed: %s", e)
+
+    def _apply(self, config: AutomationConfig):
+        if self._config is not None and config.dict() == self._config.dict():
+            return
+        self._config = config
+        for listener in self._listeners:
+            listener(config)
+
+automation_config_store = AutomationConfigStore()
+
 async def get_automation_config() -> AutomationConfig:
     """Get automation configuration"""
-    config = await db.automation_config.find_one()
-    if config:
-        # Ensure auto_cleanup_blacklist is always True
-        config['auto_cleanup_blacklist'] = True
-        return AutomationConfig(**config)
-    
-    # Create default config if not exists
-    default_config = AutomationConfig()
-    default_config.auto_cleanup_blacklist = True
-    await db.automation_config.insert_one(default_config.dict())
-    return default_config
+    return await automation_config_store.get()
 
 async def cleanup_expired_blacklists():
     """Clean up expired temporary blacklists"""
@@ -300,8 +1051,271 @@ async def cleanup_expired_blacklists():
     })
     return result.deleted_count
 
+# ========================== SESSION STORAGE ==========================
+
+LIVE_SESSION_NAME = 'live'
+SESSION_FLUSH_INTERVAL = float(os.environ.get('SESSION_FLUSH_INTERVAL', '5'))  # seconds new entities wait before a write
+SESSION_ENTITY_BATCH = int(os.environ.get('SESSION_ENTITY_BATCH', '200'))  # pending entities that force an early write
+
+EntityRow = Tuple[int, int, Optional[str], Optional[str], Optional[str]]  # peer id, access hash, username, phone, name
+
+class MongoSession(MemorySession):
+    """Telethon session kept in Mongo: encrypted auth key in ``telegram_sessions``, peers in ``telegram_entities``
+
+    Telethon calls its session synchronously, so every lookup is served from
+    in-memory indexes filled once by ``load``. Changed entities are buffered
+    and written back in batches by ``flush``.
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self._rows_by_id: Dict[int, EntityRow] = {}
+        self._ids_by_username: Dict[str, int] = {}
+        self._ids_by_phone: Dict[str, int] = {}
+        self._ids_by_name: Dict[str, int] = {}
+        self._pending_entities: Dict[int, EntityRow] = {}
+        self._state_dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def load(cls, name: str) -> 'MongoSession':
+        """Read the stored auth key and the whole entity table for ``name``"""
+        session = cls(name)
+        doc = await db.telegram_sessions.find_one({"_id": name})
+        if doc:
+            session._dc_id = doc.get('dc_id') or 0
+            session._server_address = doc.get('server_address')
+            session._port = doc.get('port')
+            session._takeout_id = doc.get('takeout_id')
+            if doc.get('auth_key'):
+                session._auth_key = AuthKey(base64.b64decode(decrypt_data(doc['auth_key'])))
+
+        cursor = db.telegram_entities.find(
+            {"session": name}, {"_id": 0, "peer_id": 1, "hash": 1, "username": 1, "phone": 1, "name": 1}
+        )
+        async for row in cursor:
+            session._index_row((row['peer_id'], row['hash'], row.get('username'), row.get('phone'), row.get('name')))
+        logger.info("Loaded Telegram session %s with %d cached entities", name, len(session._rows_by_id))
+        return session
+
+    def import_string_session(self, session_string: str):
+        """Take over the data centre and auth key of a ``StringSession``"""
+        string_session = StringSession(session_string)
+        self.set_dc(string_session.dc_id, string_session.server_address, string_session.port)
+        self.auth_key = string_session.auth_key
+
+    # Connection state; every change is persisted on the next flush
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._mark_state_dirty()
+
+    @property
+    def auth_key(self):
+        return self._auth_key
+
+    @auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._mark_state_dirty()
+
+    @property
+    def takeout_id(self):
+        return self._takeout_id
+
+    @takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._mark_state_dirty()
+
+    def _mark_state_dirty(self):
+        self._state_dirty = True
+        self._schedule_flush(immediate=True)
+
+    # Entity cache
+
+    def _index_row(self, row: EntityRow) -> bool:
+        """Add or replace a row in the lookup indexes; False when nothing changed"""
+        peer_id, _, username, phone, name = row
+        previous = self._rows_by_id.get(peer_id)
+        if previous == row:
+            return False
+        if previous:
+            for index, key in ((self._ids_by_username, previous[2]), (self._ids_by_phone, previous[3]),
+                               (self._ids_by_name, previous[4])):
+                if key and index.get(key) == peer_id:
+                    del index[key]
+
+        self._rows_by_id[peer_id] = row
+        if username:
+            self._ids_by_username[username] = peer_id
+        if phone:
+            self._ids_by_phone[phone] = peer_id
+        if name:
+            self._ids_by_name[name] = peer_id
+        return True
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            if self._index_row(row):
+                self._pending_entities[row[0]] = row
+        if self._pending_entities:
+            self._schedule_flush(immediate=len(self._pending_entities) >= SESSION_ENTITY_BATCH)
+
+    def _row_for(self, peer_id: Optional[int]) -> Optional[Tuple[int, int]]:
+        row = self._rows_by_id.get(peer_id) if peer_id is not None else None
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._row_for(self._ids_by_phone.get(phone))
+
+    def get_entity_rows_by_username(self, username):
+        return self._row_for(self._ids_by_username.get(username))
+
+    def get_entity_rows_by_name(self, name):
+        return self._row_for(self._ids_by_name.get(name))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._row_for(id)
+        for peer_id in (get_peer_id(PeerUser(id)), get_peer_id(PeerChat(id)), get_peer_id(PeerChannel(id))):
+            row = self._row_for(peer_id)
+            if row:
+                return row
+        return None
+
+    # Persistence
+
+    def _schedule_flush(self, immediate: bool = False):
+        """Start a background write unless one is already waiting"""
+        if self._flush_task and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # outside the loop; the next flush picks the changes up
+        self._flush_task = loop.create_task(self._delayed_flush(0 if immediate else SESSION_FLUSH_INTERVAL))
+
+    async def _delayed_flush(self, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("Failed to persist Telegram session %s: %s", self.name, e)
+
+    async def flush(self):
+        """Write the connection state and pending entities to Mongo"""
+        now = datetime.utcnow()
+        if self._state_dirty:
+            self._state_dirty = False
+            auth_key = self._auth_key.key if self._auth_key else None
+            await db.telegram_sessions.update_one(
+                {"_id": self.name},
+                {"$set": {
+                    "dc_id": self._dc_id,
+                    "server_address": self._server_address,
+                    "port": self._port,
+                    "takeout_id": self._takeout_id,
+                    "auth_key": encrypt_data(base64.b64encode(auth_key).decode()) if auth_key else None,
+                    "updated_at": now,
+                }},
+                upsert=True
+            )
+
+        entities, self._pending_entities = self._pending_entities, {}
+        if entities:
+            await db.telegram_entities.bulk_write([
+                UpdateOne(
+                    {"_id": f"{self.name}:{peer_id}"},
+                    {"$set": {
+                        "session": self.name, "peer_id": peer_id, "hash": access_hash,
+                        "username": username, "phone": phone, "name": name, "updated_at": now,
+                    }},
+                    upsert=True
+                )
+                for peer_id, access_hash, username, phone, name in entities.values()
+            ], ordered=False)
+            logger.debug("Persisted %d Telegram entities for session %s", len(entities), self.name)
+
+    def save(self):
+        # Telethon calls this after DC switches and on disconnect
+        self._schedule_flush(immediate=True)
+        return ''
+
+    def close(self):
+        self._schedule_flush(immediate=True)
+
+    def delete(self):
+        try:
+            asyncio.get_running_loop().create_task(delete_stored_session(self.name))
+        except RuntimeError:
+            pass
+
+def _session_memory_usage() -> Dict[str, int]:
+    sessions = [c.session for c in telegram_clients.values() if isinstance(c.session, MongoSession)]
+    return {
+        "clients": len(telegram_clients),
+        "cached_entities": sum(len(session._rows_by_id) for session in sessions),
+        "pending_entities": sum(len(session._pending_entities) for session in sessions),
+    }
+
+register_memory_reporter('telegram_sessions', _session_memory_usage)
+
+async def store_live_session(session_string: str):
+    """Replace the live session's auth key after a login, keeping its entity cache"""
+    session = await MongoSession.load(LIVE_SESSION_NAME)
+    session.import_string_session(session_string)
+    await session.flush()
+
+    # A live client still holding the previous key is rebuilt on next use
+    client = telegram_clients.pop('live', None)
+    if client and client.is_connected():
+        await client.disconnect()
+
+async def delete_stored_session(name: str):
+    """Forget the auth key and every cached entity of a session"""
+    await db.telegram_sessions.delete_one({"_id": name})
+    result = await db.telegram_entities.delete_many({"session": name})
+    logger.info("Deleted Telegram session %s and %d cached entities", name, result.deleted_count)
+
 # ========================== TELEGRAM CLIENT MANAGEMENT ==========================
 
+_live_client_lock = asyncio.Lock()
+
+async def get_connected_client() -> Optional[TelegramClient]:
+    """Return the long-lived authorised client used by background work, connecting it on first use
+
+    Kept under its own key so the short-lived clients of the login flow
+    (``telegram_clients['main']``) never replace it.
+    """
+    async with _live_client_lock:
+        client = telegram_clients.get('live')
+        if client and client.is_connected():
+            return client
+
+        config = await get_telegram_config()
+        if not config or not config.is_authenticated or not config.session_string:
+            return None
+
+        session = await MongoSession.load(LIVE_SESSION_NAME)
+        if session.auth_key is None:
+            # First start after the upgrade: move the StringSession into Mongo
+            session.import_string_session(config.session_string)
+            await session.flush()
+
+        client = TelegramClient(session, config.api_id, config.api_hash)
+        with trace_span("telegram.connect", kind='CLIENT'):
+            await client.connect()
+        if not await client.is_user_authorized():
+            logger.warning("Stored Telegram session is no longer authorised")
+            await client.disconnect()
+            return None
+
+        telegram_clients['live'] = client
+        return client
+
 async def initialize_telegram_client(session_string: Optional[str] = None) -> Optional[TelegramClient]:
     """Initialize Telegram client with current config and optional session"""
     config = await get_telegram_config()
@@ -326,105 +1340,1586 @@ async def initialize_telegram_client(session_string: Optional[str] = None) -> Op
         telegram_clients['main'] = client
         return client
     except Exception as e:
-        logging.error(f"Failed to initialize Telegram client: {e}")
+        logger.error("Failed to initialize Telegram client: %s", e)
         return None
 
-# ========================== API ENDPOINTS ==========================
+# ========================== CACHE INVALIDATION ==========================
 
-# Root endpoint
-@api_router.get("/")
-async def root():
-    return {"message": "Telegram Automation System API", "version": "2.0.0"}
+INVALIDATION_COLLECTIONS = ("telegram_config", "automation_config", "message_templates", "group_targets", "blacklist")
+INVALIDATION_MODE = os.environ.get('INVALIDATION_MODE', 'auto')  # 'auto', 'change_stream' or 'polling'
+INVALIDATION_POLL_INTERVAL = float(os.environ.get('INVALIDATION_POLL_INTERVAL', '2'))  # seconds; bounds staleness when polling
+CHANGE_STREAM_UNSUPPORTED = 40573  # $changeStream on a standalone server
 
-# ========================== TELEGRAM CONFIGURATION ==========================
+class InvalidationBus:
+    """Tells every worker's in-process caches that a watched collection changed
 
-@api_router.post("/telegram/config", response_model=TelegramConfig)
-async def create_telegram_config(config_data: TelegramConfigCreate):
-    """Create or update Telegram configuration"""
-    existing_config = await get_telegram_config()
-    
-    if existing_config:
-        # Update existing config
-        existing_config.api_id = config_data.api_id
-        existing_config.api_hash = config_data.api_hash
-        existing_config.phone_number = config_data.phone_number
-        existing_config.is_authenticated = False
-        existing_config.session_string = None
-        config = existing_config
-    else:
-        # Create new config
-        config = TelegramConfig(**config_data.dict())
-    
-    await save_telegram_config(config)
-    
-    # Initialize client for testing
-    await initialize_telegram_client()
-    
-    return config
+    On a replica set a change stream over the watched collections delivers
+    every write from any worker. A standalone server has no change streams,
+    so each worker instead bumps a per-collection counter in ``cache_versions``
+    (at most once per poll interval) and polls the counters of the others.
+    Either way local writes are dispatched immediately. To try the change
+    stream path locally, start ``mongod --replSet rs0`` and run
+    ``rs.initiate()`` once.
+    """
 
-@api_router.get("/telegram/config", response_model=Optional[TelegramConfig])
-async def get_current_telegram_config():
-    """Get current Telegram configuration"""
-    config = await get_telegram_config()
-    if config:
-        # Don't return sensitive data
-        config.api_hash = "***HIDDEN***"
-        if config.session_string:
-            config.session_string = "***HIDDEN***"
-    return config
+    def __init__(self, collections: Tuple[str, ...], poll_interval: float):
+        self.collections = frozenset(collections)
+        self.poll_interval = poll_interval
+        self.mode: Optional[str] = None  # set once the watcher is running
+        self.events = 0
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._dirty: set = set()
+        self._versions: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
 
-@api_router.put("/telegram/config", response_model=TelegramConfig)
-async def update_telegram_config(config_update: TelegramConfigUpdate):
-    """Update Telegram configuration"""
-    config = await get_telegram_config()
-    if not config:
-        raise HTTPException(status_code=404, detail="Telegram configuration not found")
-    
-    update_data = config_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(config, field, value)
-    
-    if any([config_update.api_id, config_update.api_hash, config_update.phone_number]):
-        config.is_authenticated = False
-        config.session_string = None
-    
-    await save_telegram_config(config)
-    await initialize_telegram_client()
-    
-    # Don't return sensitive data
-    config.api_hash = "***HIDDEN***"
-    if config.session_string:
-        config.session_string = "***HIDDEN***"
-    
+    def subscribe(self, collection: str, handler: Callable[[str], None]):
+        """Call ``handler(collection)`` whenever ``collection`` changes; handlers must be cheap and not raise"""
+        self._handlers.setdefault(collection, []).append(handler)
+
+    def notify(self, collection: str):
+        """Called for every local write"""
+        if collection not in self.collections:
+            return
+        self._dispatch(collection)
+        if self.mode != 'change_stream':
+            self._dirty.add(collection)
+
+    def _dispatch(self, collection: str):
+        self.events += 1
+        for handler in self._handlers.get(collection, []):
+            try:
+                handler(collection)
+            except Exception as e:
+                logger.warning("Invalidation handler for %s failed: %s", collection, e)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush_versions()
+
+    async def _run(self):
+        if INVALIDATION_MODE != 'polling':
+            try:
+                await self._watch()
+                return
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAM_UNSUPPORTED or INVALIDATION_MODE == 'change_stream':
+                    raise
+                logger.info("Change streams unavailable, polling cache versions every %ss", self.poll_interval)
+        await self._poll()
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": sorted(self.collections)}}}]
+        resume_token = None
+        resync = False
+        while True:
+            try:
+                async with db.watch(pipeline, resume_after=resume_token) as stream:
+                    if self.mode != 'change_stream':
+                        self.mode = 'change_stream'
+                        self._dirty.clear()
+                        logger.info("Cache invalidation following a change stream")
+                    if resync:
+                        # Changes between the lost resume point and now were never seen; reload everything
+                        resync = False
+                        for collection in sorted(self.collections):
+                            self._dispatch(collection)
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._dispatch(change["ns"]["coll"])
+            except OperationFailure as e:
+                if self.mode != 'change_stream':
+                    raise
+                # The stream cannot resume, e.g. its resume point fell off the oplog (ChangeStreamHistoryLost)
+                logger.warning("Change stream failed, resubscribing from now: %s", e)
+                resume_token = None
+                resync = True
+                await asyncio.sleep(self.poll_interval)
+            except PyMongoError as e:
+                # Transient network or election error; resume where we left off
+                logger.warning("Change stream interrupted: %s", e)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self):
+        self.mode = 'polling'
+        async for document in db.cache_versions.find({"_id": {"$in": sorted(self.collections)}}):
+            self._versions[document["_id"]] = document.get("version", 0)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._flush_versions()
+                async for document in db.cache_versions.find({"_id": {"$in": sorted(self.collections)}}):
+                    collection, version = document["_id"], document.get("version", 0)
+                    if self._versions.get(collection, 0) != version:
+                        self._versions[collection] = version
+                        self._dispatch(collection)
+            except PyMongoError as e:
+                logger.warning("Polling cache versions failed: %s", e)
+
+    async def _flush_versions(self):
+        """Publish local writes to workers that poll"""
+        dirty, self._dirty = self._dirty, set()
+        for collection in dirty:
+            document = await db.cache_versions.find_one_and_update(
+                {"_id": collection}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+            # Skipping past our own bump only when nobody else wrote in between
+            if document["version"] == self._versions.get(collection, 0) + 1:
+                self._versions[collection] = document["version"]
+
+invalidation_bus = InvalidationBus(INVALIDATION_COLLECTIONS, INVALIDATION_POLL_INTERVAL)
+collection_write_listeners.append(invalidation_bus.notify)
+register_memory_reporter('invalidation_bus', lambda: {
+    "change_stream": int(invalidation_bus.mode == 'change_stream'),
+    "events": invalidation_bus.events,
+    "pending_version_bumps": len(invalidation_bus._dirty),
+})
+
+# ========================== PROFILE CACHE ==========================
+
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '300'))  # seconds before a background refresh
+PROFILE_REFRESH_RETRY = 60.0  # seconds between attempts while refreshes fail
+
+class ProfileCache:
+    """In-memory Telegram auth status and user profile with stale-while-revalidate refresh
+
+    Reads never wait on Telegram: a stale entry is returned as-is while a single
+    background task refreshes it through the live client. Only the worker
+    holding the engine lease refreshes; the others serve the profile it
+    stores in ``telegram_config`` and reload it when that changes.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._status: Optional[Dict[str, Any]] = None
+        self._profile: Optional[UserProfile] = None
+        self._config_id: Optional[str] = None
+        self._refresh_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._load_lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._status = None
+        self._profile = None
+        self._config_id = None
+        self._refresh_at = 0.0
+
+    async def _load(self):
+        config = await get_telegram_config()
+        if not config:
+            self._status = {"authenticated": False, "phone_number": None}
+            self._profile = None
+            self._config_id = None
+            return
+        self._status = {
+            "authenticated": config.is_authenticated,
+            "phone_number": config.phone_number,
+            "has_session": bool(config.session_string),
+        }
+        self._profile = config.user_profile
+        self._config_id = config.id
+        # The stored profile has no fetch time; treat it as stale
+        self._refresh_at = 0.0
+
+    async def get(self) -> Tuple[Dict[str, Any], Optional[UserProfile]]:
+        if self._status is None:
+            async with self._load_lock:
+                if self._status is None:
+                    await self._load()
+        if self._status.get("authenticated") and engine_lease.held and time.monotonic() >= self._refresh_at:
+            self._schedule_refresh()
+        return self._status, self._profile
+
+    async def refresh_if_stale(self):
+        """Run a due refresh to completion instead of in the background"""
+        await self.get()
+        if self._refresh_task and not self._refresh_task.done():
+            await self._refresh_task
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_at = time.monotonic() + PROFILE_REFRESH_RETRY
+        self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            client = await get_connected_client()
+            if not client:
+                return
+            profile = await fetch_user_profile(client)
+            if profile.user_id is None:
+                return
+            changed = self._profile is None or profile.dict() != self._profile.dict()
+            self._profile = profile
+            self._refresh_at = time.monotonic() + self.ttl
+            # An unchanged write would still invalidate every worker's cache, this one included
+            if self._config_id and changed:
+                await db.telegram_config.update_one(
+                    {"_id": self._config_id},
+                    {"$set": {"user_profile": profile.dict()}}
+                )
+        except Exception as e:
+            logger.warning("Background profile refresh failed: %s", e)
+
+profile_cache = ProfileCache(PROFILE_CACHE_TTL)
+invalidation_bus.subscribe("telegram_config", lambda _: profile_cache.invalidate())
+register_memory_reporter('profile_cache', lambda: {
+    "profiles": int(profile_cache._profile is not None),
+    "refreshing": int(bool(profile_cache._refresh_task and not profile_cache._refresh_task.done())),
+})
+
+# ========================== GROUP PREFLIGHT ==========================
+
+PREFLIGHT_TTL_HOURS = float(os.environ.get('PREFLIGHT_TTL_HOURS', '6'))
+PREFLIGHT_CONCURRENCY = int(os.environ.get('PREFLIGHT_CONCURRENCY', '4'))
+PREFLIGHT_MAX_FLOOD_WAIT = int(os.environ.get('PREFLIGHT_MAX_FLOOD_WAIT', '300'))  # seconds; longer waits end the run
+PREFLIGHT_MAX_ATTEMPTS = 3
+
+class FloodGate:
+    """Shared pause: once Telegram asks for a FloodWait, every worker holds off until it has passed"""
+
+    def __init__(self):
+        self._resume_at = 0.0
+
+    def hold(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self._resume_at - time.monotonic())
+
+    async def wait(self, limit: float = math.inf) -> bool:
+        """Sleep out the pause; returns False, without sleeping, while it lasts longer than ``limit`` seconds"""
+        while True:
+            delay = self.remaining()
+            if delay <= 0:
+                return True
+            if delay > limit:
+                return False
+            await asyncio.sleep(delay)
+
+class PreflightFloodStop(Exception):
+    """Telegram asked for a pause longer than a preflight run may wait"""
+
+preflight_status = PreflightStatus()
+preflight_flood_gate = FloodGate()
+
+async def resolve_group_entity(client: TelegramClient, group: GroupTarget) -> Tuple[Any, bool]:
+    """Resolve a group target to a Telethon entity; returns (entity or None, is_member)"""
+    parsed = parse_group_identifier(group.group_identifier)
+    if parsed['type'] == 'invite_link':
+        invite_hash = parsed['value'].rstrip('/').split('/')[-1].lstrip('+')
+        with trace_span("telegram.check_chat_invite", kind='CLIENT'):
+            invite = await client(CheckChatInviteRequest(invite_hash))
+        if isinstance(invite, ChatInviteAlready):
+            return invite.chat, True
+        return getattr(invite, 'chat', None), False
+
+    key = int(parsed['value']) if parsed['type'] == 'group_id' else parsed['value']
+    with trace_span("telegram.get_entity", kind='CLIENT'):
+        entity = await client.get_entity(key)
+    return entity, not (getattr(entity, 'left', False) or getattr(entity, 'kicked', False))
+
+async def check_group_sendability(client: TelegramClient, group: GroupTarget) -> Tuple[GroupPreflight, Optional[int]]:
+    """Check membership, send permission and slow mode for one group; returns (result, peer id)"""
+    try:
+        entity, is_member = await resolve_group_entity(client, group)
+    except (UsernameNotOccupiedError, UsernameInvalidError, ChannelPrivateError,
+            InviteHashExpiredError, InviteHashInvalidError, ValueError) as e:
+        return GroupPreflight(is_member=False, can_send=False, error=str(e)), None
+
+    if entity is None or not is_member:
+        return GroupPreflight(is_member=False, can_send=False, error="Not a member of this group"), None
+
+    peer_id = get_peer_id(entity)
+    if getattr(entity, 'deactivated', False):
+        return GroupPreflight(is_member=True, can_send=False, error="Group has been deactivated"), peer_id
+    if not isinstance(entity, (Channel, Chat)):
+        # Users and bots: nothing to check beyond resolving
+        return GroupPreflight(is_member=True, can_send=True), peer_id
+
+    is_privileged = bool(getattr(entity, 'creator', False) or getattr(entity, 'admin_rights', None))
+    # The user's own restrictions and the group default both apply; either can ban posting
+    banned = any(rights is not None and rights.send_messages
+                 for rights in (getattr(entity, 'banned_rights', None), getattr(entity, 'default_banned_rights', None)))
+    can_send = is_privileged or not banned
+    error = None if can_send else "Posting is restricted in this group"
+    if isinstance(entity, Channel) and entity.broadcast and not is_privileged:
+        can_send, error = False, "Broadcast channel: only admins can post"
+
+    slow_mode_seconds = 0
+    if isinstance(entity, Channel) and entity.megagroup and can_send:
+        with trace_span("telegram.get_full_channel", kind='CLIENT'):
+            full = await client(GetFullChannelRequest(entity))
+        slow_mode_seconds = full.full_chat.slowmode_seconds or 0
+
+    return GroupPreflight(is_member=True, can_send=can_send, slow_mode_seconds=slow_mode_seconds, error=error), peer_id
+
+async def _preflight_one(client: TelegramClient, group: GroupTarget):
+    for attempt in range(PREFLIGHT_MAX_ATTEMPTS):
+        if not await preflight_flood_gate.wait(PREFLIGHT_MAX_FLOOD_WAIT):
+            raise PreflightFloodStop(f"Telegram flood wait, {preflight_flood_gate.remaining():.0f}s left")
+        try:
+            result, peer_id = await check_group_sendability(client, group)
+            break
+        except FloodWaitError as e:
+            # Held for the full wait either way, so no worker or later run calls Telegram before it ends
+            preflight_flood_gate.hold(e.seconds)
+            if e.seconds > PREFLIGHT_MAX_FLOOD_WAIT:
+                raise PreflightFloodStop(f"Telegram flood wait of {e.seconds}s")
+            logger.warning("Preflight flood wait of %ss, pausing all workers", e.seconds)
+        except RPCError as e:
+            result, peer_id = GroupPreflight(error=str(e)), None
+            break
+    else:
+        result, peer_id = GroupPreflight(error="Gave up after repeated flood waits"), None
+
+    update = {"preflight": result.dict(), "updated_at": datetime.utcnow()}
+    if peer_id is not None:
+        update["resolved_id"] = str(peer_id)
+    await db.group_targets.update_one({"_id": group.id}, {"$set": update})
+
+    preflight_status.checked += 1
+    if result.error and result.is_member is None:
+        preflight_status.failed += 1
+    elif result.is_usable:
+        preflight_status.usable += 1
+    else:
+        preflight_status.unusable += 1
+
+async def run_group_preflight(force: bool = False) -> PreflightStatus:
+    """Check every active group whose cached preflight is missing or older than the TTL
+
+    Groups stream from the cursor into a bounded queue served by
+    PREFLIGHT_CONCURRENCY workers, so memory stays flat for large lists.
+    """
+    global preflight_status
+    if preflight_status.is_running:
+        return preflight_status
+
+    if preflight_flood_gate.remaining() > PREFLIGHT_MAX_FLOOD_WAIT:
+        preflight_status.last_error = f"Telegram flood wait, {preflight_flood_gate.remaining():.0f}s left"
+        return preflight_status
+
+    client = await get_connected_client()
+    if not client:
+        preflight_status.last_error = "Telegram client is not authenticated"
+        return preflight_status
+
+    query: Dict[str, Any] = {"is_active": True}
+    if not force:
+        cutoff = datetime.utcnow() - timedelta(hours=PREFLIGHT_TTL_HOURS)
+        query["$or"] = [{"preflight": None}, {"preflight.checked_at": {"$lt": cutoff}}]
+
+    preflight_status = PreflightStatus(is_running=True, started_at=datetime.utcnow())
+    work: asyncio.Queue = asyncio.Queue(maxsize=PREFLIGHT_CONCURRENCY * 2)
+    stopped = asyncio.Event()
+
+    async def worker():
+        while True:
+            group = await work.get()
+            try:
+                # After a long flood wait the queued groups are only drained
+                if group is not None and not stopped.is_set():
+                    await _preflight_one(client, group)
+            except PreflightFloodStop as e:
+                if not stopped.is_set():
+                    stopped.set()
+                    preflight_status.last_error = f"{e}; preflight stopped"
+                    logger.warning("Preflight stopped: %s", e)
+            except Exception as e:
+                preflight_status.failed += 1
+                preflight_status.last_error = str(e)
+                logger.warning("Preflight failed for group %s: %s", group.id, e)
+            finally:
+                work.task_done()
+            if group is None:
+                return
+
+    workers = [asyncio.create_task(worker()) for _ in range(PREFLIGHT_CONCURRENCY)]
+    try:
+        async for document in db.group_targets.find(query):
+            if stopped.is_set():
+                break
+            preflight_status.total += 1
+            await work.put(GroupTarget(**document))
+    finally:
+        for _ in workers:
+            await work.put(None)
+        await asyncio.gather(*workers)
+        preflight_status.is_running = False
+        preflight_status.finished_at = datetime.utcnow()
+
+    logger.info("Group preflight finished: checked=%s usable=%s unusable=%s failed=%s",
+                preflight_status.checked, preflight_status.usable, preflight_status.unusable, preflight_status.failed)
+    return preflight_status
+
+# ========================== GROUP REGISTRY ==========================
+
+GROUP_ACTIVE = 1
+GROUP_BLACKLISTED = 2  # permanently; temporary blacklists only push next_eligible forward
+GROUP_UNUSABLE = 4  # preflight says we are not a member or cannot post
+
+class GroupRegistry:
+    """The engine's working set of groups, held as parallel arrays indexed by slot
+
+    A ``GroupTarget`` per group costs kilobytes of dicts, datetimes and
+    strings; here a group is an interned id, two strings and a few array
+    cells, lookups by id go through one dict and finding the eligible groups
+    is a scan over flat arrays.
+    """
+
+    PROJECTION = {
+        "_id": 1, "parsed_name": 1, "group_identifier": 1, "resolved_id": 1, "is_active": 1,
+        "preflight.is_member": 1, "preflight.can_send": 1,
+    }
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.identifiers: List[str] = []
+        self.peer_ids = array('q')  # marked peer id, 0 while unresolved
+        self.access_hashes = array('q')  # 0 when unknown
+        self.flags = bytearray()
+        self.next_eligible = array('d')  # unix time before which the group is skipped
+        self._slots: Dict[str, int] = {}
+        self._blacklisted: set = set()  # ids flagged by the last apply_blacklist
+        self._deferred: set = set()  # ids deferred by the last apply_blacklist
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def slot(self, group_id: str) -> Optional[int]:
+        return self._slots.get(group_id)
+
+    def upsert(self, group_id: str, name: str, identifier: str, peer_id: int = 0, access_hash: int = 0,
+               flags: int = GROUP_ACTIVE, next_eligible: float = 0.0) -> int:
+        """Add a group or overwrite its slot; returns the slot"""
+        slot = self._slots.get(group_id)
+        if slot is None:
+            group_id = sys.intern(group_id)
+            slot = len(self.ids)
+            self._slots[group_id] = slot
+            self.ids.append(group_id)
+            self.names.append(name)
+            self.identifiers.append(identifier)
+            self.peer_ids.append(peer_id)
+            self.access_hashes.append(access_hash)
+            self.flags.append(flags)
+            self.next_eligible.append(next_eligible)
+        else:
+            self.names[slot] = name
+            self.identifiers[slot] = identifier
+            self.peer_ids[slot] = peer_id
+            self.access_hashes[slot] = access_hash
+            self.flags[slot] = flags
+            self.next_eligible[slot] = next_eligible
+        return slot
+
+    def remove(self, group_id: str):
+        """Drop a group; its slot stays empty until the next ``compact``"""
+        slot = self._slots.pop(group_id, None)
+        if slot is not None:
+            self.flags[slot] = 0
+
+    def compact(self):
+        """Rebuild the arrays without empty slots once they make up half of them; invalidates slots"""
+        if len(self._slots) * 2 > len(self.ids):
+            return
+        compacted = GroupRegistry()
+        for slot in sorted(self._slots.values()):
+            compacted.upsert(self.ids[slot], self.names[slot], self.identifiers[slot], self.peer_ids[slot],
+                             self.access_hashes[slot], self.flags[slot], self.next_eligible[slot])
+        compacted._blacklisted, compacted._deferred = self._blacklisted, self._deferred
+        self.__dict__.update(compacted.__dict__)
+
+    def apply_document(self, document: Dict[str, Any], session: Optional[MemorySession] = None):
+        """Add, update or drop a group from a ``PROJECTION``-shaped document, keeping its blacklist state"""
+        group_id = document["_id"]
+        if not document.get("is_active", True):
+            self.remove(group_id)
+            return
+
+        flags, next_eligible = GROUP_ACTIVE, 0.0
+        slot = self._slots.get(group_id)
+        if slot is not None:
+            flags |= self.flags[slot] & GROUP_BLACKLISTED
+            next_eligible = self.next_eligible[slot]
+        preflight = document.get("preflight") or {}
+        if preflight.get("is_member") is False or preflight.get("can_send") is False:
+            flags |= GROUP_UNUSABLE
+
+        peer_id = int(document["resolved_id"]) if document.get("resolved_id") else 0
+        row = session.get_entity_rows_by_id(peer_id) if session and peer_id else None
+        self.upsert(group_id, document.get("parsed_name", ""), document.get("group_identifier", ""),
+                    peer_id, row[1] if row and row[1] else 0, flags, next_eligible)
+
+    def apply_blacklist(self, entries: List[Dict[str, Any]]):
+        """Flag permanently blacklisted groups and defer temporarily blacklisted ones"""
+        now, utcnow = time.time(), datetime.utcnow()
+        permanent, deferred = set(), set()
+        for entry in entries:
+            slot = self._slots.get(entry["group_id"])
+            if entry.get("blacklist_type") == "temporary" and entry.get("expires_at"):
+                deferred.add(entry["group_id"])
+                if slot is not None:
+                    self.defer(slot, now + (entry["expires_at"] - utcnow).total_seconds())
+            else:
+                permanent.add(entry["group_id"])
+                if slot is not None:
+                    self.set_flag(slot, GROUP_BLACKLISTED)
+        for group_id in self._blacklisted - permanent:
+            slot = self._slots.get(group_id)
+            if slot is not None:
+                self.set_flag(slot, GROUP_BLACKLISTED, False)
+        for group_id in self._deferred - deferred:
+            slot = self._slots.get(group_id)
+            if slot is not None:
+                self.next_eligible[slot] = 0.0
+        self._blacklisted, self._deferred = permanent, deferred
+
+    def set_flag(self, slot: int, flag: int, on: bool = True):
+        self.flags[slot] = self.flags[slot] | flag if on else self.flags[slot] & ~flag
+
+    def defer(self, slot: int, until: float):
+        self.next_eligible[slot] = max(self.next_eligible[slot], until)
+
+    def is_eligible(self, slot: int, now: Optional[float] = None) -> bool:
+        return self.flags[slot] == GROUP_ACTIVE and self.next_eligible[slot] <= (time.time() if now is None else now)
+
+    def eligible(self, now: Optional[float] = None) -> List[int]:
+        """Slots of active, unblacklisted, usable groups that are not deferred"""
+        now = time.time() if now is None else now
+        flags, next_eligible = self.flags, self.next_eligible
+        return [slot for slot in range(len(flags)) if flags[slot] == GROUP_ACTIVE and next_eligible[slot] <= now]
+
+    def send_target(self, slot: int):
+        """Input peer when the access hash is known, else something Telethon can resolve"""
+        peer_id, access_hash = self.peer_ids[slot], self.access_hashes[slot]
+        if peer_id:
+            real_id, peer_type = resolve_id(peer_id)
+            if peer_type is PeerChat:
+                return InputPeerChat(real_id)
+            if access_hash:
+                return (InputPeerChannel if peer_type is PeerChannel else InputPeerUser)(real_id, access_hash)
+            return peer_id
+        parsed = parse_group_identifier(self.identifiers[slot])
+        return int(parsed['value']) if parsed['type'] == 'group_id' else parsed['value']
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the registry"""
+        containers = (self.ids, self.names, self.identifiers, self.peer_ids, self.access_hashes,
+                      self.flags, self.next_eligible, self._slots)
+        strings = (self.ids, self.names, self.identifiers)
+        return sum(sys.getsizeof(c) for c in containers) + sum(sys.getsizeof(s) for values in strings for s in values)
+
+    def memory_usage(self) -> Dict[str, int]:
+        return {"groups": len(self), "bytes": self.nbytes()}
+
+    @classmethod
+    async def load(cls, session: Optional[MemorySession] = None) -> 'GroupRegistry':
+        """Build the registry from all active groups without constructing models
+
+        Access hashes come from ``session``'s entity cache when given.
+        """
+        registry = cls()
+        async for document in db.group_targets.find({"is_active": True}, cls.PROJECTION):
+            registry.apply_document(document, session)
+        return registry
+
+# ========================== TEMPLATE COMPILATION ==========================
+
+TEMPLATE_MAX_PARTS = int(os.environ.get('TEMPLATE_MAX_PARTS', '3'))  # Telegram-sized messages one template may expand to
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_MAX_ENTITIES = 100
+
+class TemplateCompileError(ValueError):
+    """A template that Telegram would not accept"""
+
+def compile_template_content(content: str) -> CompiledTemplate:
+    """Parse markdown into plain text and entities once and split it into sendable messages"""
+    text, entities = markdown.parse(content)
+    if not text.strip():
+        raise TemplateCompileError("Template is empty once formatting is removed")
+    parts = [
+        CompiledTemplatePart(text=part_text, entities=[entity.to_dict() for entity in part_entities])
+        for part_text, part_entities in split_text(text, entities, limit=TELEGRAM_MESSAGE_LIMIT,
+                                                   max_entities=TELEGRAM_MAX_ENTITIES)
+    ]
+    if len(parts) > TEMPLATE_MAX_PARTS:
+        raise TemplateCompileError(
+            f"Template is {len(text)} characters, more than {TEMPLATE_MAX_PARTS} messages of {TELEGRAM_MESSAGE_LIMIT}"
+        )
+    return CompiledTemplate(parts=parts)
+
+def _entity_from_dict(data: Dict[str, Any]) -> TLObject:
+    name = data.get('_', '')
+    entity_type = getattr(tl_types, name, None) if name.startswith('MessageEntity') else None
+    if entity_type is None:
+        raise TemplateCompileError(f"Unknown message entity {name!r}")
+    return entity_type(**{key: value for key, value in data.items() if key != '_'})
+
+class CompiledTemplateCache:
+    """Ready-to-send (text, entities) parts per template, rebuilt only when ``updated_at`` changes"""
+
+    def __init__(self):
+        self._parts: Dict[str, Tuple[datetime, List[Tuple[str, List[TLObject]]]]] = {}
+
+    def parts(self, template: MessageTemplate) -> List[Tuple[str, List[TLObject]]]:
+        cached = self._parts.get(template.id)
+        if cached and cached[0] == template.updated_at:
+            return cached[1]
+        # Documents written before compilation existed are compiled on first use
+        compiled = template.compiled or compile_template_content(template.content)
+        parts = [(part.text, [_entity_from_dict(entity) for entity in part.entities]) for part in compiled.parts]
+        self._parts[template.id] = (template.updated_at, parts)
+        return parts
+
+    def retain(self, template_ids):
+        """Forget templates that are no longer active"""
+        for template_id in set(self._parts) - set(template_ids):
+            del self._parts[template_id]
+
+compiled_templates = CompiledTemplateCache()
+register_memory_reporter('compiled_templates', lambda: {"templates": len(compiled_templates._parts)})
+
+# ========================== SEND LOG ==========================
+
+SEND_LOG_TTL_DAYS = int(os.environ.get('SEND_LOG_TTL_DAYS', '90'))  # raw send events kept; 0 keeps them forever
+SEND_ROLLUP_TTL_DAYS = int(os.environ.get('SEND_ROLLUP_TTL_DAYS', '400'))
+
+# Rollup scope -> (send_log field the counters are broken down by, bucket size)
+ROLLUP_SCOPES: Dict[str, Tuple[Optional[str], str]] = {
+    "hour": (None, "hour"),
+    "day": (None, "day"),
+    "group": ("group_id", "day"),
+    "template": ("template_id", "day"),
+}
+
+def rollup_period(moment: datetime, unit: str) -> datetime:
+    if unit == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def rollup_id(scope: str, key: str, period: datetime) -> str:
+    """Rollups are keyed by scope, key and bucket so a chart is a handful of ``_id`` lookups"""
+    return f"{scope}:{key}:{period:%Y-%m-%dT%H}"
+
+async def ensure_send_log_collection():
+    """Create ``send_log`` as a time-series collection bucketed per group
+
+    A plain ``send_log`` left by an earlier version is kept as it is; the
+    rollups work the same on either.
+    """
+    if await db.list_collection_names(filter={"name": "send_log"}):
+        return
+    options: Dict[str, Any] = {"timeseries": {"timeField": "sent_at", "metaField": "group_id", "granularity": "seconds"}}
+    if SEND_LOG_TTL_DAYS > 0:
+        options["expireAfterSeconds"] = SEND_LOG_TTL_DAYS * 86400
+    try:
+        await db.create_collection("send_log", **options)
+    except OperationFailure as e:
+        # 48: another worker created it first; anything else is a server without time-series support
+        if e.code != 48:
+            logger.warning("send_log stays a plain collection: %s", e)
+
+def _rollup_changes(entry: SendLogEntry) -> Dict[str, Dict[str, Any]]:
+    """Rollup ``_id`` -> upsert update folding one send into each scope"""
+    sent = entry.status == "sent"
+    increments = {
+        "sent": int(sent),
+        "failed": int(not sent),
+        "flood_waits": int(bool(entry.flood_wait_seconds)),
+        "flood_wait_seconds": entry.flood_wait_seconds or 0,
+        "latency_ms_total": entry.latency_ms or 0,
+        "latency_samples": int(entry.latency_ms is not None),
+    }
+    changes = {}
+    for scope, (field, unit) in ROLLUP_SCOPES.items():
+        key = getattr(entry, field) if field else "all"
+        if key is None:
+            continue
+        period = rollup_period(entry.sent_at, unit)
+        update: Dict[str, Any] = {
+            "$inc": dict(increments),
+            "$setOnInsert": {"scope": scope, "key": key, "period": period},
+        }
+        if entry.latency_ms is not None:
+            update["$max"] = {"latency_ms_max": entry.latency_ms}
+        changes[rollup_id(scope, key, period)] = update
+    return changes
+
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', '30'))  # seconds between flushes: the crash loss window
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', '200'))  # buffered sends that force an early flush
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', '50000'))  # kept while Mongo is failing
+
+class WriteBehindBuffer:
+    """Coalesces send records, rollup increments and engine state in memory and writes them in batches
+
+    A flush is one ``insert_many`` for the log, one ``bulk_write`` for the
+    rollups and one ``bulk_write`` per state collection, however many sends
+    it covers. It runs every ``WRITE_BEHIND_INTERVAL`` seconds, as soon as
+    ``WRITE_BEHIND_MAX_BATCH`` sends are buffered, and on ``stop``.
+
+    Loss window: a crash loses what was buffered since the last flush, at most
+    ``WRITE_BEHIND_INTERVAL`` seconds or ``WRITE_BEHIND_MAX_BATCH`` sends of
+    log entries, rollup counts and cycle position. The engine then resumes
+    from the older checkpoint and may repeat those sends. A clean shutdown
+    loses nothing. A failed flush is retried from the write that failed,
+    and of the log entries only those the server rejected are retried. A
+    write cut off by a connection error is retried whole: ``send_log`` is a
+    time-series collection without a unique ``_id``, so entries already
+    stored are then logged twice, and a rollup batch that was partly applied
+    over-counts. ``rebuild-rollups`` recomputes the rollups from the log.
+    """
+
+    def __init__(self):
+        self._entries: List[Dict[str, Any]] = []
+        self._rollups: Dict[str, Dict[str, Any]] = {}
+        self._states: Dict[str, Dict[str, Dict[str, Any]]] = {}  # collection -> _id -> latest document
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.writes = 0  # round trips made by flushes
+        self.dropped = 0
+
+    def add_send(self, entry: SendLogEntry):
+        self._entries.append(entry.dict())
+        self._merge_rollups(_rollup_changes(entry))
+        if len(self._entries) >= WRITE_BEHIND_MAX_BATCH:
+            self._wake.set()
+
+    def add_rollups(self, changes: Dict[str, Dict[str, Any]]):
+        """Fold increments for sends logged elsewhere, e.g. imported, into the next flush"""
+        self._merge_rollups(changes)
+
+    def put_state(self, collection: str, document_id: str, document: Dict[str, Any]):
+        """Stage a whole-document replacement; only the latest one per ``_id`` is written"""
+        self._states.setdefault(collection, {})[document_id] = document
+
+    def _merge_rollups(self, changes: Dict[str, Dict[str, Any]]):
+        for document_id, update in changes.items():
+            pending = self._rollups.get(document_id)
+            if pending is None:
+                self._rollups[document_id] = update
+                continue
+            for field, value in update["$inc"].items():
+                pending["$inc"][field] = pending["$inc"].get(field, 0) + value
+            if "$max" in update:
+                current = pending.setdefault("$max", {}).get("latency_ms_max")
+                pending["$max"]["latency_ms_max"] = max(update["$max"]["latency_ms_max"], current or 0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer and write out everything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), WRITE_BEHIND_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            entries, rollups, states = self._entries, self._rollups, self._states
+            if not (entries or rollups or states):
+                return
+            self._entries, self._rollups, self._states = [], {}, {}
+            try:
+                if entries:
+                    try:
+                        await db.send_log.insert_many(entries, ordered=False)
+                    except BulkWriteError as e:
+                        # Unordered: every entry not listed in writeErrors was written; only those are retried
+                        entries = [entries[error['index']] for error in e.details.get('writeErrors', [])]
+                        if entries:
+                            raise
+                    self.writes += 1
+                    entries = []
+                if rollups:
+                    await db.send_rollups.bulk_write(
+                        [UpdateOne({"_id": document_id}, update, upsert=True) for document_id, update in rollups.items()],
+                        ordered=False
+                    )
+                    self.writes += 1
+                    rollups = {}
+                for collection, documents in list(states.items()):
+                    await db[collection].bulk_write(
+                        [ReplaceOne({"_id": document_id}, document, upsert=True) for document_id, document in documents.items()],
+                        ordered=False
+                    )
+                    self.writes += 1
+                    del states[collection]
+                self.flushes += 1
+            except PyMongoError as e:
+                logger.warning("Write-behind flush failed, retrying with the next one: %s", e)
+                self._requeue(entries, rollups, states)
+
+    def _requeue(self, entries: List[Dict[str, Any]], rollups: Dict[str, Dict[str, Any]],
+                 states: Dict[str, Dict[str, Dict[str, Any]]]):
+        self._entries[:0] = entries
+        overflow = len(self._entries) - WRITE_BEHIND_MAX_PENDING
+        if overflow > 0:
+            # Oldest log entries go first; their counts stay in the rollups
+            del self._entries[:overflow]
+            self.dropped += overflow
+            logger.error("Write-behind buffer full, dropped %d send log entries", overflow)
+        self._merge_rollups(rollups)
+        for collection, documents in states.items():
+            # State staged since the failed flush is newer and wins
+            for document_id, document in documents.items():
+                self._states.setdefault(collection, {}).setdefault(document_id, document)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "send_records": len(self._entries),
+            "rollups": len(self._rollups),
+            "states": sum(len(documents) for documents in self._states.values()),
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "dropped": self.dropped,
+        }
+
+send_writer = WriteBehindBuffer()
+register_memory_reporter('write_behind', send_writer.stats)
+
+async def rebuild_send_rollups():
+    """Recompute the rollups of the periods ``send_log`` still fully covers
+
+    Rollups outlive the log (``SEND_ROLLUP_TTL_DAYS`` against
+    ``SEND_LOG_TTL_DAYS``), so older periods are left as they are, and so is
+    the day at the edge of the log's retention, which may be partly expired.
+    """
+    await send_writer.flush()
+    match: Dict[str, Any] = {}
+    if SEND_LOG_TTL_DAYS > 0:
+        edge = rollup_period(datetime.utcnow() - timedelta(days=SEND_LOG_TTL_DAYS), "day")
+        match["sent_at"] = {"$gte": edge + timedelta(days=1)}
+    for scope, (field, unit) in ROLLUP_SCOPES.items():
+        key = f"${field}" if field else {"$literal": "all"}
+        pipeline = [
+            {"$match": {**match, field: {"$ne": None}} if field else match},
+            {"$group": {
+                "_id": {"key": key, "period": {"$dateTrunc": {"date": "$sent_at", "unit": unit}}},
+                "sent": {"$sum": {"$cond": [{"$eq": ["$status", "sent"]}, 1, 0]}},
+                "failed": {"$sum": {"$cond": [{"$eq": ["$status", "sent"]}, 0, 1]}},
+                "flood_waits": {"$sum": {"$cond": [{"$gt": ["$flood_wait_seconds", 0]}, 1, 0]}},
+                "flood_wait_seconds": {"$sum": {"$ifNull": ["$flood_wait_seconds", 0]}},
+                "latency_ms_total": {"$sum": {"$ifNull": ["$latency_ms", 0]}},
+                "latency_samples": {"$sum": {"$cond": [{"$isNumber": "$latency_ms"}, 1, 0]}},
+                "latency_ms_max": {"$max": "$latency_ms"},
+            }},
+            {"$project": {
+                "_id": {"$concat": [f"{scope}:", "$_id.key", ":",
+                                    {"$dateToString": {"date": "$_id.period", "format": "%Y-%m-%dT%H"}}]},
+                "scope": {"$literal": scope}, "key": "$_id.key", "period": "$_id.period",
+                "sent": 1, "failed": 1, "flood_waits": 1, "flood_wait_seconds": 1,
+                "latency_ms_total": 1, "latency_samples": 1, "latency_ms_max": 1,
+            }},
+            {"$merge": {"into": "send_rollups", "whenMatched": "replace"}},
+        ]
+        await db.send_log.aggregate(pipeline).to_list(None)
+    logger.info("Rebuilt send rollups: %d documents", await db.send_rollups.count_documents({}))
+
+def _rollup_from_document(period: datetime, document: Optional[Dict[str, Any]]) -> SendRollup:
+    if not document:
+        return SendRollup(period=period)
+    attempts = document.get("sent", 0) + document.get("failed", 0)
+    samples = document.get("latency_samples", 0)
+    return SendRollup(
+        period=period,
+        sent=document.get("sent", 0),
+        failed=document.get("failed", 0),
+        flood_waits=document.get("flood_waits", 0),
+        flood_wait_seconds=document.get("flood_wait_seconds", 0),
+        avg_latency_ms=document["latency_ms_total"] / samples if samples else None,
+        max_latency_ms=document.get("latency_ms_max"),
+        success_rate=document.get("sent", 0) / attempts if attempts else None,
+    )
+
+async def read_rollups(scope: str, periods: List[datetime], key: str = "all",
+                       database: Optional[TracedDatabase] = None) -> List[SendRollup]:
+    """One rollup per period, zero-filled where nothing was sent; reads the primary unless given ``database``"""
+    ids = [rollup_id(scope, key, period) for period in periods]
+    database = database or db
+    documents = {document["_id"]: document for document in await database.send_rollups.find({"_id": {"$in": ids}}).to_list(None)}
+    return [_rollup_from_document(period, documents.get(document_id)) for period, document_id in zip(periods, ids)]
+
+SEND_ROLLUP_HOURLY_DAYS = int(os.environ.get('SEND_ROLLUP_HOURLY_DAYS', '30'))  # hourly buckets kept; daily ones cover the rest
+
+async def prune_hourly_rollups():
+    """Drop hourly rollups older than the hourly charts reach"""
+    cutoff = datetime.utcnow() - timedelta(days=SEND_ROLLUP_HOURLY_DAYS)
+    result = await db.send_rollups.delete_many({"scope": "hour", "period": {"$lt": cutoff}})
+    if result.deleted_count:
+        logger.info("Pruned %d hourly send rollups", result.deleted_count)
+
+async def sent_today() -> int:
+    today = rollup_period(datetime.utcnow(), "day")
+    return (await read_rollups("day", [today]))[0].sent
+
+# ========================== AUTOMATION ENGINE ==========================
+
+ENGINE_DRAIN_TIMEOUT = float(os.environ.get('ENGINE_DRAIN_TIMEOUT', '20'))  # seconds an in-flight send may take at shutdown
+ENGINE_SYNC_OVERLAP = timedelta(seconds=float(os.environ.get('ENGINE_SYNC_OVERLAP', '5')))  # re-read window for late writes
+TOMBSTONE_TTL_DAYS = int(os.environ.get('TOMBSTONE_TTL_DAYS', '7'))
+
+async def record_tombstone(collection: str, document_id: str):
+    """Note a deletion so in-memory copies synced by ``updated_at`` can drop the document"""
+    await db.tombstones.insert_one({"collection": collection, "doc_id": document_id, "deleted_at": datetime.utcnow()})
+
+async def deleted_since(collection: str, since: datetime) -> List[str]:
+    return await db.tombstones.distinct("doc_id", {"collection": collection, "deleted_at": {"$gte": since}})
+
+ENGINE_MAX_FLOOD_WAIT = int(os.environ.get('ENGINE_MAX_FLOOD_WAIT', '900'))  # seconds; longer waits end the cycle
+ENGINE_MAX_ERRORS = 20
+DELAY_FIELDS = {"message_delay_min", "message_delay_max", "cycle_delay_min", "cycle_delay_max"}
+
+# Send failures that mean the group will never accept our messages
+PERMANENT_SEND_ERRORS = (ChatWriteForbiddenError, UserBannedInChannelError, ChannelPrivateError, ChatAdminRequiredError)
+
+async def blacklist_group(group_id: str, group_name: str, blacklist_type: str, reason: str,
+                          expires_at: Optional[datetime] = None):
+    """Add or refresh the blacklist entry for a group"""
+    entry_id = str(uuid.uuid4())
+    await db.blacklist.update_one(
+        {"group_id": group_id},
+        {
+            "$set": {
+                "group_name": group_name,
+                "blacklist_type": blacklist_type,
+                "reason": reason,
+                "expires_at": expires_at,
+            },
+            "$setOnInsert": {"_id": entry_id, "id": entry_id, "created_at": datetime.utcnow()},
+        },
+        upsert=True
+    )
+
+class AutomationEngine:
+    """Background send loop: each cycle sends one template to every usable group, pausing between sends"""
+
+    def __init__(self):
+        self.status = AutomationStatus()
+        self.config = AutomationConfig()  # pushed by automation_config_store; read on every send
+        self.groups = GroupRegistry()
+        self.templates: Dict[str, MessageTemplate] = {}
+        self._synced_at: Optional[datetime] = None  # watermark of the last group/template sync
+        self._stale = False
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event = asyncio.Event()
+        self._stats_day = datetime.utcnow().date()
+        # Position in the current cycle, kept so a restart can pick up where it stopped
+        self._cycle_id: Optional[str] = None
+        self._cycle_group_ids: List[str] = []
+        self._cycle_position = 0
+        self._next_cycle_at: Optional[datetime] = None
+        self._restored = False  # checkpoint() must not overwrite a state that was never loaded
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self.status.is_running = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Stop after the send in flight; past ``timeout`` seconds the send is cancelled"""
+        self._stop_event.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Engine did not stop within %ss, cancelling the send in flight", timeout)
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+
+    @property
+    def has_position(self) -> bool:
+        return bool(self._cycle_id or self._cycle_group_ids or self._next_cycle_at)
+
+    def forget_position(self):
+        """Drop the resume point so the next start plans a fresh cycle right away"""
+        self._cycle_id, self._cycle_group_ids, self._cycle_position = None, [], 0
+        self._next_cycle_at = None
+
+    def stage_checkpoint(self):
+        """Buffer counters and the unsent rest of the current cycle; written with the next write-behind flush"""
+        # Only the lease holder's state is current; any other worker's copy is stale
+        if not self._restored or not engine_lease.held:
+            return
+        send_writer.put_state("engine_state", "engine", {
+            "current_cycle": self.status.current_cycle,
+            "last_message_sent": self.status.last_message_sent,
+            "cycle_id": self._cycle_id,
+            "remaining_group_ids": self._cycle_group_ids[self._cycle_position:],
+            "next_cycle_at": self._next_cycle_at,
+            "saved_at": datetime.utcnow(),
+        })
+
+    async def checkpoint(self):
+        """Persist the engine state to ``engine_state`` now, with the send records buffered before it"""
+        self.stage_checkpoint()
+        await send_writer.flush()
+
+    async def restore_checkpoint(self):
+        """Reload what ``checkpoint`` saved; call before ``start``"""
+        state = await db.engine_state.find_one({"_id": "engine"})
+        self._restored = True
+        # The daily rollup counts sends from every worker and every earlier run
+        self._stats_day = datetime.utcnow().date()
+        self.status.messages_sent_today = await sent_today()
+        if not state:
+            return
+        self.status.current_cycle = state.get("current_cycle", 0)
+        self.status.last_message_sent = state.get("last_message_sent")
+        self._cycle_id = state.get("cycle_id")
+        self._cycle_group_ids = state.get("remaining_group_ids") or []
+        self._cycle_position = 0
+        self._next_cycle_at = state.get("next_cycle_at")
+        logger.info("Restored engine checkpoint: cycle %s, %d groups left, next cycle at %s",
+                    self._cycle_id, len(self._cycle_group_ids), self._next_cycle_at)
+
+    def apply_config(self, config: AutomationConfig):
+        """New delays take effect from the next send and the next gap between cycles"""
+        if self.config.dict(include=DELAY_FIELDS) != config.dict(include=DELAY_FIELDS):
+            logger.info("Engine delays updated: %s", config.dict(include=DELAY_FIELDS))
+        self.config = config
+        # Switched off on another worker: wind down after the send in flight
+        if not config.is_active and self.is_running:
+            self._stop_event.set()
+
+    def _record_error(self, message: str):
+        self.status.errors = (self.status.errors + [f"{datetime.utcnow().isoformat()} {message}"])[-ENGINE_MAX_ERRORS:]
+
+    async def _pause(self, seconds: float) -> bool:
+        """Sleep unless asked to stop; returns False when interrupted"""
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _run(self):
+        # The task copied the context of whatever started it, often a request; sends open traces of their own
+        current_span_var.set(None)
+        request_id_var.set(None)
+        try:
+            # After a restart, wait out the delay the previous process was in instead of starting over
+            if not self._cycle_group_ids and self._next_cycle_at:
+                self.status.next_cycle_at = self._next_cycle_at
+                delay = (self._next_cycle_at - datetime.utcnow()).total_seconds()
+                if delay > 0 and not await self._pause(delay):
+                    return
+            while not self._stop_event.is_set():
+                try:
+                    await self._run_cycle()
+                except Exception as e:
+                    logger.exception("Automation cycle failed")
+                    self._record_error(f"Cycle failed: {e}")
+                if self._stop_event.is_set():
+                    break
+                delay = random.uniform(self.config.cycle_delay_min, self.config.cycle_delay_max) * 3600
+                self._next_cycle_at = self.status.next_cycle_at = datetime.utcnow() + timedelta(seconds=delay)
+                await self.checkpoint()
+                if not await self._pause(delay):
+                    break
+        except Exception as e:
+            logger.exception("Automation engine stopped on error")
+            self._record_error(f"Engine stopped: {e}")
+        finally:
+            self.status.is_running = False
+            self.status.next_cycle_at = None
+
+    def mark_stale(self):
+        """Sync again before the next send; called by the invalidation bus"""
+        self._stale = self._synced_at is not None
+
+    def reset_sync(self):
+        """Force the next sync to reload everything, e.g. after a restore replaced the collections"""
+        self._synced_at = None
+
+    async def sync(self, session: Optional[MemorySession] = None):
+        """Bring the in-memory groups and templates up to date
+
+        The first sync (or one after tombstones may have expired) loads every
+        active document; later ones read only documents whose ``updated_at``
+        is past the watermark plus the tombstones of deletions since then.
+        """
+        started = datetime.utcnow()
+        since = self._synced_at
+        self._stale = False
+        if since is None or started - since > timedelta(days=TOMBSTONE_TTL_DAYS):
+            self.groups = await GroupRegistry.load(session)
+            self.templates = {
+                doc["id"]: MessageTemplate(**doc)
+                for doc in await db.message_templates.find({"is_active": True}).to_list(None)
+            }
+            logger.info("Loaded engine working set: %s groups, %s templates", len(self.groups), len(self.templates))
+        else:
+            since -= ENGINE_SYNC_OVERLAP
+            changed_groups = 0
+            async for document in db.group_targets.find({"updated_at": {"$gte": since}}, GroupRegistry.PROJECTION):
+                self.groups.apply_document(document, session)
+                changed_groups += 1
+            deleted_groups = await deleted_since("group_targets", since)
+            for group_id in deleted_groups:
+                self.groups.remove(group_id)
+            self.groups.compact()
+
+            changed_templates = await db.message_templates.find({"updated_at": {"$gte": since}}).to_list(None)
+            deleted_templates = await deleted_since("message_templates", since)
+            for doc in changed_templates:
+                if doc.get("is_active", True):
+                    self.templates[doc["id"]] = MessageTemplate(**doc)
+                else:
+                    self.templates.pop(doc["id"], None)
+            for template_id in deleted_templates:
+                self.templates.pop(template_id, None)
+            logger.info("Synced engine working set: %s/%s groups and %s/%s templates changed/deleted",
+                        changed_groups, len(deleted_groups), len(changed_templates), len(deleted_templates))
+        self._synced_at = started
+
+        # The blacklist is small and has no update timestamp; reapply it whole
+        self.groups.apply_blacklist(
+            await db.blacklist.find({}, {"_id": 0, "group_id": 1, "blacklist_type": 1, "expires_at": 1}).to_list(None)
+        )
+
+    async def plan_cycle(self, session: Optional[MemorySession] = None) -> Tuple[List[int], List[MessageTemplate]]:
+        """Sync the working set; returns slots of usable groups and the active templates"""
+        await cleanup_expired_blacklists()
+        await self.sync(session)
+        slots = self.groups.eligible()
+        templates = list(self.templates.values())
+        compiled_templates.retain(self.templates)
+
+        logger.info("Planned cycle: %s groups, %s skipped, %s templates",
+                    len(slots), len(self.groups) - len(slots), len(templates))
+        return slots, templates
+
+    async def _run_cycle(self):
+        client = await get_connected_client()
+        if not client:
+            self._record_error("Telegram client is not authenticated")
+            self._stop_event.set()
+            return
+
+        # Refresh stale preflight results so the plan can skip groups that cannot be used
+        await run_group_preflight()
+
+        resuming = bool(self._cycle_group_ids)
+        if not resuming:
+            self.status.current_cycle += 1
+            self._cycle_id = f"{self.status.current_cycle}-{uuid.uuid4().hex[:8]}"
+        cycle_id = self._cycle_id
+        token = cycle_id_var.set(cycle_id)
+        try:
+            slots, templates = await self.plan_cycle(client.session)
+            if not templates:
+                self._record_error("No active message templates")
+                return
+
+            # Slots move when the registry compacts; hold ids across mid-cycle syncs
+            if resuming:
+                logger.info("Resuming cycle %s with %d groups left", cycle_id, len(self._cycle_group_ids))
+            else:
+                self._cycle_group_ids = [self.groups.ids[slot] for slot in slots]
+            self._cycle_position = 0
+            self._next_cycle_at = None
+            group_ids = self._cycle_group_ids
+            for index, group_id in enumerate(group_ids):
+                self._cycle_position = index
+                if self._stop_event.is_set():
+                    break
+                if self._stale:
+                    # Groups, templates or the blacklist changed since the plan, here or on another worker
+                    await self.sync(client.session)
+                    templates = list(self.templates.values())
+                    if not templates:
+                        self._record_error("No active message templates")
+                        break
+                slot = self.groups.slot(group_id)
+                if slot is None or not self.groups.is_eligible(slot):
+                    continue
+                flood_wait = await self._send(client, slot, random.choice(templates), cycle_id)
+                self._cycle_position = index + 1
+                self.stage_checkpoint()
+                if flood_wait:
+                    if flood_wait > ENGINE_MAX_FLOOD_WAIT or not await self._pause(flood_wait):
+                        break
+                elif index < len(group_ids) - 1:
+                    if not await self._pause(random.uniform(self.config.message_delay_min, self.config.message_delay_max)):
+                        break
+            else:
+                self._cycle_position = len(group_ids)
+        finally:
+            cycle_id_var.reset(token)
+            # Anything but a stop request finishes the cycle; a stop leaves the rest for a restart
+            if not self._stop_event.is_set():
+                self._cycle_group_ids, self._cycle_position = [], 0
+
+    async def _send(self, client: TelegramClient, slot: int, template: MessageTemplate, cycle_id: str) -> int:
+        """Send one message and record the outcome; returns an account-level flood wait in seconds, if any"""
+        group_id, group_name = self.groups.ids[slot], self.groups.names[slot]
+        entry = SendLogEntry(group_id=group_id, template_id=template.id, status="sent", cycle_id=cycle_id)
+        flood_wait = 0
+        started = time.perf_counter()
+        with trace_span("engine.send", kind='PRODUCER', root=True, **{
+            'group.id': group_id, 'template.id': template.id, 'cycle.id': cycle_id,
+        }):
+            try:
+                target = self.groups.send_target(slot)
+                for text, entities in compiled_templates.parts(template):
+                    with trace_span("telegram.send_message", kind='CLIENT'):
+                        await client.send_message(target, text, formatting_entities=entities)
+                self._count_sent()
+                send_logger.info("Sent template %s to %s", template.id, group_name)
+            except SlowModeWaitError as e:
+                entry.status, entry.error = "failed", str(e)
+                self.groups.defer(slot, time.time() + e.seconds)
+                await blacklist_group(group_id, group_name, "temporary", f"Slow mode: wait {e.seconds}s",
+                                      datetime.utcnow() + timedelta(seconds=e.seconds))
+            except FloodWaitError as e:
+                entry.status, entry.error, entry.flood_wait_seconds = "failed", str(e), e.seconds
+                flood_wait = e.seconds
+                self._record_error(f"Flood wait of {e.seconds}s")
+            except PERMANENT_SEND_ERRORS as e:
+                entry.status, entry.error = "failed", str(e)
+                self.groups.set_flag(slot, GROUP_BLACKLISTED)
+                await blacklist_group(group_id, group_name, "permanent", str(e))
+                send_logger.warning("Cannot send to %s, blacklisted: %s", group_name, e)
+            except Exception as e:
+                entry.status, entry.error = "failed", str(e)
+                send_logger.warning("Failed to send to %s: %s", group_name, e)
+        entry.latency_ms = (time.perf_counter() - started) * 1000
+        send_writer.add_send(entry)
+        return flood_wait
+
+    def _count_sent(self):
+        today = datetime.utcnow().date()
+        if today != self._stats_day:
+            self._stats_day = today
+            self.status.messages_sent_today = 0
+        self.status.messages_sent_today += 1
+        self.status.last_message_sent = datetime.utcnow()
+
+automation_engine = AutomationEngine()
+automation_config_store.subscribe(automation_engine.apply_config)
+invalidation_bus.subscribe("automation_config", lambda _: automation_config_store.invalidate())
+for _collection in ("group_targets", "message_templates", "blacklist"):
+    invalidation_bus.subscribe(_collection, lambda _: automation_engine.mark_stale())
+register_memory_reporter('group_registry', lambda: automation_engine.groups.memory_usage())
+
+# ========================== API ENDPOINTS ==========================
+
+# Root endpoint
+@api_router.get("/")
+async def root():
+    return {"message": "Telegram Automation System API", "version": "2.0.0"}
+
+@api_router.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Ready once startup warm-up has finished; 503 while starting or draining"""
+    body = {"status": lifecycle.phase, "warmup": lifecycle.warmup}
+    if lifecycle.phase != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+# ========================== TELEGRAM CONFIGURATION ==========================
+
+@api_router.post("/telegram/config", response_model=TelegramConfig)
+async def create_telegram_config(config_data: TelegramConfigCreate):
+    """Create or update Telegram configuration"""
+    existing_config = await get_telegram_config()
+    
+    if existing_config:
+        # Update existing config
+        existing_config.api_id = config_data.api_id
+        existing_config.api_hash = config_data.api_hash
+        existing_config.phone_number = config_data.phone_number
+        existing_config.is_authenticated = False
+        existing_config.session_string = None
+        config = existing_config
+    else:
+        # Create new config
+        config = TelegramConfig(**config_data.dict())
+    
+    await save_telegram_config(config)
+    
+    # Initialize client for testing
+    await initialize_telegram_client()
+    
     return config
 
-# ========================== TELEGRAM AUTHENTICATION ==========================
+@api_router.get("/telegram/config", response_model=Optional[TelegramConfig])
+async def get_current_telegram_config():
+    """Get current Telegram configuration"""
+    config = await get_telegram_config()
+    if config:
+        # Don't return sensitive data
+        config.api_hash = "***HIDDEN***"
+        if config.session_string:
+            config.session_string = "***HIDDEN***"
+    return config
 
-@api_router.post("/telegram/send-code")
-async def send_auth_code():
-    """Send authentication code to phone number"""
+@api_router.put("/telegram/config", response_model=TelegramConfig)
+async def update_telegram_config(config_update: TelegramConfigUpdate):
+    """Update Telegram configuration"""
     config = await get_telegram_config()
     if not config:
         raise HTTPException(status_code=404, detail="Telegram configuration not found")
     
+    update_data = config_update.dict(exclude_unset=True)
+    for field, value in update_data.items():
+        setattr(config, field, value)
+    
+    if any([config_update.api_id, config_update.api_hash, config_update.phone_number]):
+        config.is_authenticated = False
+        config.session_string = None
+    
+    await save_telegram_config(config)
+    await initialize_telegram_client()
+    
+    # Don't return sensitive data
+    config.api_hash = "***HIDDEN***"
+    if config.session_string:
+        config.session_string = "***HIDDEN***"
+    
+    return config
+
+# ========================== TELEGRAM AUTHENTICATION ==========================
+
+AUTH_MAX_CONCURRENCY = int(os.environ.get('AUTH_MAX_CONCURRENCY', '2'))  # Telegram auth operations in flight
+AUTH_MAX_PENDING = int(os.environ.get('AUTH_MAX_PENDING', '20'))  # queued + running before new jobs are refused
+AUTH_JOB_RETENTION = 900  # seconds a finished job stays pollable
+AUTH_EVENT_KEEPALIVE = 15  # seconds between SSE keepalive comments
+AUTH_JOB_POLL_INTERVAL = 0.5  # seconds between reads when streaming a job another worker runs
+AUTH_JOB_TERMINAL = ("succeeded", "failed")
+
+current_auth_job_var: ContextVar[Optional[AuthJob]] = ContextVar('current_auth_job', default=None)
+
+class AuthJobRunner:
+    """Runs Telegram login steps as background jobs under a concurrency cap
+
+    The HTTP request only validates input and returns the job; the MTProto
+    connect and RPCs run here, so request latency does not follow Telegram's.
+    Every state change is also written to ``auth_jobs``, so a poll or event
+    stream that lands on another worker than the one running the job reads
+    it from there.
+    """
+
+    def __init__(self, max_concurrency: int, max_pending: int):
+        self.jobs: Dict[str, AuthJob] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_pending = max_pending
+        self._listeners: Dict[str, List[asyncio.Queue]] = {}
+        self._tasks: set = set()
+        self._versions: Dict[str, int] = {}
+
+    def submit(self, operation: str, work) -> AuthJob:
+        """Queue ``work`` (a coroutine function returning the result dict) as a new job"""
+        self._prune()
+        pending = sum(1 for job in self.jobs.values() if job.status not in AUTH_JOB_TERMINAL)
+        if pending >= self._max_pending:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many authentication operations in progress. Please retry shortly.",
+                headers={"Retry-After": "5"}
+            )
+
+        job = AuthJob(operation=operation)
+        self.jobs[job.id] = job
+        self._publish(job)
+        task = asyncio.create_task(self._run(job, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: AuthJob, work):
+        async with self._semaphore:
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            self._publish(job)
+            current_auth_job_var.set(job)
+            # The submitting request's trace is exported before the job ends; the job gets a trace of its own
+            with trace_span(f"auth.{job.operation}", root=True, **{'auth.job.id': job.id}) as span:
+                try:
+                    job.result = await work()
+                    job.status = "succeeded"
+                except HTTPException as e:
+                    job.status, job.error, job.status_code = "failed", e.detail, e.status_code
+                except Exception as e:
+                    logger.exception("Auth job %s failed", job.id)
+                    job.status, job.error, job.status_code = "failed", str(e), 500
+                finally:
+                    job.finished_at = datetime.utcnow()
+                    await self._publish(job)
+                    if span and job.error:
+                        span.error = job.error
+
+    def progress(self, stage: str):
+        """Record a progress stage on the job running in the current task, if any"""
+        job = current_auth_job_var.get()
+        if job:
+            job.progress.append(stage)
+            self._publish(job)
+
+    def _publish(self, job: AuthJob) -> asyncio.Task:
+        for listener in self._listeners.get(job.id, []):
+            listener.put_nowait(job.json())
+        self._versions[job.id] = version = self._versions.get(job.id, 0) + 1
+        task = asyncio.create_task(self._store(job.copy(deep=True), version))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _store(self, job: AuthJob, version: int):
+        document = to_document(job)
+        document["version"] = version
+        document["expires_at"] = datetime.utcnow() + timedelta(seconds=AUTH_JOB_RETENTION)
+        try:
+            # Writes can finish out of order; one older than what is stored matches nothing and is dropped
+            await db.auth_jobs.replace_one({"_id": job.id, "version": {"$lt": version}}, document, upsert=True)
+        except DuplicateKeyError:
+            pass
+        except PyMongoError as e:
+            logger.warning("Failed to store auth job %s: %s", job.id, e)
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=AUTH_JOB_RETENTION)
+        for job_id in [job.id for job in self.jobs.values() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+            self._versions.pop(job_id, None)
+
+    async def _load(self, job_id: str) -> Optional[Tuple[AuthJob, int]]:
+        document = await db.auth_jobs.find_one({"_id": job_id})
+        return (AuthJob(**document), document["version"]) if document else None
+
+    async def get(self, job_id: str) -> AuthJob:
+        """The job from this worker, or as last stored by the worker running it"""
+        job = self.jobs.get(job_id)
+        if not job:
+            stored = await self._load(job_id)
+            if not stored:
+                raise HTTPException(status_code=404, detail="Authentication job not found")
+            job = stored[0]
+        return job
+
+    async def stream(self, job_id: str) -> AsyncIterator[str]:
+        """Server-sent events: the current state, then every update until the job finishes"""
+        if job_id not in self.jobs:
+            async for event in self._stream_stored(job_id):
+                yield event
+            return
+        job = self.jobs[job_id]
+        listener: asyncio.Queue = asyncio.Queue()
+        self._listeners.setdefault(job_id, []).append(listener)
+        try:
+            yield f"data: {job.json()}\n\n"
+            # Keep draining after the job finishes so the final update is delivered
+            while job.status not in AUTH_JOB_TERMINAL or not listener.empty():
+                try:
+                    payload = await asyncio.wait_for(listener.get(), timeout=AUTH_EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {payload}\n\n"
+        finally:
+            self._listeners[job_id].remove(listener)
+            if not self._listeners[job_id]:
+                del self._listeners[job_id]
+
+    async def _stream_stored(self, job_id: str) -> AsyncIterator[str]:
+        """Follow a job running on another worker through its stored document"""
+        version, quiet = 0, 0.0
+        while True:
+            stored = await self._load(job_id)
+            if not stored:
+                return
+            job, stored_version = stored
+            if stored_version != version:
+                version, quiet = stored_version, 0.0
+                yield f"data: {job.json()}\n\n"
+                if job.status in AUTH_JOB_TERMINAL:
+                    return
+            elif quiet >= AUTH_EVENT_KEEPALIVE:
+                quiet = 0.0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(AUTH_JOB_POLL_INTERVAL)
+            quiet += AUTH_JOB_POLL_INTERVAL
+
+auth_jobs = AuthJobRunner(AUTH_MAX_CONCURRENCY, AUTH_MAX_PENDING)
+register_memory_reporter('auth_jobs', lambda: {
+    "jobs": len(auth_jobs.jobs),
+    "tasks": len(auth_jobs._tasks),
+    "sse_listeners": sum(len(queues) for queues in auth_jobs._listeners.values()),
+    "sse_buffered_events": sum(q.qsize() for queues in auth_jobs._listeners.values() for q in queues),
+})
+
+async def _send_auth_code(config: TelegramConfig) -> Dict[str, Any]:
+    """Connect and request a login code; runs as an auth job"""
     try:
         client = await initialize_telegram_client()
         if not client:
             raise HTTPException(status_code=400, detail="Failed to initialize Telegram client")
         
-        await client.connect()
-        logging.info(f"Telethon client connected for phone: {config.phone_number}")
+        auth_jobs.progress("connecting")
+        with trace_span("telegram.connect", kind='CLIENT'):
+            await client.connect()
+        logger.info("Telethon client connected for phone: %s", config.phone_number)
         
-        sent_code = await client.send_code_request(config.phone_number)
-        logging.info(f"SMS code sent successfully, phone_code_hash: {sent_code.phone_code_hash[:10]}...")
+        auth_jobs.progress("requesting_code")
+        with trace_span("telegram.send_code_request", kind='CLIENT'):
+            sent_code = await client.send_code_request(config.phone_number)
+        logger.debug("SMS code sent successfully, phone_code_hash: %s...", sent_code.phone_code_hash[:10])
         
         # Get session string to persist for verify-code endpoint
         session_string = client.session.save()
-        logging.info(f"Session string saved for continuity: {session_string[:20]}...")
+        logger.debug("Session string saved for continuity: %s...", session_string[:20])
         
         # Store phone_code_hash AND session_string for later use
         current_time = datetime.utcnow()
-        logging.info(f"Storing temp_auth with session for phone: {config.phone_number}")
+        logger.info("Storing temp_auth with session for phone: %s", config.phone_number)
         
         result = await db.temp_auth.replace_one(
             {"phone_number": config.phone_number},
@@ -437,10 +2932,10 @@ async def send_auth_code():
             },
             upsert=True
         )
-        logging.info(f"Database write result: matched={result.matched_count}, modified={result.modified_count}, upserted={result.upserted_id}")
+        logger.debug("Database write result: matched=%s, modified=%s, upserted=%s", result.matched_count, result.modified_count, result.upserted_id)
         
         await client.disconnect()
-        logging.info(f"Authentication code sent successfully for phone: {config.phone_number}")
+        logger.info("Authentication code sent successfully for phone: %s", config.phone_number)
         return {
             "success": True, 
             "message": "Authentication code sent successfully", 
@@ -448,64 +2943,40 @@ async def send_auth_code():
         }
     
     except Exception as e:
-        logging.error(f"Failed to send auth code: {e}")
+        logger.error("Failed to send auth code: %s", e)
         raise HTTPException(status_code=400, detail=f"Failed to send auth code: {str(e)}")
 
-@api_router.post("/telegram/verify-code")
-async def verify_auth_code(auth_request: AuthRequest):
-    """Verify authentication code and complete login"""
-    logging.info(f"Starting verification for code: {auth_request.phone_code[:3]}***")
-    
-    config = await get_telegram_config()
-    if not config:
-        raise HTTPException(status_code=404, detail="Telegram configuration not found")
-    
-    # Get stored phone_code_hash with timeout check
-    temp_auth = await db.temp_auth.find_one({"phone_number": config.phone_number})
-    if not temp_auth:
-        logging.warning(f"No temp_auth found for phone: {config.phone_number}")
-        raise HTTPException(status_code=400, detail="No pending authentication found. Please request a new verification code.")
-    
-    # Log temp_auth details for debugging
-    logging.info(f"Found temp_auth - Created: {temp_auth.get('created_at')}, Expires: {temp_auth.get('expires_at')}")
-    
-    # Check if temp_auth has expired (beyond our application timeout) with buffer
-    current_time = datetime.utcnow()
-    if 'expires_at' in temp_auth and temp_auth['expires_at'] < current_time:
-        # Log the timing details for debugging
-        logging.warning(f"Authentication expired - Current: {current_time}, Expires: {temp_auth['expires_at']}")
-        # Clean up expired temp auth
-        await db.temp_auth.delete_one({"phone_number": config.phone_number})
-        raise HTTPException(status_code=400, detail="The verification session has expired. Please request a new verification code.")
-    
+async def _verify_auth_code(config: TelegramConfig, temp_auth: Dict[str, Any], phone_code: str) -> Dict[str, Any]:
+    """Sign in with the received code; runs as an auth job"""
     try:
         # Use the SAME session from send-code to maintain continuity
-        session_string = temp_auth.get('session_string')
-        if not session_string:
-            logging.error("No session_string found in temp_auth - session continuity broken")
-            raise HTTPException(status_code=400, detail="Authentication session invalid. Please request a new verification code.")
-        
-        logging.info(f"Using stored session for continuity: {session_string[:20]}...")
+        session_string = temp_auth['session_string']
+        logger.debug("Using stored session for continuity: %s...", session_string[:20])
         client = await initialize_telegram_client(session_string=session_string)
         if not client:
             raise HTTPException(status_code=400, detail="Failed to initialize Telegram client with session")
         
-        await client.connect()
-        logging.info(f"Client connected with stored session for phone: {config.phone_number}")
+        auth_jobs.progress("connecting")
+        with trace_span("telegram.connect", kind='CLIENT'):
+            await client.connect()
+        logger.info("Client connected with stored session for phone: %s", config.phone_number)
         
         try:
             # Use correct parameter order according to Telethon docs with session continuity
-            logging.info(f"Attempting sign_in with phone_code_hash: {temp_auth['phone_code_hash'][:10]}...")
-            signed_in = await client.sign_in(
-                config.phone_number,
-                auth_request.phone_code,
-                phone_code_hash=temp_auth['phone_code_hash']
-            )
-            logging.info(f"Sign-in successful for phone: {config.phone_number}")
+            logger.debug("Attempting sign_in with phone_code_hash: %s...", temp_auth['phone_code_hash'][:10])
+            auth_jobs.progress("signing_in")
+            with trace_span("telegram.sign_in", kind='CLIENT'):
+                signed_in = await client.sign_in(
+                    config.phone_number,
+                    phone_code,
+                    phone_code_hash=temp_auth['phone_code_hash']
+                )
+            logger.info("Sign-in successful for phone: %s", config.phone_number)
             
             # Fetch user profile information
+            auth_jobs.progress("fetching_profile")
             user_profile = await fetch_user_profile(client)
-            logging.info(f"Fetched user profile: {user_profile.first_name} (@{user_profile.username})")
+            logger.info("Fetched user profile: %s (@%s)", user_profile.first_name, user_profile.username)
             
             # Get session string and save with user profile
             session_string = client.session.save()
@@ -514,6 +2985,7 @@ async def verify_auth_code(auth_request: AuthRequest):
             config.user_profile = user_profile
             config.updated_at = datetime.utcnow()
             await save_telegram_config(config)
+            await store_live_session(session_string)
             
             await client.disconnect()
             
@@ -528,7 +3000,7 @@ async def verify_auth_code(auth_request: AuthRequest):
             
         except SessionPasswordNeededError:
             # Don't disconnect - we need to maintain the session for 2FA
-            logging.info(f"2FA required for phone: {config.phone_number} - keeping session alive")
+            logger.info("2FA required for phone: %s - keeping session alive", config.phone_number)
             
             # Update temp_auth to indicate 2FA state and keep client session
             current_time = datetime.utcnow()
@@ -559,16 +3031,16 @@ async def verify_auth_code(auth_request: AuthRequest):
                 pass
     
     except PhoneCodeInvalidError as e:
-        logging.error(f"Invalid phone code: {e}")
+        logger.error("Invalid phone code: %s", e)
         # Don't clean up temp_auth for invalid code - allow retry
         raise HTTPException(status_code=400, detail="The verification code you entered is incorrect. Please check the code and try again.")
     except PhoneCodeExpiredError as e:
-        logging.error(f"Expired phone code: {e}")
+        logger.error("Expired phone code: %s", e)
         # Clean up expired temp auth and force user to request new code
         await db.temp_auth.delete_one({"phone_number": config.phone_number})
         raise HTTPException(status_code=400, detail="The verification code has expired. Please request a new verification code to continue.")
     except Exception as e:
-        logging.error(f"Failed to verify auth code: {e}")
+        logger.error("Failed to verify auth code: %s", e)
         # For unknown errors, also clean up to force fresh start
         try:
             await db.temp_auth.delete_one({"phone_number": config.phone_number})
@@ -576,46 +3048,33 @@ async def verify_auth_code(auth_request: AuthRequest):
             pass
         raise HTTPException(status_code=400, detail="Authentication failed. Please request a new verification code and try again.")
 
-@api_router.post("/telegram/verify-2fa")
-async def verify_2fa_password(two_fa_auth: TwoFactorAuth):
-    """Verify 2FA password with session continuity"""
-    logging.info(f"Starting 2FA verification")
-    
-    config = await get_telegram_config()
-    if not config:
-        raise HTTPException(status_code=404, detail="Telegram configuration not found")
-    
-    # Get stored session from temp_auth for continuity
-    temp_auth = await db.temp_auth.find_one({"phone_number": config.phone_number})
-    if not temp_auth or not temp_auth.get('session_string'):
-        logging.error("No session_string found for 2FA - session continuity broken")
-        raise HTTPException(status_code=400, detail="Authentication session invalid. Please restart authentication process.")
-    
-    # Verify this is actually a 2FA state
-    if not temp_auth.get('requires_2fa'):
-        logging.error("2FA not required for this session")
-        raise HTTPException(status_code=400, detail="2FA not required. Please complete phone verification first.")
-    
+async def _verify_2fa_password(config: TelegramConfig, temp_auth: Dict[str, Any], password: str) -> Dict[str, Any]:
+    """Complete a 2FA login; runs as an auth job"""
     try:
         # Use the SAME session from verify-code step that's in 2FA state
         session_string = temp_auth['session_string']
-        logging.info(f"Using 2FA session for password verification: {session_string[:20]}...")
+        logger.debug("Using 2FA session for password verification: %s...", session_string[:20])
         
         client = await initialize_telegram_client(session_string=session_string)
         if not client:
             raise HTTPException(status_code=400, detail="Failed to initialize Telegram client with 2FA session")
         
-        await client.connect()
-        logging.info(f"Client connected with 2FA session for phone: {config.phone_number}")
+        auth_jobs.progress("connecting")
+        with trace_span("telegram.connect", kind='CLIENT'):
+            await client.connect()
+        logger.info("Client connected with 2FA session for phone: %s", config.phone_number)
         
         # Complete 2FA authentication - client should be in password-needed state
-        logging.info(f"Attempting 2FA password verification...")
-        signed_in = await client.sign_in(password=two_fa_auth.password)
-        logging.info(f"2FA authentication successful!")
+        logger.info("Attempting 2FA password verification...")
+        auth_jobs.progress("signing_in")
+        with trace_span("telegram.sign_in_2fa", kind='CLIENT'):
+            signed_in = await client.sign_in(password=password)
+        logger.info("2FA authentication successful!")
         
         # Fetch user profile information
+        auth_jobs.progress("fetching_profile")
         user_profile = await fetch_user_profile(client)
-        logging.info(f"Fetched user profile: {user_profile.first_name} (@{user_profile.username})")
+        logger.info("Fetched user profile: %s (@%s)", user_profile.first_name, user_profile.username)
         
         # Get session string and save with user profile
         session_string = client.session.save()
@@ -624,6 +3083,7 @@ async def verify_2fa_password(two_fa_auth: TwoFactorAuth):
         config.user_profile = user_profile
         config.updated_at = datetime.utcnow()
         await save_telegram_config(config)
+        await store_live_session(session_string)
         
         await client.disconnect()
         
@@ -638,46 +3098,113 @@ async def verify_2fa_password(two_fa_auth: TwoFactorAuth):
     except PasswordHashInvalidError:
         raise HTTPException(status_code=400, detail="Invalid 2FA password")
     except Exception as e:
-        logging.error(f"Failed to verify 2FA: {e}")
+        logger.error("Failed to verify 2FA: %s", e)
         raise HTTPException(status_code=400, detail=f"Failed to verify 2FA: {str(e)}")
 
-@api_router.get("/telegram/status")
-async def get_telegram_status():
-    """Get Telegram authentication status"""
+@api_router.post("/telegram/send-code", response_model=AuthJob, status_code=202)
+async def send_auth_code():
+    """Send authentication code to phone number (returns a job to poll)"""
+    config = await get_telegram_config()
+    if not config:
+        raise HTTPException(status_code=404, detail="Telegram configuration not found")
+    
+    return auth_jobs.submit("send_code", lambda: _send_auth_code(config))
+
+@api_router.post("/telegram/verify-code", response_model=AuthJob, status_code=202)
+async def verify_auth_code(auth_request: AuthRequest):
+    """Verify authentication code and complete login (returns a job to poll)"""
+    logger.info("Starting verification for code: %s***", auth_request.phone_code[:3])
+    
+    config = await get_telegram_config()
+    if not config:
+        raise HTTPException(status_code=404, detail="Telegram configuration not found")
+    
+    # Get stored phone_code_hash with timeout check
+    temp_auth = await db.temp_auth.find_one({"phone_number": config.phone_number})
+    if not temp_auth:
+        logger.warning("No temp_auth found for phone: %s", config.phone_number)
+        raise HTTPException(status_code=400, detail="No pending authentication found. Please request a new verification code.")
+    
+    # Log temp_auth details for debugging
+    logger.info("Found temp_auth - Created: %s, Expires: %s", temp_auth.get('created_at'), temp_auth.get('expires_at'))
+    
+    # Check if temp_auth has expired (beyond our application timeout) with buffer
+    current_time = datetime.utcnow()
+    if 'expires_at' in temp_auth and temp_auth['expires_at'] < current_time:
+        # Log the timing details for debugging
+        logger.warning("Authentication expired - Current: %s, Expires: %s", current_time, temp_auth['expires_at'])
+        # Clean up expired temp auth
+        await db.temp_auth.delete_one({"phone_number": config.phone_number})
+        raise HTTPException(status_code=400, detail="The verification session has expired. Please request a new verification code.")
+    
+    if not temp_auth.get('session_string'):
+        logger.error("No session_string found in temp_auth - session continuity broken")
+        raise HTTPException(status_code=400, detail="Authentication session invalid. Please request a new verification code.")
+    
+    return auth_jobs.submit("verify_code", lambda: _verify_auth_code(config, temp_auth, auth_request.phone_code))
+
+@api_router.post("/telegram/verify-2fa", response_model=AuthJob, status_code=202)
+async def verify_2fa_password(two_fa_auth: TwoFactorAuth):
+    """Verify 2FA password with session continuity (returns a job to poll)"""
+    logger.info("Starting 2FA verification")
+    
     config = await get_telegram_config()
     if not config:
-        return {"authenticated": False, "phone_number": None}
+        raise HTTPException(status_code=404, detail="Telegram configuration not found")
+    
+    # Get stored session from temp_auth for continuity
+    temp_auth = await db.temp_auth.find_one({"phone_number": config.phone_number})
+    if not temp_auth or not temp_auth.get('session_string'):
+        logger.error("No session_string found for 2FA - session continuity broken")
+        raise HTTPException(status_code=400, detail="Authentication session invalid. Please restart authentication process.")
+    
+    # Verify this is actually a 2FA state
+    if not temp_auth.get('requires_2fa'):
+        logger.error("2FA not required for this session")
+        raise HTTPException(status_code=400, detail="2FA not required. Please complete phone verification first.")
+    
+    return auth_jobs.submit("verify_2fa", lambda: _verify_2fa_password(config, temp_auth, two_fa_auth.password))
+
+@api_router.get("/telegram/auth-jobs/{job_id}", response_model=AuthJob)
+async def get_auth_job(job_id: str):
+    """Poll an authentication job"""
+    return await auth_jobs.get(job_id)
+
+@api_router.get("/telegram/auth-jobs/{job_id}/events")
+async def stream_auth_job_events(job_id: str):
+    """Stream authentication job progress as server-sent events"""
+    await auth_jobs.get(job_id)
+    return StreamingResponse(
+        auth_jobs.stream(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/telegram/status")
+async def get_telegram_status():
+    """Get Telegram authentication status"""
+    status, profile = await profile_cache.get()
+    if "has_session" not in status:
+        # No configuration stored yet
+        return status
     
     return {
-        "authenticated": config.is_authenticated,
-        "phone_number": config.phone_number,
-        "has_session": bool(config.session_string),
-        "user_profile": config.user_profile.dict() if config.user_profile else None
+        **status,
+        "user_profile": profile.dict() if profile else None
     }
 
 @api_router.get("/telegram/profile")
 async def get_user_profile():
     """Get user profile information"""
-    config = await get_telegram_config()
-    if not config or not config.is_authenticated:
+    status, profile = await profile_cache.get()
+    if not status.get("authenticated"):
         raise HTTPException(status_code=401, detail="User not authenticated")
     
-    if not config.user_profile:
-        # Try to fetch profile from current session if available
-        try:
-            client_key = f"{config.api_id}_{config.phone_number}"
-            if client_key in telegram_clients:
-                client = telegram_clients[client_key]
-                user_profile = await fetch_user_profile(client)
-                config.user_profile = user_profile
-                await save_telegram_config(config)
-                return user_profile.dict()
-        except Exception as e:
-            logging.error(f"Failed to fetch user profile: {e}")
-        
+    if not profile:
+        # The lease holder refreshes it in the background
         return {"message": "User profile not available"}
     
-    return config.user_profile.dict()
+    return profile.dict()
 
 @api_router.post("/telegram/logout")
 async def logout_telegram():
@@ -688,17 +3215,20 @@ async def logout_telegram():
         if not config:
             return {"message": "No active session found"}
         
-        # Disconnect and clean up active client if exists
-        client_key = f"{config.api_id}_{config.phone_number}"
-        if client_key in telegram_clients:
-            client = telegram_clients[client_key]
+        # Stop sending before the session goes away
+        await automation_engine.stop()
+        automation_engine.forget_position()
+        await automation_engine.checkpoint()
+        
+        # Disconnect and clean up active clients if they exist
+        for client_key in list(telegram_clients):
+            client = telegram_clients.pop(client_key)
             try:
                 if client.is_connected():
                     await client.disconnect()
-                del telegram_clients[client_key]
-                logging.info(f"Disconnected and removed client for {config.phone_number}")
+                logger.info("Disconnected and removed %s client for %s", client_key, config.phone_number)
             except Exception as e:
-                logging.warning(f"Error disconnecting client: {e}")
+                logger.warning("Error disconnecting client: %s", e)
         
         # Clear session data in database
         await db.telegram_config.update_one(
@@ -712,14 +3242,17 @@ async def logout_telegram():
             }
         )
         
+        await delete_stored_session(LIVE_SESSION_NAME)
+        profile_cache.invalidate()
+        
         # Clean up temporary auth data if exists
         await db.temp_auth.delete_many({"phone_number": config.phone_number})
         
-        logging.info(f"Successfully logged out user {config.phone_number}")
+        logger.info("Successfully logged out user %s", config.phone_number)
         return {"message": "Successfully logged out from Telegram"}
         
     except Exception as e:
-        logging.error(f"Error during logout: {e}")
+        logger.error("Error during logout: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to logout: {str(e)}")
 
 # ========================== MESSAGE TEMPLATES ==========================
@@ -728,19 +3261,23 @@ async def logout_telegram():
 async def create_message_template(message_data: MessageTemplateCreate):
     """Create a new message template"""
     message = MessageTemplate(**message_data.dict())
-    await db.message_templates.insert_one(message.dict())
+    try:
+        message.compiled = compile_template_content(message.content)
+    except TemplateCompileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.message_templates.insert_one(to_document(message))
     return message
 
 @api_router.get("/messages", response_model=List[MessageTemplate])
 async def get_message_templates():
     """Get all message templates"""
-    messages = await db.message_templates.find().to_list(1000)
+    messages = await read_db["browse"].message_templates.find().to_list(1000)
     return [MessageTemplate(**msg) for msg in messages]
 
 @api_router.get("/messages/{message_id}", response_model=MessageTemplate)
 async def get_message_template(message_id: str):
     """Get a specific message template"""
-    message = await db.message_templates.find_one({"id": message_id})
+    message = await db.message_templates.find_one({"_id": message_id})
     if not message:
         raise HTTPException(status_code=404, detail="Message template not found")
     return MessageTemplate(**message)
@@ -748,27 +3285,33 @@ async def get_message_template(message_id: str):
 @api_router.put("/messages/{message_id}", response_model=MessageTemplate)
 async def update_message_template(message_id: str, message_update: MessageTemplateUpdate):
     """Update a message template"""
-    existing_message = await db.message_templates.find_one({"id": message_id})
+    existing_message = await db.message_templates.find_one({"_id": message_id})
     if not existing_message:
         raise HTTPException(status_code=404, detail="Message template not found")
     
     update_data = message_update.dict(exclude_unset=True)
+    if update_data.get('content') is not None:
+        try:
+            update_data['compiled'] = compile_template_content(update_data['content']).dict()
+        except TemplateCompileError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     update_data['updated_at'] = datetime.utcnow()
     
     await db.message_templates.update_one(
-        {"id": message_id},
+        {"_id": message_id},
         {"$set": update_data}
     )
     
-    updated_message = await db.message_templates.find_one({"id": message_id})
+    updated_message = await db.message_templates.find_one({"_id": message_id})
     return MessageTemplate(**updated_message)
 
 @api_router.delete("/messages/{message_id}")
 async def delete_message_template(message_id: str):
     """Delete a message template"""
-    result = await db.message_templates.delete_one({"id": message_id})
+    result = await db.message_templates.delete_one({"_id": message_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Message template not found")
+    await record_tombstone("message_templates", message_id)
     return {"message": "Message template deleted successfully"}
 
 # ========================== GROUP TARGETS ==========================
@@ -784,7 +3327,7 @@ async def create_group_target(group_data: GroupTargetCreate):
         group_type=parsed_info['type'],
         is_active=group_data.is_active
     )
-    await db.group_targets.insert_one(group.dict())
+    await db.group_targets.insert_one(to_document(group))
     return group
 
 @api_router.post("/groups/bulk", response_model=List[GroupTarget])
@@ -797,7 +3340,7 @@ async def create_bulk_group_targets(bulk_data: GroupBulkImport):
             continue
             
         try:
-            parsed_info = parse_group_identifier(identifier.strip())
+            parsed_info = validate_group_identifier(identifier.strip())
             
             # Check if group already exists
             existing = await db.group_targets.find_one({"group_identifier": identifier.strip()})
@@ -810,164 +3353,1257 @@ async def create_bulk_group_targets(bulk_data: GroupBulkImport):
                 group_type=parsed_info['type'],
                 is_active=True
             )
-            await db.group_targets.insert_one(group.dict())
+            await db.group_targets.insert_one(to_document(group))
             created_groups.append(group)
             
         except Exception as e:
-            logging.error(f"Failed to create group {identifier}: {e}")
+            logger.error("Failed to create group %s: %s", identifier, e)
             continue
     
     return created_groups
 
-@api_router.get("/groups", response_model=List[GroupTarget])
-async def get_group_targets():
-    """Get all group targets"""
-    groups = await db.group_targets.find().to_list(1000)
-    return [GroupTarget(**group) for group in groups]
+PREVIEW_CHUNK_SIZE = 1000
+PREVIEW_MAX_REPORTED = 100
+
+async def _existing_identifiers(identifiers: List[str]) -> set:
+    """Stored identifiers among ``identifiers``: one covered ``$in`` query on the identifier index per chunk"""
+    chunks = [identifiers[start:start + PREVIEW_CHUNK_SIZE] for start in range(0, len(identifiers), PREVIEW_CHUNK_SIZE)]
+    results = await asyncio.gather(*(
+        db.group_targets.find({"group_identifier": {"$in": chunk}}, {"_id": 0, "group_identifier": 1}).to_list(None)
+        for chunk in chunks
+    ))
+    return {document["group_identifier"] for documents in results for document in documents}
+
+@api_router.post("/groups/bulk/preview", response_model=GroupImportPreview)
+async def preview_bulk_group_targets(request: Request):
+    """Dry run of the bulk import: what it would create, skip and reject, without writing anything
+
+    Takes the bulk import's JSON body, or plain text with one identifier per
+    line (optionally gzip-compressed), streamed.
+    """
+    started = time.perf_counter()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            lines = GroupBulkImport(**await request.json()).groups
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid bulk import body: {str(e).splitlines()[0]}")
+    else:
+        try:
+            lines = [line async for line in _iter_request_lines(request.stream())]
+        except (ValueError, zlib.error) as e:
+            raise HTTPException(status_code=400, detail=f"Failed to read import data: {str(e)}")
+        # A trailing newline is not a blank entry
+        if lines and not lines[-1]:
+            lines.pop()
+
+    blank = duplicates = 0
+    invalid_lines: List[GroupImportIssue] = []
+    invalid = 0
+    candidates: Dict[str, str] = {}  # identifier -> group_type, in input order
+    for number, line in enumerate(lines, 1):
+        identifier = line.strip()
+        if not identifier:
+            blank += 1
+        elif identifier in candidates:
+            duplicates += 1
+        else:
+            try:
+                candidates[identifier] = validate_group_identifier(identifier)['type']
+            except ValueError as e:
+                invalid += 1
+                if len(invalid_lines) < PREVIEW_MAX_REPORTED:
+                    invalid_lines.append(GroupImportIssue(line=number, identifier=identifier[:200], error=str(e)))
+
+    existing = await _existing_identifiers(list(candidates))
+    by_type: Dict[str, int] = {}
+    for identifier, group_type in candidates.items():
+        if identifier not in existing:
+            by_type[group_type] = by_type.get(group_type, 0) + 1
+
+    return GroupImportPreview(
+        lines=len(lines),
+        blank=blank,
+        invalid=invalid,
+        duplicates=duplicates,
+        existing=len(existing),
+        new=len(candidates) - len(existing),
+        by_type=by_type,
+        invalid_lines=invalid_lines,
+        computed_in_ms=(time.perf_counter() - started) * 1000,
+    )
+
+@api_router.post("/groups/preflight", response_model=PreflightStatus)
+async def start_group_preflight(background_tasks: BackgroundTasks, force: bool = False):
+    """Start a membership/permission check of active groups (only stale ones unless forced)"""
+    if not preflight_status.is_running:
+        background_tasks.add_task(_traced_preflight, force)
+    return preflight_status
+
+async def _traced_preflight(force: bool):
+    """Run a requested preflight in a trace of its own; the request's trace is exported before it ends"""
+    with trace_span("preflight.run", root=True, **{'preflight.force': force}):
+        await run_group_preflight(force)
+
+@api_router.get("/groups/preflight", response_model=PreflightStatus)
+async def get_group_preflight_status():
+    """Get progress of the current or last group preflight run"""
+    return preflight_status
+
+@api_router.get("/groups", response_model=List[GroupTarget])
+async def get_group_targets():
+    """Get all group targets"""
+    groups = await read_db["browse"].group_targets.find().to_list(1000)
+    return [GroupTarget(**group) for group in groups]
+
+@api_router.get("/groups/{group_id}", response_model=GroupTarget)
+async def get_group_target(group_id: str):
+    """Get a specific group target"""
+    group = await db.group_targets.find_one({"_id": group_id})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group target not found")
+    return GroupTarget(**group)
+
+@api_router.put("/groups/{group_id}", response_model=GroupTarget)
+async def update_group_target(group_id: str, group_update: GroupTargetUpdate):
+    """Update a group target"""
+    existing_group = await db.group_targets.find_one({"_id": group_id})
+    if not existing_group:
+        raise HTTPException(status_code=404, detail="Group target not found")
+    
+    update_data = group_update.dict(exclude_unset=True)
+    
+    # If identifier is updated, reparse it
+    if 'group_identifier' in update_data:
+        parsed_info = parse_group_identifier(update_data['group_identifier'])
+        update_data['parsed_name'] = parsed_info['name']
+        update_data['group_type'] = parsed_info['type']
+        update_data['resolved_id'] = None  # Reset resolved ID
+        update_data['preflight'] = None  # The old group's membership says nothing about the new one
+    
+    update_data['updated_at'] = datetime.utcnow()
+    
+    await db.group_targets.update_one(
+        {"_id": group_id},
+        {"$set": update_data}
+    )
+    
+    updated_group = await db.group_targets.find_one({"_id": group_id})
+    return GroupTarget(**updated_group)
+
+@api_router.delete("/groups/{group_id}")
+async def delete_group_target(group_id: str):
+    """Delete a group target"""
+    result = await db.group_targets.delete_one({"_id": group_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Group target not found")
+    await record_tombstone("group_targets", group_id)
+    return {"message": "Group target deleted successfully"}
+
+# ========================== BLACKLIST MANAGEMENT ==========================
+
+@api_router.get("/blacklist", response_model=List[BlacklistEntry])
+async def get_blacklist():
+    """Get all blacklist entries"""
+    blacklist = await read_db["browse"].blacklist.find().to_list(1000)
+    return [BlacklistEntry(**entry) for entry in blacklist]
+
+@api_router.post("/blacklist", response_model=BlacklistEntry)
+async def create_blacklist_entry(blacklist_data: BlacklistEntryCreate):
+    """Create a new blacklist entry"""
+    blacklist_entry = BlacklistEntry(**blacklist_data.dict())
+    await db.blacklist.insert_one(to_document(blacklist_entry))
+    return blacklist_entry
+
+@api_router.delete("/blacklist/{entry_id}")
+async def remove_blacklist_entry(entry_id: str):
+    """Remove a blacklist entry"""
+    result = await db.blacklist.delete_one({"_id": entry_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Blacklist entry not found")
+    return {"message": "Blacklist entry removed successfully"}
+
+@api_router.post("/blacklist/cleanup")
+async def cleanup_blacklist():
+    """Clean up expired blacklist entries"""
+    deleted_count = await cleanup_expired_blacklists()
+    return {"message": f"Cleaned up {deleted_count} expired blacklist entries"}
+
+# ========================== AUTOMATION CONFIGURATION ==========================
+
+@api_router.get("/automation/config", response_model=AutomationConfig)
+async def get_automation_configuration():
+    """Get automation configuration"""
+    return await get_automation_config()
+
+@api_router.put("/automation/config", response_model=AutomationConfig)
+async def update_automation_configuration(config_update: AutomationConfigUpdate):
+    """Update automation configuration"""
+    config = await get_automation_config()
+    
+    update_data = config_update.dict(exclude_unset=True)
+    for field, value in update_data.items():
+        setattr(config, field, value)
+    
+    # Stored and pushed to the running engine; the next send uses the new delays
+    await automation_config_store.save(config)
+    
+    return config
+
+@api_router.get("/automation/status", response_model=AutomationStatus)
+async def get_automation_status():
+    """Get current automation status"""
+    return automation_engine.status
+
+@api_router.post("/automation/start")
+async def start_automation():
+    """Start the automation process"""
+    config = await get_automation_config()
+    telegram_config = await get_telegram_config()
+    
+    if not telegram_config or not telegram_config.is_authenticated:
+        raise HTTPException(status_code=400, detail="Telegram authentication required")
+    if lifecycle.phase != "ready":
+        raise HTTPException(status_code=503, detail=f"Server is {lifecycle.phase}, try again shortly",
+                            headers={"Retry-After": "5"})
+    
+    config.is_active = True
+    await automation_config_store.save(config)
+    
+    # Whichever worker holds the engine lease starts it
+    engine_supervisor.poke()
+    return {"message": "Automation started successfully"}
+
+@api_router.post("/automation/stop")
+async def stop_automation():
+    """Stop the automation process"""
+    config = await get_automation_config()
+    config.is_active = False
+    await automation_config_store.save(config)
+    
+    await automation_engine.stop()
+    # A later start begins a fresh cycle rather than resuming this one
+    automation_engine.forget_position()
+    await automation_engine.checkpoint()
+    return {"message": "Automation stopped successfully"}
+
+# ========================== CYCLE SIMULATION ==========================
+
+# Standard normal quantiles; cycle duration is a sum of independent uniform delays, so the CLT applies
+NORMAL_QUANTILES = {"p05": -1.6449, "p50": 0.0, "p95": 1.6449}
+
+def project_schedule(config: AutomationConfig, window_ends: np.ndarray, send_latency: float) -> Dict[str, Any]:
+    """Closed-form projection of cycle timing and each group's next send
+
+    ``window_ends`` holds, per group in planner order, seconds from the start
+    until a flood/slow-mode window ends (0 when the group is free). A group
+    still inside its window is skipped by the planner until the first cycle
+    starting after it ends, and is sent in every cycle from then on, in
+    planner order with the free groups. Each cycle lasts as long as its own
+    sends take, so cycles grow as delayed groups join. Per-group times are
+    expectations; the duration and period reported are the first cycle's.
+    """
+    delay_min, delay_max = float(config.message_delay_min), float(config.message_delay_max)
+    delay_mean = (delay_min + delay_max) / 2
+    step = delay_mean + send_latency
+
+    free = window_ends <= 0
+    sends = int(free.sum())
+    gaps = max(sends - 1, 0)
+    duration_mean = gaps * delay_mean + sends * send_latency
+    duration_std = math.sqrt(gaps * (delay_max - delay_min) ** 2 / 12)
+    duration_min = gaps * delay_min + sends * send_latency
+    duration_max = gaps * delay_max + sends * send_latency
+    duration = {"mean": duration_mean, "std": duration_std, "min": duration_min, "max": duration_max}
+    for name, z in NORMAL_QUANTILES.items():
+        duration[name] = min(duration_max, max(duration_min, duration_mean + z * duration_std))
+
+    gap_min, gap_max = config.cycle_delay_min * 3600, config.cycle_delay_max * 3600
+    gap_mean = (gap_min + gap_max) / 2
+
+    def cycle_period(count: int) -> float:
+        return max(max(count - 1, 0) * delay_mean + count * send_latency + gap_mean, 1.0)
+
+    period = cycle_period(sends)
+
+    # The cycles where delayed groups join; between them cycles repeat with the same period
+    waits = np.sort(window_ends[~free])
+    join_cycle, join_start = [0], [0.0]
+    cycle, start, eligible = 0, 0.0, sends
+    while eligible < len(window_ends):
+        cycle_length = cycle_period(eligible)
+        skipped = max(math.ceil((waits[eligible - sends] - start) / cycle_length), 1)
+        cycle += skipped
+        start += skipped * cycle_length
+        eligible = sends + int(np.searchsorted(waits, start, side="right"))
+        join_cycle.append(cycle)
+        join_start.append(start)
+
+    join = np.where(free, 0, np.searchsorted(np.asarray(join_start), window_ends, side="left"))
+    cycles_ahead = np.asarray(join_cycle, dtype=np.float64)[join]
+
+    # A group's place in its first cycle: every earlier group already eligible by then goes before it
+    position = np.cumsum(free) - free
+    joined: List[int] = []
+    for i in np.flatnonzero(~free):
+        position[i] += bisect.bisect_right(joined, join[i])
+        bisect.insort(joined, join[i])
+    next_send = np.asarray(join_start, dtype=np.float64)[join] + position * step
+
+    return {
+        "duration": duration,
+        "gap": {"mean": gap_mean, "min": gap_min, "max": gap_max},
+        "period": period,
+        "sends": sends,
+        "sends_per_hour": sends / period * 3600,
+        "sends_per_hour_in_cycle": 3600 / step if step > 0 else 0.0,
+        "cycles_ahead": cycles_ahead,
+        "next_send": next_send,
+    }
+
+@api_router.post("/automation/simulate", response_model=SimulationResult)
+async def simulate_automation(request: SimulationRequest):
+    """Project cycle duration, throughput and per-group next send time without sending anything"""
+    config = await get_automation_config()
+    if request.config:
+        config = config.copy(update=request.config.dict(exclude_unset=True))
+    if config.message_delay_min > config.message_delay_max or config.cycle_delay_min > config.cycle_delay_max:
+        raise HTTPException(status_code=400, detail="Delay minimums must not exceed maximums")
+
+    if request.start_at:
+        start_at = request.start_at
+        # Stored times are naive UTC; an offset or Z in the request would make them incomparable
+        if start_at.tzinfo is not None:
+            start_at = start_at.astimezone(timezone.utc).replace(tzinfo=None)
+    elif automation_engine.status.next_cycle_at:
+        start_at = automation_engine.status.next_cycle_at
+    else:
+        start_at = datetime.utcnow()
+
+    permanent, window_end_by_group = set(), {}
+    async for entry in db.blacklist.find({}, {"_id": 0, "group_id": 1, "blacklist_type": 1, "expires_at": 1}):
+        if entry.get("blacklist_type") == "temporary" and entry.get("expires_at"):
+            window_end_by_group[entry["group_id"]] = (entry["expires_at"] - start_at).total_seconds()
+        else:
+            permanent.add(entry["group_id"])
+
+    ids, names, window_ends = [], [], []
+    active = excluded = 0
+    projection = {"_id": 0, "id": 1, "parsed_name": 1, "preflight.is_member": 1, "preflight.can_send": 1}
+    async for group in db.group_targets.find({"is_active": True}, projection):
+        active += 1
+        preflight = group.get("preflight") or {}
+        if group["id"] in permanent or preflight.get("is_member") is False or preflight.get("can_send") is False:
+            excluded += 1
+            continue
+        ids.append(group["id"])
+        names.append(group["parsed_name"])
+        window_ends.append(window_end_by_group.get(group["id"], 0.0))
+
+    started = time.perf_counter()
+    projection_result = project_schedule(config, np.asarray(window_ends, dtype=np.float64), request.send_latency_seconds)
+    next_send = projection_result["next_send"]
+    order = np.argsort(next_send, kind="stable")
+    page = order[request.schedule_offset:request.schedule_offset + request.schedule_limit]
+    schedule = [
+        SimulatedSend(
+            group_id=ids[i],
+            group_name=names[i],
+            next_send_at=start_at + timedelta(seconds=float(next_send[i])),
+            cycles_ahead=int(projection_result["cycles_ahead"][i]),
+        )
+        for i in page
+    ]
+    computed_in_ms = (time.perf_counter() - started) * 1000
+
+    return SimulationResult(
+        start_at=start_at,
+        groups_active=active,
+        groups_in_next_cycle=projection_result["sends"],
+        groups_delayed=len(ids) - projection_result["sends"],
+        groups_excluded=excluded,
+        cycle_duration_seconds=projection_result["duration"],
+        cycle_gap_seconds=projection_result["gap"],
+        cycle_period_seconds=projection_result["period"],
+        sends_per_hour=projection_result["sends_per_hour"],
+        sends_per_hour_in_cycle=projection_result["sends_per_hour_in_cycle"],
+        schedule_total=len(ids),
+        schedule=schedule,
+        computed_in_ms=computed_in_ms,
+    )
+
+# ========================== SEND STATISTICS ==========================
+
+# Rollups are written by the write-behind buffer, so they trail live sends by up to WRITE_BEHIND_INTERVAL
+STATS_MAX_DAYS = 366
+STATS_MAX_BREAKDOWN = 500  # rows one breakdown request may return
+STATS_MAX_HOURS = 24 * 14
+
+@api_router.get("/stats/sends/today", response_model=SendRollup)
+async def get_sends_today():
+    """Today's send totals (UTC)"""
+    today = rollup_period(datetime.utcnow(), "day")
+    return (await read_rollups("day", [today], database=read_db["stats"]))[0]
+
+@api_router.get("/stats/sends/daily", response_model=List[SendRollup])
+async def get_sends_daily(days: int = 30):
+    """Daily totals for the last ``days`` days, oldest first"""
+    if not 1 <= days <= STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {STATS_MAX_DAYS}")
+    today = rollup_period(datetime.utcnow(), "day")
+    return await read_rollups("day", [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)],
+                              database=read_db["stats"])
+
+@api_router.get("/stats/sends/hourly", response_model=List[SendRollup])
+async def get_sends_hourly(hours: int = 48):
+    """Hourly totals for the last ``hours`` hours, oldest first"""
+    if not 1 <= hours <= STATS_MAX_HOURS:
+        raise HTTPException(status_code=400, detail=f"hours must be between 1 and {STATS_MAX_HOURS}")
+    now = rollup_period(datetime.utcnow(), "hour")
+    return await read_rollups("hour", [now - timedelta(hours=offset) for offset in range(hours - 1, -1, -1)],
+                              database=read_db["stats"])
+
+async def _send_breakdown(scope: str, collection: str, name_field: str, days: int, limit: int) -> List[SendBreakdown]:
+    """Sum one scope's daily rollups over a window, worst failure rate first, named from ``collection``"""
+    if not 1 <= days <= STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {STATS_MAX_DAYS}")
+    since = rollup_period(datetime.utcnow(), "day") - timedelta(days=days - 1)
+    rows = await read_db["stats"].send_rollups.aggregate([
+        {"$match": {"scope": scope, "period": {"$gte": since}}},
+        {"$group": {"_id": "$key", "sent": {"$sum": "$sent"}, "failed": {"$sum": "$failed"},
+                    "flood_waits": {"$sum": "$flood_waits"}}},
+        {"$addFields": {"failure_rate": {"$divide": ["$failed", {"$add": ["$sent", "$failed"]}]}}},
+        {"$sort": {"failure_rate": -1, "failed": -1}},
+        {"$limit": limit},
+    ]).to_list(None)
+    names = {
+        document["_id"]: document.get(name_field)
+        for document in await read_db["stats"][collection].find({"_id": {"$in": [row["_id"] for row in rows]}},
+                                                                {name_field: 1}).to_list(None)
+    }
+    return [SendBreakdown(id=row["_id"], name=names.get(row["_id"]), sent=row["sent"], failed=row["failed"],
+                          flood_waits=row["flood_waits"], failure_rate=row["failure_rate"]) for row in rows]
+
+@api_router.get("/stats/sends/groups", response_model=List[SendBreakdown])
+async def get_sends_by_group(days: int = 7, limit: int = Query(50, ge=1, le=STATS_MAX_BREAKDOWN)):
+    """Per-group send totals over the last ``days`` days, highest failure rate first"""
+    return await _send_breakdown("group", "group_targets", "parsed_name", days, limit)
+
+@api_router.get("/stats/sends/templates", response_model=List[SendBreakdown])
+async def get_sends_by_template(days: int = 7, limit: int = Query(50, ge=1, le=STATS_MAX_BREAKDOWN)):
+    """Per-template send totals over the last ``days`` days, highest failure rate first"""
+    return await _send_breakdown("template", "message_templates", "title", days, limit)
+
+# ========================== DATA EXPORT / IMPORT ==========================
+
+# Public name -> (Mongo collection, model used for columns and import validation)
+EXPORTABLE_COLLECTIONS: Dict[str, Tuple[str, Type[BaseModel]]] = {
+    "groups": ("group_targets", GroupTarget),
+    "templates": ("message_templates", MessageTemplate),
+    "blacklist": ("blacklist", BlacklistEntry),
+    "send_history": ("send_log", SendLogEntry),
+}
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 20
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _csv_cell(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default)
+    return str(value)
+
+def _csv_cell_value(cell: str, structured: bool) -> Any:
+    if cell == '':
+        return None
+    if structured and cell[0] in '{[':
+        try:
+            return json.loads(cell)
+        except ValueError:
+            pass
+    return cell
+
+def _get_export_spec(collection: str) -> Tuple[str, Type[BaseModel]]:
+    spec = EXPORTABLE_COLLECTIONS.get(collection)
+    if not spec:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown collection '{collection}'. Available: {', '.join(EXPORTABLE_COLLECTIONS)}"
+        )
+    return spec
+
+async def _iter_export_chunks(collection_name: str, fields: List[str], fmt: str) -> AsyncIterator[bytes]:
+    """Stream a collection as NDJSON or CSV, one encoded chunk per cursor batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(fields)
+
+    count = 0
+    cursor = read_db["export"][collection_name].find({}, {'_id': 0}).batch_size(EXPORT_BATCH_SIZE)
+    async for document in cursor:
+        if writer:
+            writer.writerow([_csv_cell(document.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps(document, default=_json_default))
+            buffer.write('\n')
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode()
+
+async def _gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream on the fly into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+async def _iter_request_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a (possibly gzip-compressed) request body into lines without buffering it whole"""
+    decompressor = None
+    first_chunk = True
+    pending = b''
+    async for chunk in stream:
+        if not chunk:
+            continue
+        if first_chunk:
+            first_chunk = False
+            if chunk[:2] == b'\x1f\x8b':
+                decompressor = zlib.decompressobj(31)
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.rstrip(b'\r').decode('utf-8')
+    if decompressor:
+        pending += decompressor.flush()
+    for line in pending.split(b'\n'):
+        yield line.rstrip(b'\r').decode('utf-8')
+
+async def _iter_import_records(stream: AsyncIterator[bytes], fmt: str, text_fields: frozenset = frozenset()) -> AsyncIterator[Dict[str, Any]]:
+    """Yield raw records from an NDJSON or CSV request body
+
+    CSV cells holding JSON objects/arrays (nested fields written by the
+    exporter) are decoded, except in ``text_fields`` where they are content.
+    """
+    if fmt == 'ndjson':
+        async for line in _iter_request_lines(stream):
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    header: Optional[List[str]] = None
+    record = ''
+    async for line in _iter_request_lines(stream):
+        record = f"{record}\n{line}" if record else line
+        # A quoted cell may span lines; the record is complete once quotes balance
+        if record.count('"') % 2:
+            continue
+        if record.strip():
+            cells = next(csv.reader([record]))
+            if header is None:
+                header = cells
+            else:
+                yield {field: _csv_cell_value(cell, field not in text_fields) for field, cell in zip(header, cells)}
+        record = ''
+
+async def _drop_logged_sends(batch: List[Dict[str, Any]], result: ImportResult) -> List[Dict[str, Any]]:
+    """Leave out send log entries already stored, counting them as duplicates
+
+    ``send_log`` is a time-series collection, which does not enforce a unique
+    ``_id``, so a re-imported entry is matched by its ``id`` within the
+    batch's time range instead of being rejected by the server.
+    """
+    sent_at = [document["sent_at"] for document in batch]
+    seen = {document["id"] async for document in db.send_log.find(
+        {"sent_at": {"$gte": min(sent_at), "$lte": max(sent_at)}, "id": {"$in": [document["id"] for document in batch]}},
+        {"_id": 0, "id": 1}
+    )}
+    fresh = []
+    for document in batch:
+        if document["id"] in seen:
+            result.duplicates += 1
+        else:
+            seen.add(document["id"])
+            fresh.append(document)
+    return fresh
+
+async def _flush_import_batch(collection_name: str, batch: List[Dict[str, Any]], result: ImportResult):
+    if collection_name == "send_log":
+        batch = await _drop_logged_sends(batch, result)
+        if not batch:
+            return
+    failed = set()
+    try:
+        inserted = await db[collection_name].insert_many(batch, ordered=False)
+        result.inserted += len(inserted.inserted_ids)
+    except BulkWriteError as e:
+        result.inserted += e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', []):
+            failed.add(error['index'])
+            if error.get('code') == 11000:
+                result.duplicates += 1
+            elif len(result.errors) < IMPORT_MAX_REPORTED_ERRORS:
+                result.errors.append(error.get('errmsg', 'write error'))
+    if collection_name == "send_log":
+        # Count only the entries written into the rollups; the rest of the history stays as it is
+        for index, document in enumerate(batch):
+            if index not in failed:
+                send_writer.add_rollups(_rollup_changes(SendLogEntry(**document)))
+
+@api_router.get("/export/{collection}")
+async def export_collection(collection: str, format: str = "ndjson", gzip: bool = False):
+    """Stream a collection as NDJSON or CSV, optionally gzip-compressed"""
+    collection_name, model = _get_export_spec(collection)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+
+    chunks = _iter_export_chunks(collection_name, list(model.model_fields), format)
+    media_type = EXPORT_FORMATS[format]
+    filename = f"{collection}-{datetime.utcnow():%Y%m%dT%H%M%SZ}.{format}"
+    if gzip:
+        chunks = _gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/import/{collection}", response_model=ImportResult)
+async def import_collection(collection: str, request: Request, format: str = "ndjson"):
+    """Stream NDJSON or CSV (optionally gzip-compressed) into a collection in batches"""
+    collection_name, model = _get_export_spec(collection)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+
+    text_fields = frozenset(name for name, field in model.model_fields.items() if field.annotation in (str, Optional[str]))
+    result = ImportResult(collection=collection)
+    batch: List[Dict[str, Any]] = []
+    try:
+        async for record in _iter_import_records(request.stream(), format, text_fields):
+            try:
+                document = model(**record)
+                if isinstance(document, MessageTemplate):
+                    document.compiled = compile_template_content(document.content)
+                batch.append(to_document(document) if collection_name in ID_KEYED_COLLECTIONS else document.dict())
+            except (ValidationError, TypeError, TemplateCompileError) as e:
+                result.invalid += 1
+                if len(result.errors) < IMPORT_MAX_REPORTED_ERRORS:
+                    result.errors.append(str(e).splitlines()[0])
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await _flush_import_batch(collection_name, batch, result)
+                batch = []
+    except (ValueError, zlib.error) as e:
+        # Malformed JSON or compressed data; batches already written stay written
+        raise HTTPException(status_code=400, detail=f"Failed to parse import data: {str(e)}")
+
+    if batch:
+        await _flush_import_batch(collection_name, batch, result)
+    # Imported documents keep their exported updated_at, which may be behind the engine's watermark
+    automation_engine.reset_sync()
+    if collection_name == "send_log":
+        await send_writer.flush()
+
+    logger.info("Imported into %s: inserted=%s duplicates=%s invalid=%s",
+                collection_name, result.inserted, result.duplicates, result.invalid)
+    return result
+
+# ========================== SNAPSHOT / RESTORE ==========================
+
+# Every collection the app owns; telegram_config is archived as stored (still encrypted)
+SNAPSHOT_COLLECTIONS = [
+    "telegram_config",
+    "message_templates",
+    "group_targets",
+    "blacklist",
+    "automation_config",
+    "send_log",
+    "send_rollups",
+    "telegram_sessions",
+    "telegram_entities",
+]
+SNAPSHOT_FORMAT = "telegram-automation-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_BATCH_SIZE = 1000
+
+# Documents travel as raw BSON bytes, so neither side pays for decoding and re-encoding
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+class _ChunkSink:
+    """Unseekable write target for zipfile; the snapshot stream drains it between batches"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def iter_snapshot_archive() -> AsyncIterator[bytes]:
+    """Stream every app collection into one zip archive: a BSON member per collection plus manifest.json
+
+    Collections are read batch by batch as raw BSON and compressed off the event
+    loop, so memory stays bounded by one batch regardless of database size.
+    """
+    sink = _ChunkSink()
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "app_version": app.version,
+        "database": os.environ['DB_NAME'],
+        "created_at": datetime.utcnow(),
+        "collections": [],
+    }
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        for name in SNAPSHOT_COLLECTIONS:
+            member_name = f"{name}.bson"
+            count = 0
+            cursor = db.get_collection(name, codec_options=RAW_BSON_OPTIONS).find().batch_size(SNAPSHOT_BATCH_SIZE)
+            with archive.open(member_name, 'w', force_zip64=True) as member:
+                while True:
+                    batch = await cursor.to_list(SNAPSHOT_BATCH_SIZE)
+                    if not batch:
+                        break
+                    await asyncio.to_thread(member.write, b''.join(document.raw for document in batch))
+                    count += len(batch)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            manifest["collections"].append({"name": name, "file": member_name, "format": "bson", "documents": count})
+
+        archive.writestr("manifest.json", json.dumps(manifest, default=_json_default, indent=2))
+    yield sink.drain()
+
+def _read_snapshot_manifest(path: Path) -> Dict[str, Any]:
+    try:
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise ValueError(f"Not a valid snapshot archive: {e}")
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot format or version")
+    return manifest
+
+def _read_bson_batch(documents, size: int) -> List[RawBSONDocument]:
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= size:
+            break
+    return batch
+
+async def _restore_collection(path: Path, entry: Dict[str, Any], replace_existing: bool) -> Dict[str, Any]:
+    """Bulk-load one archive member; each collection has its own archive handle so they load in parallel"""
+    name = entry["name"]
+    collection = db[name]
+    if replace_existing:
+        await collection.delete_many({})
+
+    stats = {"inserted": 0, "duplicates": 0}
+    with zipfile.ZipFile(path) as archive, archive.open(entry["file"]) as member:
+        documents = decode_file_iter(member, codec_options=RAW_BSON_OPTIONS)
+        while True:
+            batch = await asyncio.to_thread(_read_bson_batch, documents, SNAPSHOT_BATCH_SIZE)
+            if not batch:
+                break
+            try:
+                result = await collection.insert_many(batch, ordered=False)
+                stats["inserted"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                stats["inserted"] += e.details.get('nInserted', 0)
+                stats["duplicates"] += sum(1 for error in e.details.get('writeErrors', []) if error.get('code') == 11000)
+    return stats
+
+async def restore_snapshot(path: Path, replace_existing: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Restore a snapshot archive, loading all collections concurrently"""
+    manifest = _read_snapshot_manifest(path)
+    entries = [entry for entry in manifest["collections"] if entry["name"] in SNAPSHOT_COLLECTIONS]
+    results = await asyncio.gather(*(_restore_collection(path, entry, replace_existing) for entry in entries))
+    summary = {entry["name"]: result for entry, result in zip(entries, results)}
+    # Archives taken before documents were keyed by id still carry ObjectIds
+    await migrate_ids_to_primary_key()
+    automation_engine.reset_sync()
+    # Archives from before the rollups existed only carry the raw log
+    if "send_log" in summary and "send_rollups" not in summary:
+        await rebuild_send_rollups()
+    logger.info("Restored snapshot %s: %s", path, summary)
+    return summary
+
+@api_router.get("/admin/snapshot", dependencies=[Depends(require_admin)])
+async def download_snapshot():
+    """Stream a compressed snapshot of every app collection"""
+    filename = f"snapshot-{datetime.utcnow():%Y%m%dT%H%M%SZ}.zip"
+    return StreamingResponse(
+        iter_snapshot_archive(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/admin/restore", dependencies=[Depends(require_admin)])
+async def upload_restore(request: Request, replace_existing: bool = True):
+    """Restore from an uploaded snapshot archive (request body), spooled to disk first"""
+    with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as spool:
+        spool_path = Path(spool.name)
+        async for chunk in request.stream():
+            spool.write(chunk)
+    try:
+        summary = await restore_snapshot(spool_path, replace_existing=replace_existing)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spool_path.unlink(missing_ok=True)
+    return {"message": "Snapshot restored successfully", "collections": summary}
+
+# ========================== MEMORY PROFILING ==========================
+
+MEMORY_TRACE_FRAMES = int(os.environ.get('MEMORY_TRACE_FRAMES', '10'))  # stack depth recorded per allocation
+MEMORY_MAX_SNAPSHOTS = int(os.environ.get('MEMORY_MAX_SNAPSHOTS', '5'))  # oldest are dropped; each one is large
+MEMORY_KEY_TYPES = ("lineno", "filename", "traceback")
+
+# Allocations made by the profiler itself and by imports are noise
+_MEMORY_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+memory_snapshots: "OrderedDict[str, Tuple[datetime, tracemalloc.Snapshot]]" = OrderedDict()
+register_memory_reporter('memory_profiler', lambda: {"snapshots": len(memory_snapshots)})
+
+def _get_memory_snapshot(name: str) -> Tuple[datetime, tracemalloc.Snapshot]:
+    if name not in memory_snapshots:
+        raise HTTPException(status_code=404, detail=f"Memory snapshot '{name}' not found")
+    return memory_snapshots[name]
+
+def _check_key_type(key_type: str):
+    if key_type not in MEMORY_KEY_TYPES:
+        raise HTTPException(status_code=400, detail=f"key_type must be one of: {', '.join(MEMORY_KEY_TYPES)}")
+
+def _format_statistic(stat) -> MemoryAllocation:
+    return MemoryAllocation(
+        location=" <- ".join(f"{frame.filename}:{frame.lineno}" for frame in reversed(stat.traceback)),
+        size_bytes=stat.size,
+        count=stat.count,
+        size_diff_bytes=getattr(stat, 'size_diff', None),
+        count_diff=getattr(stat, 'count_diff', None),
+    )
+
+def _snapshot_info(name: str, taken_at: datetime, stats: list, limit: int) -> MemorySnapshotInfo:
+    return MemorySnapshotInfo(
+        name=name,
+        taken_at=taken_at,
+        traced_bytes=sum(stat.size for stat in stats),
+        top=[_format_statistic(stat) for stat in stats[:limit]],
+    )
+
+@api_router.get("/admin/memory", response_model=MemoryReport, dependencies=[Depends(require_admin)])
+async def get_memory_report():
+    """Process memory, tracemalloc totals and the sizes of in-memory structures"""
+    current, peak = tracemalloc.get_traced_memory()
+    components = {}
+    for name, reporter in memory_reporters.items():
+        try:
+            components[name] = reporter()
+        except Exception as e:
+            logger.warning("Memory reporter %s failed: %s", name, e)
+    return MemoryReport(
+        tracing=tracemalloc.is_tracing(),
+        traced_current_bytes=current,
+        traced_peak_bytes=peak,
+        max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        snapshots=list(memory_snapshots),
+        components=components,
+    )
+
+@api_router.post("/admin/memory/tracing/start", dependencies=[Depends(require_admin)])
+async def start_memory_tracing(frames: int = MEMORY_TRACE_FRAMES):
+    """Start tracing allocations; the process runs slower while this is on"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, frames))
+        logger.info("Memory tracing started with %d frames", tracemalloc.get_traceback_limit())
+    return {"message": "Memory tracing running", "frames": tracemalloc.get_traceback_limit()}
+
+@api_router.post("/admin/memory/tracing/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_tracing():
+    """Stop tracing allocations; snapshots already taken are kept"""
+    tracemalloc.stop()
+    logger.info("Memory tracing stopped")
+    return {"message": "Memory tracing stopped"}
+
+@api_router.post("/admin/memory/snapshots", response_model=MemorySnapshotInfo, dependencies=[Depends(require_admin)])
+async def take_memory_snapshot(name: Optional[str] = None, limit: int = 20):
+    """Take a named tracemalloc snapshot and return its top allocation sites"""
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    name = name or f"{datetime.utcnow():%Y%m%dT%H%M%S}"
+    # Snapshotting walks every traced block; keep it off the event loop
+    snapshot = await asyncio.to_thread(lambda: tracemalloc.take_snapshot().filter_traces(_MEMORY_SNAPSHOT_FILTERS))
+    taken_at = datetime.utcnow()
+    memory_snapshots.pop(name, None)
+    memory_snapshots[name] = (taken_at, snapshot)
+    while len(memory_snapshots) > MEMORY_MAX_SNAPSHOTS:
+        memory_snapshots.popitem(last=False)
+
+    stats = await asyncio.to_thread(snapshot.statistics, "lineno")
+    return _snapshot_info(name, taken_at, stats, limit)
+
+@api_router.get("/admin/memory/snapshots/{name}", response_model=MemorySnapshotInfo, dependencies=[Depends(require_admin)])
+async def get_memory_snapshot(name: str, key_type: str = "lineno", limit: int = 20):
+    """Top allocation sites of a stored snapshot, grouped by line, file or full traceback"""
+    _check_key_type(key_type)
+    taken_at, snapshot = _get_memory_snapshot(name)
+    stats = await asyncio.to_thread(snapshot.statistics, key_type)
+    return _snapshot_info(name, taken_at, stats, limit)
+
+@api_router.delete("/admin/memory/snapshots/{name}", dependencies=[Depends(require_admin)])
+async def delete_memory_snapshot(name: str):
+    """Drop a stored snapshot to free its memory"""
+    _get_memory_snapshot(name)
+    del memory_snapshots[name]
+    return {"message": f"Memory snapshot '{name}' deleted"}
+
+@api_router.get("/admin/memory/diff", response_model=List[MemoryAllocation], dependencies=[Depends(require_admin)])
+async def diff_memory_snapshots(base: str, target: str, key_type: str = "lineno", limit: int = 20):
+    """Allocation sites whose size changed the most between two snapshots"""
+    _check_key_type(key_type)
+    _, base_snapshot = _get_memory_snapshot(base)
+    _, target_snapshot = _get_memory_snapshot(target)
+    stats = await asyncio.to_thread(target_snapshot.compare_to, base_snapshot, key_type)
+    return [_format_statistic(stat) for stat in stats[:limit]]
+
+# ========================== CPU PROFILING ==========================
+
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '300'))
+PROFILE_SCOPES = ("process", "route", "engine")
+PROFILE_FORMATS = ("collapsed", "speedscope")
 
-@api_router.get("/groups/{group_id}", response_model=GroupTarget)
-async def get_group_target(group_id: str):
-    """Get a specific group target"""
-    group = await db.group_targets.find_one({"id": group_id})
-    if not group:
-        raise HTTPException(status_code=404, detail="Group target not found")
-    return GroupTarget(**group)
+class SamplingProfiler:
+    """Samples Python stacks from a background thread at a fixed interval
 
-@api_router.put("/groups/{group_id}", response_model=GroupTarget)
-async def update_group_target(group_id: str, group_update: GroupTargetUpdate):
-    """Update a group target"""
-    existing_group = await db.group_targets.find_one({"id": group_id})
-    if not existing_group:
-        raise HTTPException(status_code=404, detail="Group target not found")
-    
-    update_data = group_update.dict(exclude_unset=True)
-    
-    # If identifier is updated, reparse it
-    if 'group_identifier' in update_data:
-        parsed_info = parse_group_identifier(update_data['group_identifier'])
-        update_data['parsed_name'] = parsed_info['name']
-        update_data['group_type'] = parsed_info['type']
-        update_data['resolved_id'] = None  # Reset resolved ID
-    
-    update_data['updated_at'] = datetime.utcnow()
-    
-    await db.group_targets.update_one(
-        {"id": group_id},
-        {"$set": update_data}
-    )
-    
-    updated_group = await db.group_targets.find_one({"id": group_id})
-    return GroupTarget(**updated_group)
+    With ``target_codes`` set only stacks passing through one of those code
+    objects are kept, which scopes a profile to a route handler or the
+    engine loop without touching the code being measured.
+    """
 
-@api_router.delete("/groups/{group_id}")
-async def delete_group_target(group_id: str):
-    """Delete a group target"""
-    result = await db.group_targets.delete_one({"id": group_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Group target not found")
-    return {"message": "Group target deleted successfully"}
+    def __init__(self, interval: float, thread_ids: Optional[set] = None, target_codes: Optional[frozenset] = None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.target_codes = target_codes
+        self.stacks: Dict[Tuple[int, tuple], int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
 
-# ========================== BLACKLIST MANAGEMENT ==========================
+    def start(self):
+        self._thread.start()
 
-@api_router.get("/blacklist", response_model=List[BlacklistEntry])
-async def get_blacklist():
-    """Get all blacklist entries"""
-    blacklist = await db.blacklist.find().to_list(1000)
-    return [BlacklistEntry(**entry) for entry in blacklist]
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
 
-@api_router.post("/blacklist", response_model=BlacklistEntry)
-async def create_blacklist_entry(blacklist_data: BlacklistEntryCreate):
-    """Create a new blacklist entry"""
-    blacklist_entry = BlacklistEntry(**blacklist_data.dict())
-    await db.blacklist.insert_one(blacklist_entry.dict())
-    return blacklist_entry
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids and thread_id not in self.thread_ids):
+                    continue
+                self.samples += 1
+                stack = []
+                matched = self.target_codes is None
+                while frame is not None:
+                    code = frame.f_code
+                    matched = matched or code in self.target_codes
+                    stack.append(code)
+                    frame = frame.f_back
+                if matched:
+                    key = (thread_id, tuple(reversed(stack)))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
 
-@api_router.delete("/blacklist/{entry_id}")
-async def remove_blacklist_entry(entry_id: str):
-    """Remove a blacklist entry"""
-    result = await db.blacklist.delete_one({"id": entry_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Blacklist entry not found")
-    return {"message": "Blacklist entry removed successfully"}
+def _frame_name(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
 
-@api_router.post("/blacklist/cleanup")
-async def cleanup_blacklist():
-    """Clean up expired blacklist entries"""
-    deleted_count = await cleanup_expired_blacklists()
-    return {"message": f"Cleaned up {deleted_count} expired blacklist entries"}
+def _write_collapsed(path: Path, stacks: Dict[Tuple[int, tuple], int], thread_names: Dict[int, str]):
+    with open(path, 'w') as output:
+        for (thread_id, stack), count in sorted(stacks.items(), key=lambda item: -item[1]):
+            frames = [thread_names.get(thread_id, str(thread_id))] + [_frame_name(code) for code in stack]
+            output.write(f"{';'.join(frames)} {count}\n")
 
-# ========================== AUTOMATION CONFIGURATION ==========================
+def _write_speedscope(path: Path, stacks: Dict[Tuple[int, tuple], int], thread_names: Dict[int, str],
+                      interval_ms: float, name: str):
+    frame_index: Dict[Any, int] = {}
+    frames: List[Dict[str, Any]] = []
+    per_thread: Dict[int, Tuple[list, list]] = {}
+    for (thread_id, stack), count in stacks.items():
+        indexes = []
+        for code in stack:
+            if code not in frame_index:
+                frame_index[code] = len(frames)
+                frames.append({"name": getattr(code, 'co_qualname', code.co_name),
+                               "file": code.co_filename, "line": code.co_firstlineno})
+            indexes.append(frame_index[code])
+        samples, weights = per_thread.setdefault(thread_id, ([], []))
+        samples.append(indexes)
+        weights.append(count * interval_ms)
 
-@api_router.get("/automation/config", response_model=AutomationConfig)
-async def get_automation_configuration():
-    """Get automation configuration"""
-    return await get_automation_config()
+    profiles = [{
+        "type": "sampled",
+        "name": thread_names.get(thread_id, str(thread_id)),
+        "unit": "milliseconds",
+        "startValue": 0,
+        "endValue": sum(weights),
+        "samples": samples,
+        "weights": weights,
+    } for thread_id, (samples, weights) in per_thread.items()]
+    with open(path, 'w') as output:
+        json.dump({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "telegram-automation",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }, output)
 
-@api_router.put("/automation/config", response_model=AutomationConfig)
-async def update_automation_configuration(config_update: AutomationConfigUpdate):
-    """Update automation configuration"""
-    config = await get_automation_config()
-    
-    update_data = config_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(config, field, value)
-    
-    # Ensure blacklist cleanup is always enabled
-    config.auto_cleanup_blacklist = True
-    config.updated_at = datetime.utcnow()
-    
-    await db.automation_config.replace_one(
-        {"id": config.id},
-        config.dict(),
-        upsert=True
+def _route_codes(path: str, method: Optional[str]) -> frozenset:
+    codes = frozenset(
+        route.endpoint.__code__ for route in app.routes
+        if isinstance(route, APIRoute) and route.path == path and (not method or method.upper() in route.methods)
     )
-    
-    return config
+    if not codes:
+        raise HTTPException(status_code=404, detail=f"No route matches {method or '*'} {path}")
+    return codes
 
-@api_router.get("/automation/status", response_model=AutomationStatus)
-async def get_automation_status():
-    """Get current automation status"""
-    # This would be implemented with the actual automation engine
-    status = AutomationStatus()
-    return status
+def _lag_summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "samples": len(ordered),
+        "p50_ms": round(ordered[len(ordered) // 2], 2),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2),
+        "max_ms": round(ordered[-1], 2),
+    }
 
-@api_router.post("/automation/start")
-async def start_automation():
-    """Start the automation process"""
-    config = await get_automation_config()
-    telegram_config = await get_telegram_config()
-    
-    if not telegram_config or not telegram_config.is_authenticated:
-        raise HTTPException(status_code=400, detail="Telegram authentication required")
-    
-    config.is_active = True
-    config.updated_at = datetime.utcnow()
-    
-    await db.automation_config.replace_one(
-        {"id": config.id},
-        config.dict(),
-        upsert=True
-    )
-    
-    return {"message": "Automation started successfully"}
+profile_runs: "OrderedDict[str, ProfileRun]" = OrderedDict()
+_profile_task: Optional[asyncio.Task] = None
 
-@api_router.post("/automation/stop")
-async def stop_automation():
-    """Stop the automation process"""
-    config = await get_automation_config()
-    config.is_active = False
-    config.updated_at = datetime.utcnow()
-    
-    await db.automation_config.replace_one(
-        {"id": config.id},
-        config.dict(),
-        upsert=True
+async def _run_profile(run: ProfileRun, profiler: SamplingProfiler):
+    lag_count = loop_lag_monitor.count
+    profiler.start()
+    try:
+        await asyncio.sleep(run.seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+        run.finished_at = datetime.utcnow()
+
+    # The monitor keeps a bounded window; take the samples added while profiling
+    new_lag_samples = min(loop_lag_monitor.count - lag_count, len(loop_lag_monitor.samples))
+    run.loop_lag = _lag_summary(list(loop_lag_monitor.samples)[-new_lag_samples:] if new_lag_samples else [])
+    run.samples = profiler.samples
+    run.matched_samples = sum(profiler.stacks.values())
+
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    path = PROFILE_DIR / f"profile-{run.started_at:%Y%m%dT%H%M%SZ}-{run.scope}.{'txt' if run.format == 'collapsed' else 'speedscope.json'}"
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        if run.format == "collapsed":
+            await asyncio.to_thread(_write_collapsed, path, profiler.stacks, thread_names)
+        else:
+            await asyncio.to_thread(_write_speedscope, path, profiler.stacks, thread_names,
+                                    run.interval_ms, f"{run.scope} {run.route or ''}".strip())
+        run.output_file = str(path)
+        run.status = "finished"
+    except OSError as e:
+        run.status = "failed"
+        run.error = str(e)
+    logger.info("CPU profile %s finished: %d/%d samples kept, written to %s",
+                run.id, run.matched_samples, run.samples, run.output_file)
+
+@api_router.post("/admin/profiler", response_model=ProfileRun, status_code=202, dependencies=[Depends(require_admin)])
+async def start_profiler(seconds: float = 30, scope: str = "process", route: Optional[str] = None,
+                         method: Optional[str] = None, format: str = "speedscope", interval_ms: float = 5):
+    """Sample stacks for a while, for the whole process, one route's handler or the engine loop"""
+    global _profile_task
+    if _profile_task and not _profile_task.done():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if scope not in PROFILE_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of: {', '.join(PROFILE_SCOPES)}")
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(PROFILE_FORMATS)}")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+
+    # Handlers and the engine run on the event loop thread, which is this one
+    target_codes, thread_ids = None, None
+    if scope == "route":
+        if not route:
+            raise HTTPException(status_code=400, detail="route is required for scope 'route'")
+        target_codes, thread_ids = _route_codes(route, method), {threading.get_ident()}
+    elif scope == "engine":
+        target_codes, thread_ids = frozenset({AutomationEngine._run.__code__}), {threading.get_ident()}
+
+    run = ProfileRun(scope=scope, route=route, method=method, format=format, seconds=seconds, interval_ms=interval_ms)
+    profiler = SamplingProfiler(interval_ms / 1000, thread_ids, target_codes)
+    profile_runs[run.id] = run
+    while len(profile_runs) > 20:
+        profile_runs.popitem(last=False)
+    _profile_task = asyncio.create_task(_run_profile(run, profiler))
+    logger.info("CPU profile %s started: scope=%s route=%s for %ss", run.id, scope, route, seconds)
+    return run
+
+@api_router.get("/admin/profiler", response_model=List[ProfileRun], dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Recent profile runs, newest first"""
+    return list(reversed(profile_runs.values()))
+
+@api_router.get("/admin/profiler/{run_id}/output", dependencies=[Depends(require_admin)])
+async def download_profile(run_id: str):
+    """Download the collapsed-stack or speedscope file of a finished run"""
+    run = profile_runs.get(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Profile run not found")
+    if not run.output_file:
+        raise HTTPException(status_code=409, detail=f"Profile run is {run.status}")
+    return FileResponse(run.output_file, filename=Path(run.output_file).name)
+
+# ========================== QUERY AUDIT ==========================
+
+QUERY_AUDIT_MAX_EXAMINED_RATIO = float(os.environ.get('QUERY_AUDIT_MAX_EXAMINED_RATIO', '10'))  # docs examined per doc returned
+
+class QueryShape(BaseModel):
+    name: str
+    collection: str
+    filter: Callable[[], Dict[str, Any]]  # built per run so time-based predicates use the current time
+    sort: Optional[Dict[str, int]] = None
+    limit: int = 0
+
+query_shapes: List[QueryShape] = []
+
+def register_query_shape(name: str, collection: str, filter: Callable[[], Dict[str, Any]],
+                         sort: Optional[Dict[str, int]] = None, limit: int = 0):
+    """Add a hot query to the plan audit; sample values only need the right types"""
+    query_shapes.append(QueryShape(name=name, collection=collection, filter=filter, sort=sort, limit=limit))
+
+register_query_shape("group by id", "group_targets", lambda: {"_id": "00000000-0000-0000-0000-000000000000"}, limit=1)
+register_query_shape("group by identifier (bulk import)", "group_targets", lambda: {"group_identifier": "@example"}, limit=1)
+register_query_shape("groups due for preflight", "group_targets", lambda: {
+    "is_active": True,
+    "$or": [{"preflight": None}, {"preflight.checked_at": {"$lt": datetime.utcnow() - timedelta(hours=PREFLIGHT_TTL_HOURS)}}],
+})
+register_query_shape("groups changed since watermark", "group_targets", lambda: {"updated_at": {"$gte": datetime.utcnow()}})
+register_query_shape("templates changed since watermark", "message_templates", lambda: {"updated_at": {"$gte": datetime.utcnow()}})
+register_query_shape("tombstones since watermark", "tombstones", lambda: {
+    "collection": "group_targets", "deleted_at": {"$gte": datetime.utcnow()},
+})
+register_query_shape("temp auth by phone (every auth step)", "temp_auth", lambda: {"phone_number": "+10000000000"}, limit=1)
+register_query_shape("expired temporary blacklists (cleanup)", "blacklist", lambda: {
+    "blacklist_type": "temporary", "expires_at": {"$lt": datetime.utcnow()},
+})
+register_query_shape("blacklist by group (engine upsert)", "blacklist", lambda: {"group_id": "00000000-0000-0000-0000-000000000000"}, limit=1)
+register_query_shape("telegram config by phone (logout)", "telegram_config", lambda: {"phone_number": "+10000000000"}, limit=1)
+register_query_shape("session entities (client start)", "telegram_entities", lambda: {"session": LIVE_SESSION_NAME})
+register_query_shape("daily rollups (send charts)", "send_rollups", lambda: {"_id": {"$in": [
+    rollup_id("day", "all", rollup_period(datetime.utcnow(), "day"))
+]}})
+register_query_shape("group rollups in window (failure rates)", "send_rollups", lambda: {
+    "scope": "group", "period": {"$gte": rollup_period(datetime.utcnow(), "day") - timedelta(days=6)}
+})
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Every stage name in an explain plan tree, whichever engine (classic or SBE) produced it"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key, value in plan.items():
+            if key != "rejectedPlans":
+                stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+async def explain_query_shape(shape: QueryShape) -> QueryAuditResult:
+    """Run ``explain`` with execution stats on one shape and flag scans and in-memory sorts"""
+    find: Dict[str, Any] = {"find": shape.collection, "filter": shape.filter()}
+    if shape.sort:
+        find["sort"] = shape.sort
+    if shape.limit:
+        find["limit"] = shape.limit
+    result = QueryAuditResult(name=shape.name, collection=shape.collection)
+    try:
+        explain = await db.command({"explain": find, "verbosity": "executionStats"})
+    except OperationFailure as e:
+        result.error = str(e)
+        result.flagged = True
+        return result
+
+    stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+    stats = explain.get("executionStats", {})
+    result.stages = list(dict.fromkeys(stages))
+    result.docs_examined = stats.get("totalDocsExamined", 0)
+    result.keys_examined = stats.get("totalKeysExamined", 0)
+    result.returned = stats.get("nReturned", 0)
+    result.time_ms = stats.get("executionTimeMillis", 0)
+    result.collscan = "COLLSCAN" in stages
+    result.in_memory_sort = "SORT" in stages
+    result.flagged = (
+        result.collscan or result.in_memory_sort
+        or result.docs_examined > QUERY_AUDIT_MAX_EXAMINED_RATIO * max(result.returned, 1)
     )
-    
-    return {"message": "Automation stopped successfully"}
+    return result
+
+async def run_query_audit() -> List[QueryAuditResult]:
+    results = [await explain_query_shape(shape) for shape in query_shapes]
+    flagged = [result.name for result in results if result.flagged]
+    if flagged:
+        logger.warning("Query audit flagged %d of %d shapes: %s", len(flagged), len(results), ", ".join(flagged))
+    return results
+
+@api_router.get("/admin/query-audit", response_model=List[QueryAuditResult], dependencies=[Depends(require_admin)])
+async def get_query_audit():
+    """Explain every registered hot query and flag collection scans, in-memory sorts and wide scans"""
+    return await run_query_audit()
 
 # ========================== LEGACY ENDPOINTS ==========================
 
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
@@ -983,6 +4619,216 @@ async def get_status_checks():
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """Tag every log record emitted while handling a request with its request id and trace it"""
+    request_id = request.headers.get('x-request-id') or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        with trace_span(f"{request.method} {request.url.path}", kind='SERVER', root=True, **{
+            'http.method': request.method,
+            'http.target': request.url.path,
+            'http.request_id': request_id,
+        }) as span:
+            response = await call_next(request)
+            if span:
+                route = request.scope.get('route')
+                if route is not None:
+                    # Name by route template so traces group across ids
+                    span.name = f"{request.method} {route.path}"
+                    span.set_attribute('http.route', route.path)
+                span.set_attribute('http.status_code', response.status_code)
+                if response.status_code >= 500:
+                    span.error = f"HTTP {response.status_code}"
+    finally:
+        request_id_var.reset(token)
+    response.headers['X-Request-ID'] = request_id
+    return response
+
+# ========================== ADMISSION CONTROL ==========================
+
+ADMISSION_RATE_PER_SECOND = float(os.environ.get('ADMISSION_RATE_PER_SECOND', '20'))  # per client IP
+ADMISSION_BURST = float(os.environ.get('ADMISSION_BURST', '60'))
+ADMISSION_MAX_LOOP_LAG_MS = float(os.environ.get('ADMISSION_MAX_LOOP_LAG_MS', '250'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '10'))  # seconds a request may wait for a slot
+ADMISSION_MAX_TRACKED_CLIENTS = 10000
+# Comma-separated proxy addresses or CIDR ranges whose X-Forwarded-For header is believed
+TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.environ.get('TRUSTED_PROXIES', '').split(',') if entry.strip()
+)
+
+# Path prefix -> (concurrent requests, requests allowed to wait); first match wins
+ROUTE_CONCURRENCY_LIMITS = [
+    ("/api/groups/bulk", 2, 4),
+    ("/api/import/", 2, 2),
+    ("/api/export/", 4, 4),
+    ("/api/", 64, 256),
+]
+
+# Engine control and diagnostics must keep working while everything else is shed
+ADMISSION_EXEMPT_PREFIXES = (
+    "/api/automation/start", "/api/automation/stop", "/api/automation/status", "/api/automation/config",
+    "/api/admin/", "/api/telegram/auth-jobs/", "/api/health/",
+)
+
+class LoopLagMonitor:
+    """Measures event-loop lag as how late a periodic sleep wakes up"""
+
+    def __init__(self, interval: float = 0.1, window: int = 600):
+        self.interval = interval
+        self.lag_ms = 0.0  # rises immediately, decays smoothly
+        self.samples: deque = deque(maxlen=window)
+        self.count = 0  # samples taken since start
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, loop.time() - started - self.interval) * 1000
+            self.samples.append(lag_ms)
+            self.count += 1
+            self.lag_ms = lag_ms if lag_ms > self.lag_ms else 0.8 * self.lag_ms + 0.2 * lag_ms
+
+class TokenBucketLimiter:
+    """Per-client token buckets, least recently seen clients evicted past a fixed count"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict = OrderedDict()  # key -> [tokens, updated_at]
+
+    def acquire(self, key: str) -> float:
+        """Take a token; returns 0 when allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+class RouteLimiter:
+    """Concurrency cap with a bounded wait queue for one group of routes"""
+
+    def __init__(self, limit: int, queue_depth: int):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.waiting = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked() and self.waiting >= self.queue_depth:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=ADMISSION_QUEUE_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self._semaphore.release()
+
+loop_lag_monitor = LoopLagMonitor()
+client_rate_limiter = TokenBucketLimiter(ADMISSION_RATE_PER_SECOND, ADMISSION_BURST, ADMISSION_MAX_TRACKED_CLIENTS)
+route_limiters = [(prefix, RouteLimiter(limit, depth)) for prefix, limit, depth in ROUTE_CONCURRENCY_LIMITS]
+register_memory_reporter('admission', lambda: {
+    "tracked_clients": len(client_rate_limiter._buckets),
+    "loop_lag_samples": len(loop_lag_monitor.samples),
+    "queued_requests": sum(limiter.waiting for _, limiter in route_limiters),
+})
+
+def _trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def _client_key(request: Request) -> str:
+    """The client's address; X-Forwarded-For only counts when a trusted proxy sent the request"""
+    host = request.client.host if request.client else 'unknown'
+    if _trusted_proxy(host):
+        # Each proxy appends the address it saw, so the client is the rightmost hop that is not a trusted proxy
+        for hop in reversed(request.headers.get('x-forwarded-for', '').split(',')):
+            if hop.strip():
+                host = hop.strip()
+                if not _trusted_proxy(host):
+                    break
+    return host
+
+def _overloaded(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    )
+
+@app.middleware("http")
+async def admission_control_middleware(request: Request, call_next):
+    """Shed load early: loop-lag circuit breaker, per-client token buckets, per-route concurrency caps"""
+    path = request.url.path
+    if request.method == "OPTIONS" or not path.startswith("/api/") or path.startswith(ADMISSION_EXEMPT_PREFIXES):
+        return await call_next(request)
+
+    if loop_lag_monitor.lag_ms > ADMISSION_MAX_LOOP_LAG_MS:
+        return _overloaded(503, "Server is overloaded. Please retry shortly.", 1)
+
+    wait = client_rate_limiter.acquire(_client_key(request))
+    if wait:
+        return _overloaded(429, "Too many requests. Please slow down.", wait)
+
+    limiter = next(limiter for prefix, limiter in route_limiters if path.startswith(prefix))
+    if not await limiter.acquire():
+        limiter.shed += 1
+        return _overloaded(503, "Too many concurrent requests for this endpoint. Please retry shortly.", 2)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        limiter.release()
+        raise
+
+    # Hold the slot until the body has been sent, so streamed exports count too
+    body = response.body_iterator
+
+    async def release_after_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            limiter.release()
+
+    response.body_iterator = release_after_body()
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -991,37 +4837,451 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# ========================== ENGINE LEASE ==========================
+
+ENGINE_LEASE_TTL = float(os.environ.get('ENGINE_LEASE_TTL', '30'))  # seconds a silent holder keeps the lease
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class Lease:
+    """A named lease in ``engine_lock`` held by at most one worker process at a time
+
+    The holder renews it well inside the TTL; when a holder dies, its lease
+    runs out and the next worker asking takes it over. Expiry is computed
+    with the server's clock, so workers on different hosts agree on it.
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.held = False
+
+    async def acquire(self) -> bool:
+        """Take the lease, or renew it if already ours; False while another live worker holds it"""
+        try:
+            document = await db.engine_lock.find_one_and_update(
+                {"_id": self.name, "$or": [{"holder": WORKER_ID}, {"$expr": {"$lt": ["$expires_at", "$$NOW"]}}]},
+                [{"$set": {"holder": WORKER_ID, "renewed_at": "$$NOW",
+                           "expires_at": {"$add": ["$$NOW", int(self.ttl * 1000)]}}}],
+                upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is someone else's, so the upsert collided with it
+            document = None
+        if self.held and not document:
+            logger.warning("Lost the %s lease to another worker", self.name)
+        self.held = document is not None
+        return self.held
+
+    async def release(self):
+        if self.held:
+            self.held = False
+            await db.engine_lock.delete_one({"_id": self.name, "holder": WORKER_ID})
+
+engine_lease = Lease("engine", ENGINE_LEASE_TTL)
+
+class EngineSupervisor:
+    """Keeps the engine running on exactly one worker: the lease holder, while automation is switched on
+
+    Every worker competes for the lease every third of its TTL, and at once
+    when the automation config changes, so a worker dying mid-cycle is
+    replaced within one TTL and picks up from the shared checkpoint.
+    """
+
+    def __init__(self, lease: Lease):
+        self.lease = lease
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def poke(self):
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def reconcile(self):
+        if not await self.lease.acquire():
+            if automation_engine.is_running:
+                # The new holder resumes from the checkpoint; ours would overwrite its progress
+                await automation_engine.stop(timeout=ENGINE_DRAIN_TIMEOUT)
+            return
+        if lifecycle.phase != "ready":
+            return
+        config = await get_automation_config()
+        if config.is_active and not automation_engine.is_running:
+            await automation_engine.restore_checkpoint()
+            automation_engine.start()
+        elif not config.is_active and not automation_engine.is_running and automation_engine.has_position:
+            # Switched off on another worker: the next start begins a fresh cycle
+            automation_engine.forget_position()
+            await automation_engine.checkpoint()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning("Engine lease check failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.lease.ttl / 3)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+engine_supervisor = EngineSupervisor(engine_lease)
+automation_config_store.subscribe(lambda _: engine_supervisor.poke())
+
+# ========================== TASK SCHEDULER ==========================
+
+SCHEDULER_CONCURRENCY = int(os.environ.get('SCHEDULER_CONCURRENCY', '2'))  # maintenance jobs running at once
+TASK_BLACKLIST_CLEANUP_INTERVAL = float(os.environ.get('TASK_BLACKLIST_CLEANUP_INTERVAL', '600'))  # seconds
+TASK_PREFLIGHT_INTERVAL = float(os.environ.get('TASK_PREFLIGHT_INTERVAL', '1800'))
+TASK_PROFILE_REFRESH_INTERVAL = float(os.environ.get('TASK_PROFILE_REFRESH_INTERVAL', str(PROFILE_CACHE_TTL)))
+TASK_ROLLUP_PRUNE_INTERVAL = float(os.environ.get('TASK_ROLLUP_PRUNE_INTERVAL', '3600'))
+
+class ScheduledTask:
+    """One periodic job and its run history"""
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: float, jitter: float,
+                 timeout: Optional[float], run_at_start: bool, single_instance: bool):
+        self.func = func
+        self.run_at_start = run_at_start
+        self.info = ScheduledTaskInfo(name=name, interval_seconds=interval, jitter=jitter, timeout_seconds=timeout,
+                                      single_instance=single_instance)
+        self.total_duration_ms = 0.0
+        self.current: Optional[asyncio.Task] = None
+        self.wake = asyncio.Event()
+
+    def next_delay(self) -> float:
+        """The interval spread by +/- jitter, so jobs registered together drift apart"""
+        return self.info.interval_seconds * random.uniform(1 - self.info.jitter, 1 + self.info.jitter)
+
+class TaskScheduler:
+    """Runs maintenance coroutines periodically, one instance per job and a few jobs at a time
+
+    Each job comes due every jittered interval whether or not its last run
+    finished; a run still going (or still waiting for one of the shared
+    slots) makes the next one be skipped rather than stacked. Runs are cut
+    off at their timeout, and a failed run is recorded and simply tried
+    again when the job next comes due. Single-instance jobs, the ones that
+    talk to Telegram, only run on the worker holding the engine lease.
+    """
+
+    def __init__(self, concurrency: int):
+        self.tasks: Dict[str, ScheduledTask] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+        self._loops: List[asyncio.Task] = []
+        self._stopping = False
+
+    def register(self, name: str, func: Callable[[], Any], interval: float, jitter: float = 0.1,
+                 timeout: Optional[float] = None, run_at_start: bool = False, single_instance: bool = False):
+        self.tasks[name] = ScheduledTask(name, func, interval, jitter, timeout, run_at_start, single_instance)
+
+    def start(self):
+        if not self._loops:
+            self._stopping = False
+            self._loops = [asyncio.create_task(self._loop(task)) for task in self.tasks.values()]
+
+    async def stop(self):
+        """Stop scheduling and cancel runs in progress"""
+        self._stopping = True
+        running = [task.current for task in self.tasks.values() if task.current]
+        for pending in self._loops + running:
+            pending.cancel()
+        await asyncio.gather(*self._loops, *running, return_exceptions=True)
+        self._loops = []
+
+    def trigger(self, name: str) -> bool:
+        """Run a job now instead of at its next slot; False when it is already running"""
+        task = self.tasks[name]
+        if task.info.running:
+            return False
+        task.wake.set()
+        return True
+
+    async def _loop(self, task: ScheduledTask):
+        # Without run_at_start, first runs are spread over one interval
+        delay = 0.0 if task.run_at_start else random.uniform(0, task.info.interval_seconds)
+        while True:
+            task.info.next_run_at = datetime.utcnow() + timedelta(seconds=delay)
+            try:
+                await asyncio.wait_for(task.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            # wait_for can swallow a cancel that lands as the wake-up fires
+            if self._stopping:
+                return
+            task.wake.clear()
+            if task.info.single_instance and not engine_lease.held:
+                pass  # The worker holding the lease runs it
+            elif task.info.running:
+                task.info.skipped += 1
+                logger.warning("Scheduled task %s is still running, skipping this run", task.info.name)
+            else:
+                task.info.running = True
+                task.current = asyncio.create_task(self._run(task))
+            delay = task.next_delay()
+
+    async def _run(self, task: ScheduledTask):
+        info = task.info
+        try:
+            async with self._slots:
+                info.last_started_at = datetime.utcnow()
+                started = time.perf_counter()
+                try:
+                    with trace_span(f"task.{info.name}", root=True):
+                        await asyncio.wait_for(task.func(), info.timeout_seconds)
+                except asyncio.TimeoutError:
+                    info.failures += 1
+                    info.last_error, info.last_error_at = f"Timed out after {info.timeout_seconds}s", datetime.utcnow()
+                    logger.warning("Scheduled task %s timed out after %ss", info.name, info.timeout_seconds)
+                except Exception as e:
+                    info.failures += 1
+                    info.last_error, info.last_error_at = str(e), datetime.utcnow()
+                    logger.exception("Scheduled task %s failed", info.name)
+                duration_ms = (time.perf_counter() - started) * 1000
+                info.runs += 1
+                task.total_duration_ms += duration_ms
+                info.last_duration_ms = duration_ms
+                info.avg_duration_ms = task.total_duration_ms / info.runs
+                info.max_duration_ms = max(info.max_duration_ms or 0.0, duration_ms)
+        finally:
+            info.running = False
+            task.current = None
+
+task_scheduler = TaskScheduler(SCHEDULER_CONCURRENCY)
+task_scheduler.register("blacklist_cleanup", cleanup_expired_blacklists, TASK_BLACKLIST_CLEANUP_INTERVAL,
+                        timeout=60, run_at_start=True)
+task_scheduler.register("group_preflight", run_group_preflight, TASK_PREFLIGHT_INTERVAL, timeout=TASK_PREFLIGHT_INTERVAL,
+                        single_instance=True)
+task_scheduler.register("profile_refresh", lambda: profile_cache.refresh_if_stale(), TASK_PROFILE_REFRESH_INTERVAL,
+                        timeout=60, single_instance=True)
+task_scheduler.register("hourly_rollup_prune", prune_hourly_rollups, TASK_ROLLUP_PRUNE_INTERVAL, timeout=300)
+
+@api_router.get("/admin/tasks", response_model=List[ScheduledTaskInfo], dependencies=[Depends(require_admin)])
+async def list_scheduled_tasks():
+    """Maintenance jobs with their last run, next run, durations and errors"""
+    return [task.info for task in task_scheduler.tasks.values()]
+
+@api_router.post("/admin/tasks/{name}/run", response_model=ScheduledTaskInfo, dependencies=[Depends(require_admin)])
+async def run_scheduled_task(name: str):
+    """Run a maintenance job now; its regular schedule continues from there"""
+    if name not in task_scheduler.tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task_scheduler.tasks[name].info.single_instance and not engine_lease.held:
+        raise HTTPException(status_code=409, detail="Task runs on the worker holding the engine lease")
+    if not task_scheduler.trigger(name):
+        raise HTTPException(status_code=409, detail="Task is already running")
+    return task_scheduler.tasks[name].info
+
+# ========================== LIFECYCLE ==========================
+
+ENGINE_WARMUP_TIMEOUT = float(os.environ.get('ENGINE_WARMUP_TIMEOUT', '30'))  # seconds allowed for the Telegram connection
+
+class Lifecycle:
+    """Process phase reported by the readiness probe: starting, ready or draining"""
+
+    def __init__(self):
+        self.phase = "starting"
+        self.warmup: Dict[str, str] = {}
+        self.task: Optional[asyncio.Task] = None
+
+lifecycle = Lifecycle()
+
+async def warm_up():
+    """Load caches and the engine checkpoint, connect Telegram if this worker holds the lease, then report ready"""
+    async def step(name: str, work):
+        try:
+            await work
+            lifecycle.warmup[name] = "ok"
+        except Exception as e:
+            lifecycle.warmup[name] = f"failed: {e}"
+            logger.warning("Warm-up step %s failed: %s", name, e)
+
+    await step("profile_cache", profile_cache.get())
+    await step("engine_checkpoint", automation_engine.restore_checkpoint())
+
+    held = False
+    try:
+        held = await engine_lease.acquire()
+    except PyMongoError as e:
+        lifecycle.warmup["engine_lease"] = f"failed: {e}"
+        logger.warning("Warm-up step engine_lease failed: %s", e)
+
+    # Only the lease holder talks to Telegram; a worker taking the lease over later connects then
+    if held:
+        telegram_config = await get_telegram_config()
+        live_client = None
+        if telegram_config and telegram_config.is_authenticated:
+            connect = asyncio.wait_for(get_connected_client(), ENGINE_WARMUP_TIMEOUT)
+            await step("telegram_client", connect)
+            live_client = telegram_clients.get('live')
+
+        automation_config = await get_automation_config()
+        if automation_config.is_active:
+            await step("engine_working_set", automation_engine.sync(live_client.session if live_client else None))
+
+    lifecycle.phase = "ready"
+    # Resume sending if automation was left switched on and this worker holds the lease
+    engine_supervisor.poke()
+    logger.info("Warm-up finished: %s", lifecycle.warmup)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize application on startup"""
     logger.info("Starting Telegram Automation System v2.0...")
     
+    # Documents are keyed by their string id; the old secondary ``id`` indexes go away
+    await migrate_ids_to_primary_key()
+    
     # Initialize indexes
-    await db.telegram_config.create_index("id", unique=True)
-    await db.message_templates.create_index("id", unique=True)
-    await db.group_targets.create_index("id", unique=True)
-    await db.blacklist.create_index("id", unique=True)
-    await db.automation_config.create_index("id", unique=True)
+    await db.group_targets.create_index([("is_active", 1), ("preflight.checked_at", 1)])
+    await db.group_targets.create_index("group_identifier")
+    await db.temp_auth.create_index("phone_number")
+    await db.blacklist.create_index([("blacklist_type", 1), ("expires_at", 1)])
+    await db.blacklist.create_index("group_id")
+    await db.telegram_config.create_index("phone_number")
+    await db.telegram_entities.create_index("session")
+    await db.auth_jobs.create_index("expires_at", expireAfterSeconds=0)
+    
+    # Engine sync reads changes by watermark and deletions from short-lived tombstones
+    await db.group_targets.create_index("updated_at")
+    await db.message_templates.create_index("updated_at")
+    await db.tombstones.create_index([("collection", 1), ("deleted_at", 1)])
+    await db.tombstones.create_index("deleted_at", expireAfterSeconds=TOMBSTONE_TTL_DAYS * 86400)
     
-    # Clean up expired blacklists on startup
-    await cleanup_expired_blacklists()
+    # Raw send events go to a time-series collection; stats read the rollups beside it
+    await ensure_send_log_collection()
+    await db.send_rollups.create_index([("scope", 1), ("period", 1)])
+    await db.send_rollups.create_index("period", expireAfterSeconds=SEND_ROLLUP_TTL_DAYS * 86400)
+    
+    # Leases of workers that died are cleared out; live ones are renewed long before
+    await db.engine_lock.create_index("expires_at", expireAfterSeconds=0)
+    
+    # Create the default automation config once, then keep it in memory for the engine
+    await automation_config_store.reload()
+    
+    loop_lag_monitor.start()
+    invalidation_bus.start()
+    send_writer.start()
+    engine_supervisor.start()
+    
+    # Periodic maintenance, starting with a blacklist cleanup right away
+    task_scheduler.start()
+    
+    # Serve requests right away; the readiness probe turns green once warm-up is done
+    lifecycle.task = asyncio.create_task(warm_up())
     
     logger.info("Telegram Automation System v2.0 started successfully!")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    """Clean up on shutdown"""
-    # Disconnect all telegram clients
-    for client in telegram_clients.values():
-        if client.is_connected():
-            await client.disconnect()
+    """Drain the engine, checkpoint it and close Telegram and Mongo connections"""
+    lifecycle.phase = "draining"
+    if lifecycle.task and not lifecycle.task.done():
+        lifecycle.task.cancel()
+    
+    # Let the send in flight finish, then save where the cycle stopped
+    await engine_supervisor.stop()
+    await automation_engine.stop(timeout=ENGINE_DRAIN_TIMEOUT)
+    try:
+        await automation_engine.checkpoint()
+    except Exception as e:
+        logger.error("Failed to checkpoint engine state: %s", e)
+    # Whatever the checkpoint could not write stays buffered; this is the last try
+    await send_writer.stop()
+    # Another worker can take over the engine right away instead of after the TTL
+    try:
+        await engine_lease.release()
+    except Exception as e:
+        logger.error("Failed to release the engine lease: %s", e)
+    await task_scheduler.stop()
+    await loop_lag_monitor.stop()
+    await invalidation_bus.stop()
+    
+    # Disconnect all telegram clients, persisting their entity caches
+    for telegram_client in telegram_clients.values():
+        if telegram_client.is_connected():
+            await telegram_client.disconnect()
+        if isinstance(telegram_client.session, MongoSession):
+            await telegram_client.session.flush()
     
-    client.close()
-    logger.info("Telegram Automation System v2.0 shut down successfully!")
\ No newline at end of file
+    mongo_client.close()
+    logger.info("Telegram Automation System v2.0 shut down successfully!")
+    
+    # Drain queued traces and log records before the process exits
+    if trace_listener:
+        trace_listener.stop()
+    log_listener.stop()
+
+# ========================== COMMAND LINE ==========================
+
+async def _write_snapshot_file(output: Path):
+    with open(output, 'wb') as archive_file:
+        async for chunk in iter_snapshot_archive():
+            archive_file.write(chunk)
+    logger.info("Snapshot written to %s", output)
+
+async def _print_read_routing():
+    """Show which member answers each read route
+
+    To check routing locally, start three ``mongod --replSet rs0`` members on
+    ports 27017-27019, run ``rs.initiate()`` with all three once, set
+    ``MONGO_URL=mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0``
+    and ``MONGO_READ_PREFERENCE_BROWSE=secondaryPreferred``; the browse route
+    should then report a secondary.
+    """
+    for route, database in [("primary", db), *read_db.items()]:
+        hello = await database.command("hello", read_preference=database.read_preference)
+        member = "secondary" if hello.get("secondary") else "primary" if hello.get("isWritablePrimary") else "standalone"
+        # A standalone server does not report ``me``; the client then talks to that one host
+        host = hello.get("me") or "%s:%s" % database.client.address
+        print(f"{route:8} {database.read_preference.mongos_mode:20} -> {host} ({member})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Telegram Automation System maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = commands.add_parser("snapshot", help="Write all collections to a compressed archive")
+    snapshot_parser.add_argument("--output", type=Path, default=Path(f"snapshot-{datetime.utcnow():%Y%m%dT%H%M%SZ}.zip"))
+
+    restore_parser = commands.add_parser("restore", help="Load collections from a snapshot archive")
+    restore_parser.add_argument("archive", type=Path)
+    restore_parser.add_argument("--keep-existing", action="store_true", help="Insert alongside existing documents instead of replacing them")
+
+    commands.add_parser("audit-queries", help="Explain the registered hot queries; exits 1 if any is flagged")
+    commands.add_parser("rebuild-rollups", help="Recompute the send statistics rollups for the periods the send log covers")
+    commands.add_parser("read-routing", help="Show which replica set member serves each read route")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "snapshot":
+            asyncio.run(_write_snapshot_file(args.output))
+        elif args.command == "restore":
+            asyncio.run(restore_snapshot(args.archive, replace_existing=not args.keep_existing))
+        elif args.command == "audit-queries":
+            results = asyncio.run(run_query_audit())
+            for result in results:
+                status = "FLAGGED" if result.flagged else "ok"
+                print(f"{status:8} {result.collection}: {result.name} - {'>'.join(result.stages) or result.error} "
+                      f"(examined {result.docs_examined} docs / {result.keys_examined} keys, returned {result.returned})")
+            if any(result.flagged for result in results):
+                sys.exit(1)
+        elif args.command == "rebuild-rollups":
+            asyncio.run(rebuild_send_rollups())
+        elif args.command == "read-routing":
+            asyncio.run(_print_read_routing())
+    finally:
+        mongo_client.close()
+        if trace_listener:
+            trace_listener.stop()
+        log_listener.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmark Suite
+Measures in-process data structures of the backend without a database or Telegram connection
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+# server.py reads these at import time; nothing connects until a request is made
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+os.environ.setdefault("TRACE_ENABLED", "false")
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import numpy as np  # noqa: E402
+
+from server import (  # noqa: E402
+    AutomationConfig, GroupPreflight, GroupRegistry, GroupTarget, GROUP_ACTIVE, GROUP_BLACKLISTED, project_schedule,
+)
+
+
+def measure(build):
+    """Return (result, bytes allocated, seconds) for building a structure"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def timed(fn, repeat=5):
+    """Best wall time over a few runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def fake_groups(count):
+    for index in range(count):
+        yield (
+            str(uuid.uuid4()),
+            f"Group {index}",
+            f"@group_{index}",
+            -1000000000000 - index,
+            random.getrandbits(63),
+        )
+
+
+class BackendBenchmark:
+    def __init__(self, groups):
+        self.groups = groups
+        self.rows = list(fake_groups(groups))
+        self.results = []
+
+    def report(self, name, value):
+        print(f"📊 {name}: {value}")
+        self.results.append((name, value))
+
+    def bench_group_registry(self):
+        """Memory per group and scan cost: GroupTarget models vs GroupRegistry"""
+        n = self.groups
+
+        def build_models():
+            return [
+                GroupTarget(id=group_id, group_identifier=identifier, parsed_name=name, group_type="username",
+                            resolved_id=str(peer_id), preflight=GroupPreflight(is_member=True, can_send=True))
+                for group_id, name, identifier, peer_id, _ in self.rows
+            ]
+
+        def build_registry():
+            registry = GroupRegistry()
+            for group_id, name, identifier, peer_id, access_hash in self.rows:
+                registry.upsert(group_id, name, identifier, peer_id, access_hash)
+            return registry
+
+        models, model_bytes, model_seconds = measure(build_models)
+        registry, registry_bytes, registry_seconds = measure(build_registry)
+
+        # Blacklist one group in ten so the scan has something to skip
+        for slot in range(0, n, 10):
+            registry.set_flag(slot, GROUP_BLACKLISTED)
+        blacklisted = {models[slot].id for slot in range(0, n, 10)}
+        lookup_ids = random.sample(registry.ids, min(n, 10000))
+
+        self.report(f"GroupTarget models ({n} groups)", f"{model_bytes / n:.0f} B/group, built in {model_seconds:.3f}s")
+        self.report(f"GroupRegistry ({n} groups)", f"{registry_bytes / n:.0f} B/group, built in {registry_seconds:.3f}s")
+        self.report("GroupRegistry.nbytes()", f"{registry.nbytes() / n:.0f} B/group")
+        self.report("Eligible scan, models",
+                    f"{timed(lambda: [g for g in models if g.is_active and g.id not in blacklisted]) * 1000:.2f} ms")
+        self.report("Eligible scan, registry", f"{timed(registry.eligible) * 1000:.2f} ms")
+        self.report(f"Lookup by id x{len(lookup_ids)}, registry",
+                    f"{timed(lambda: [registry.slot(group_id) for group_id in lookup_ids]) * 1000:.2f} ms")
+        assert len(registry.eligible()) == sum(1 for flags in registry.flags if flags == GROUP_ACTIVE)
+
+    def bench_schedule_projection(self):
+        """Closed-form cycle projection: a worked example, then its cost at full size"""
+        config = AutomationConfig(message_delay_min=6, message_delay_max=10, cycle_delay_min=1, cycle_delay_max=1)
+        # Free, delayed past the first cycle, free: the delayed group does not push back the third
+        projection = project_schedule(config, np.array([0.0, 60.0, 0.0]), send_latency=0.0)
+        assert projection["sends"] == 2
+        assert projection["duration"]["mean"] == 8.0
+        assert projection["period"] == 3608.0
+        assert projection["cycles_ahead"].tolist() == [0.0, 1.0, 0.0]
+        # In the next cycle the first free group is sent again before it
+        assert projection["next_send"].tolist() == [0.0, 3616.0, 8.0]
+        # Delayed groups take their place among every group sent in their cycle
+        projection = project_schedule(config, np.array([60.0, 0.0, 60.0]), send_latency=1.0)
+        assert projection["period"] == 3601.0
+        assert projection["next_send"].tolist() == [3601.0, 0.0, 3601.0 + 18.0]
+        # Free groups ahead of a delayed one, and a later cycle lengthened by the group that joined before it
+        projection = project_schedule(config, np.array([0.0, 0.0, 0.0, 60.0]), send_latency=0.0)
+        assert projection["next_send"].tolist() == [0.0, 8.0, 16.0, 3616.0 + 24.0]
+        projection = project_schedule(config, np.array([0.0, 60.0, 5000.0]), send_latency=0.0)
+        assert projection["cycles_ahead"].tolist() == [0.0, 1.0, 2.0]
+        assert projection["next_send"].tolist() == [0.0, 3600.0 + 8.0, 3600.0 + 3608.0 + 16.0]
+
+        n = self.groups
+        window_ends = np.where(np.random.random(n) < 0.1, np.random.uniform(0, 86400, n), 0.0)
+        self.report(f"Schedule projection ({n} groups)",
+                    f"{timed(lambda: project_schedule(config, window_ends, 0.5)) * 1000:.2f} ms")
+
+    def run_all(self):
+        print(f"🚀 Backend benchmarks ({self.groups} groups)")
+        print("=" * 60)
+        self.bench_group_registry()
+        self.bench_schedule_projection()
+        print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--groups", type=int, default=100000)
+    args = parser.parse_args()
+    BackendBenchmark(args.groups).run_all()
+
+
+if __name__ == "__main__":
+    main()
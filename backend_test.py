@@ -205,6 +205,74 @@ class BackendTester:
             self.log_test("Bulk Groups Import", False, f"Exception: {str(e)}")
             return False
     
+    def test_bulk_groups_preview(self):
+        """Test POST /api/groups/bulk/preview dry run"""
+        try:
+            lines = "@previewtest1\nhttps://t.me/previewtest2\n@previewtest1\nnot a group\n\n-1001111111111\n"
+            response = self.session.post(f"{BASE_URL}/groups/bulk/preview", data=lines,
+                                         headers={"Content-Type": "text/plain"})
+            
+            if response.status_code == 200:
+                preview = response.json()
+                if preview.get("duplicates") == 1 and preview.get("invalid") == 1 and preview.get("blank") == 1:
+                    self.log_test("Bulk Groups Preview", True,
+                                  f"New: {preview.get('new')}, existing: {preview.get('existing')}")
+                    return True
+                else:
+                    self.log_test("Bulk Groups Preview", False, f"Unexpected counts: {preview}")
+                    return False
+            else:
+                self.log_test("Bulk Groups Preview", False, f"HTTP {response.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("Bulk Groups Preview", False, f"Exception: {str(e)}")
+            return False
+    
+    def test_readiness_probe(self):
+        """Test GET /api/health/live and /api/health/ready endpoints"""
+        try:
+            live = self.session.get(f"{BASE_URL}/health/live")
+            ready = self.session.get(f"{BASE_URL}/health/ready")
+            
+            if live.status_code != 200:
+                self.log_test("Health Probes", False, f"Liveness HTTP {live.status_code}")
+                return False
+            if ready.status_code in (200, 503) and "status" in ready.json():
+                self.log_test("Health Probes", True, f"Readiness: {ready.json().get('status')}")
+                return True
+            else:
+                self.log_test("Health Probes", False, f"Readiness HTTP {ready.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("Health Probes", False, f"Exception: {str(e)}")
+            return False
+    
+    def test_group_preflight_status(self):
+        """Test GET /api/groups/preflight endpoint"""
+        try:
+            response = self.session.get(f"{BASE_URL}/groups/preflight")
+            
+            if response.status_code == 200:
+                data = response.json()
+                required_fields = ["is_running", "total", "checked", "usable", "unusable"]
+                missing_fields = [field for field in required_fields if field not in data]
+                
+                if not missing_fields:
+                    self.log_test("GET Group Preflight Status", True, f"Checked: {data.get('checked')}/{data.get('total')}")
+                    return True
+                else:
+                    self.log_test("GET Group Preflight Status", False, f"Missing fields: {missing_fields}")
+                    return False
+            else:
+                self.log_test("GET Group Preflight Status", False, f"HTTP {response.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("GET Group Preflight Status", False, f"Exception: {str(e)}")
+            return False
+    
     def test_messages_endpoints(self):
         """Test Message Templates CRUD endpoints"""
         # Test GET /api/messages
@@ -365,6 +433,27 @@ class BackendTester:
             self.log_test("POST Automation Stop", False, f"Exception: {str(e)}")
             return False
     
+    def test_send_statistics(self):
+        """Test GET /api/stats/sends/* rollup endpoints"""
+        try:
+            today = self.session.get(f"{BASE_URL}/stats/sends/today")
+            daily = self.session.get(f"{BASE_URL}/stats/sends/daily", params={"days": 7})
+            groups = self.session.get(f"{BASE_URL}/stats/sends/groups")
+            
+            if today.status_code != 200 or "sent" not in today.json():
+                self.log_test("Send Statistics", False, f"Today HTTP {today.status_code}")
+                return False
+            if daily.status_code == 200 and len(daily.json()) == 7 and groups.status_code == 200:
+                self.log_test("Send Statistics", True, f"Sent today: {today.json().get('sent')}")
+                return True
+            else:
+                self.log_test("Send Statistics", False, f"Daily HTTP {daily.status_code}, groups HTTP {groups.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("Send Statistics", False, f"Exception: {str(e)}")
+            return False
+    
     def test_telegram_logout(self):
         """Test POST /api/telegram/logout endpoint"""
         try:
@@ -395,6 +484,14 @@ class BackendTester:
             if response.status_code in [400, 404]:
                 # Expected to fail without valid config
                 self.log_test("POST Send Code", True, "Correctly handles missing/invalid config")
+            elif response.status_code == 202 and "id" in response.json():
+                # Config exists: the Telegram call runs as a background job
+                job = self.session.get(f"{BASE_URL}/telegram/auth-jobs/{response.json()['id']}")
+                if job.status_code == 200 and job.json().get("operation") == "send_code":
+                    self.log_test("POST Send Code", True, f"Auth job queued, status: {job.json().get('status')}")
+                else:
+                    self.log_test("POST Send Code", False, f"Auth job not pollable: HTTP {job.status_code}")
+                    return False
             else:
                 self.log_test("POST Send Code", False, f"Unexpected HTTP {response.status_code}")
                 return False
@@ -420,6 +517,57 @@ class BackendTester:
             self.log_test("POST Verify Code", False, f"Exception: {str(e)}")
             return False
     
+    def test_export_endpoints(self):
+        """Test streaming export endpoints"""
+        # Test GET /api/export/groups as NDJSON
+        try:
+            response = self.session.get(f"{BASE_URL}/export/groups")
+            
+            if response.status_code == 200:
+                lines = [line for line in response.text.splitlines() if line.strip()]
+                records = [json.loads(line) for line in lines]
+                if all("group_identifier" in record for record in records):
+                    self.log_test("GET Export Groups NDJSON", True, f"Exported {len(records)} groups")
+                else:
+                    self.log_test("GET Export Groups NDJSON", False, "Invalid record structure")
+                    return False
+            else:
+                self.log_test("GET Export Groups NDJSON", False, f"HTTP {response.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("GET Export Groups NDJSON", False, f"Exception: {str(e)}")
+            return False
+        
+        # Test GET /api/export/templates as gzip-compressed CSV
+        try:
+            response = self.session.get(f"{BASE_URL}/export/templates", params={"format": "csv", "gzip": "true"})
+            
+            if response.status_code == 200 and response.content[:2] == b"\x1f\x8b":
+                self.log_test("GET Export Templates CSV (gzip)", True, f"{len(response.content)} compressed bytes")
+            else:
+                self.log_test("GET Export Templates CSV (gzip)", False, f"HTTP {response.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("GET Export Templates CSV (gzip)", False, f"Exception: {str(e)}")
+            return False
+        
+        # Test unknown collection is rejected
+        try:
+            response = self.session.get(f"{BASE_URL}/export/not_a_collection")
+            
+            if response.status_code == 404:
+                self.log_test("GET Export Unknown Collection", True, "Correctly rejected")
+                return True
+            else:
+                self.log_test("GET Export Unknown Collection", False, f"Unexpected HTTP {response.status_code}")
+                return False
+                
+        except Exception as e:
+            self.log_test("GET Export Unknown Collection", False, f"Exception: {str(e)}")
+            return False
+    
     def run_all_tests(self):
         """Run all backend API tests"""
         print("🚀 BACKEND API REGRESSION TESTING STARTED")
@@ -428,6 +576,7 @@ class BackendTester:
         
         # Core API tests
         self.test_api_health_check()
+        self.test_readiness_probe()
         self.test_telegram_status()
         
         # Configuration tests
@@ -436,11 +585,17 @@ class BackendTester:
         # CRUD operations tests
         self.test_groups_endpoints()
         self.test_bulk_groups_import()
+        self.test_bulk_groups_preview()
+        self.test_group_preflight_status()
         self.test_messages_endpoints()
         
+        # Data export tests
+        self.test_export_endpoints()
+        
         # Automation tests
         self.test_automation_config()
         self.test_automation_status_endpoints()
+        self.test_send_statistics()
         
         # Authentication and logout tests
         self.test_authentication_endpoints()
@@ -19,6 +19,20 @@ const TelegramSetup = ({ onAuthSuccess }) => {
     setTimeout(() => setNotification({ type: '', message: '' }), 5000);
   };
 
+  // Auth endpoints return a background job; poll it until it finishes
+  const waitForAuthJob = async (job) => {
+    while (job.status !== 'succeeded' && job.status !== 'failed') {
+      await new Promise(resolve => setTimeout(resolve, 500));
+      job = (await axios.get(`/telegram/auth-jobs/${job.id}`)).data;
+    }
+    if (job.status === 'failed') {
+      const error = new Error(job.error);
+      error.response = { status: job.status_code, data: { detail: job.error } };
+      throw error;
+    }
+    return { data: job.result };
+  };
+
   const handleConfigSubmit = async (e) => {
     e.preventDefault();
     setLoading(true);
@@ -29,9 +43,9 @@ const TelegramSetup = ({ onAuthSuccess }) => {
       await axios.post('/telegram/config', formData);
       
       // Send verification code
-      const response = await axios.post('/telegram/send-code', {
+      const response = await waitForAuthJob((await axios.post('/telegram/send-code', {
         phone_number: formData.phone_number
-      });
+      })).data);
 
       if (response.data.success) {
         setStep(2);
@@ -53,9 +67,9 @@ const TelegramSetup = ({ onAuthSuccess }) => {
     setError('');
 
     try {
-      const response = await axios.post('/telegram/verify-code', {
+      const response = await waitForAuthJob((await axios.post('/telegram/verify-code', {
         code: verificationCode
-      });
+      })).data);
 
       if (response.data.success) {
         if (response.data.requires_2fa) {
@@ -85,9 +99,9 @@ const TelegramSetup = ({ onAuthSuccess }) => {
     setError('');
 
     try {
-      const response = await axios.post('/telegram/verify-2fa', {
+      const response = await waitForAuthJob((await axios.post('/telegram/verify-2fa', {
         password: twoFactorPassword
-      });
+      })).data);
 
       if (response.data.success) {
         showNotification('success', 'Two-factor authentication successful!');